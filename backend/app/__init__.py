@@ -30,16 +30,95 @@ class Config:
 
     # Security/Session (if used later)
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
+    # Lifetime of the bearer tokens issued by /login
+    SESSION_TOKEN_MAX_AGE_SECONDS = int(os.getenv("SESSION_TOKEN_MAX_AGE_SECONDS", "3600"))
 
     # Logging
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
     LOG_DIR = os.getenv("LOG_DIR", "logs")
+    # Queue + background writer, JSON records, payload sampling; see app/log_pipeline.py
+    LOG_ASYNC = os.getenv("LOG_ASYNC", "1")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_REQUESTS = os.getenv("LOG_REQUESTS", "1")
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+    LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+    LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "4000"))
 
     # OpenRouter / LLM provider
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
     OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
     OPENROUTER_HTTP_REFERER = os.getenv("OPENROUTER_HTTP_REFERER", "http://localhost:5000")
     OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "anthropic/claude-3-sonnet")
+    # Seconds (or "p95") to wait on the primary model before also firing the fallback; unset = sequential
+    OPENROUTER_HEDGE_DELAY = os.getenv("OPENROUTER_HEDGE_DELAY")
+
+    # Per-model circuit breakers (see app/circuit_breaker.py); state is reported on /api/health
+    LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60"))
+    LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+    LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+    LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+    # Calls slower than this count as failures; empty disables
+    LLM_BREAKER_SLOW_CALL_SECONDS = os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "15")
+
+    # Redis (shared caches across gunicorn workers)
+    REDIS_URL = os.getenv("REDIS_URL")
+
+    # Fraud verdict cache for retried /check-fraud requests: memory, redis or none
+    VERDICT_CACHE_BACKEND = os.getenv("VERDICT_CACHE_BACKEND", "memory")
+    VERDICT_CACHE_TTL_SECONDS = int(os.getenv("VERDICT_CACHE_TTL_SECONDS", "600"))
+    VERDICT_CACHE_MAX_ENTRIES = int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "10000"))
+
+    # /ask-ai answers keyed by the normalized question: memory, redis or none
+    AI_ANSWER_CACHE_BACKEND = os.getenv("AI_ANSWER_CACHE_BACKEND", "memory")
+    AI_ANSWER_CACHE_TTL_SECONDS = int(os.getenv("AI_ANSWER_CACHE_TTL_SECONDS", "3600"))
+    AI_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("AI_ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+    # Daraja OAuth token shared by requests (memory) or by all workers (redis); see app/mpesa/token_cache.py
+    MPESA_TOKEN_CACHE_BACKEND = os.getenv("MPESA_TOKEN_CACHE_BACKEND", "memory")
+    MPESA_TOKEN_REFRESH_MARGIN = int(os.getenv("MPESA_TOKEN_REFRESH_MARGIN", "60"))
+
+    # STK callbacks: queue (store and acknowledge, applied by a consumer) or sync; see app/mpesa/callback_queue.py
+    MPESA_CALLBACK_MODE = os.getenv("MPESA_CALLBACK_MODE", "queue")
+    MPESA_CALLBACK_CONSUMER = os.getenv("MPESA_CALLBACK_CONSUMER", "thread")  # thread|none
+    MPESA_CALLBACK_BATCH_SIZE = int(os.getenv("MPESA_CALLBACK_BATCH_SIZE", "100"))
+    MPESA_CALLBACK_POLL_SECONDS = float(os.getenv("MPESA_CALLBACK_POLL_SECONDS", "5"))
+    MPESA_CALLBACK_MAX_ATTEMPTS = int(os.getenv("MPESA_CALLBACK_MAX_ATTEMPTS", "5"))
+
+    # Daraja status queries for pending STK pushes whose callback never came; see app/mpesa/reconciler.py
+    MPESA_RECONCILER = os.getenv("MPESA_RECONCILER", "none")  # none|thread
+    MPESA_RECONCILE_INTERVAL_SECONDS = float(os.getenv("MPESA_RECONCILE_INTERVAL_SECONDS", "60"))
+    MPESA_RECONCILE_MIN_AGE_SECONDS = float(os.getenv("MPESA_RECONCILE_MIN_AGE_SECONDS", "120"))
+    MPESA_RECONCILE_CHUNK_SIZE = int(os.getenv("MPESA_RECONCILE_CHUNK_SIZE", "100"))
+    MPESA_RECONCILE_CONCURRENCY = int(os.getenv("MPESA_RECONCILE_CONCURRENCY", "4"))
+    MPESA_RECONCILE_RATE_PER_SECOND = float(os.getenv("MPESA_RECONCILE_RATE_PER_SECOND", "5"))
+
+    # /metrics: memory (per worker) or redis (totals across gunicorn workers, the default when
+    # REDIS_URL is set); see app/metrics.py
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1")
+    METRICS_BACKEND = os.getenv("METRICS_BACKEND", "redis" if REDIS_URL else "memory")
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+    # ASGI mode (asgi.py, see app/asgi.py): threads for DB work around the awaited
+    # model calls, and for requests handed to the Flask app
+    ASYNC_DB_THREADS = int(os.getenv("ASYNC_DB_THREADS", "8"))
+    ASYNC_WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", "8"))
+
+    # POST /check-fraud/batch limits
+    FRAUD_BATCH_MAX_ITEMS = int(os.getenv("FRAUD_BATCH_MAX_ITEMS", "500"))
+    FRAUD_BATCH_MAX_WORKERS = int(os.getenv("FRAUD_BATCH_MAX_WORKERS", "4"))
+
+    # Background jobs for asynchronous /check-fraud (see app/jobs.py)
+    JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")  # memory|redis
+    JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "2"))
+    JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", "100"))
+    JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+    JOB_WEBHOOK_ALLOWED_HOSTS = os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "")  # comma-separated; empty allows none
+
+    # Fraud pre-scoring: risk scores below LOW are cleared locally, scores at or
+    # above HIGH are flagged locally, everything in between goes to the LLM
+    FRAUD_PRESCORE_LOW = float(os.getenv("FRAUD_PRESCORE_LOW", "0.3"))
+    FRAUD_PRESCORE_HIGH = float(os.getenv("FRAUD_PRESCORE_HIGH", "0.8"))
 
 
 class DevelopmentConfig(Config):
@@ -51,6 +130,8 @@ class TestingConfig(Config):
     TESTING = True
     ENV = "testing"
     SQLALCHEMY_DATABASE_URI = os.getenv("TEST_DATABASE_URI", "sqlite:///:memory:")
+    # Tests never reach a Redis server, even when REDIS_URL is set in the environment
+    METRICS_BACKEND = "memory"
 
 
 class ProductionConfig(Config):
@@ -104,6 +185,14 @@ def create_app(config_name: str | None = None) -> Flask:
     # Logging
     _setup_logging(app)
 
+    # Per-request DB time (Server-Timing header)
+    from . import db_timing
+    db_timing.init_app(app)
+
+    # Prometheus metrics at /metrics
+    from . import metrics
+    metrics.init_app(app)
+
     # Add a root route to redirect to the API health check
     @app.route("/", methods=["GET"])
     def index():
@@ -112,6 +201,28 @@ def create_app(config_name: str | None = None) -> Flask:
     return app
 
 
+def start_background_workers(app: Flask) -> None:
+    """Start the threads a serving process runs next to its requests.
+
+    Called by the server entry points (wsgi.py, asgi.py, run.py's server
+    run), not by create_app, so CLI commands and migrations never claim
+    queued callbacks or query Daraja while they run.
+    """
+    if app.config.get("TESTING"):
+        return
+
+    # Queued STK callbacks are applied from startup, so rows left by a restart and
+    # retries due after backoff do not wait for the next callback to arrive
+    if app.config.get("MPESA_CALLBACK_MODE", "queue") == "queue":
+        from .mpesa.callback_queue import get_callback_consumer
+        get_callback_consumer(app)
+
+    # Background reconciliation of pending STK pushes (single-process deployments)
+    if app.config.get("MPESA_RECONCILER") == "thread":
+        from .mpesa.reconciler import get_reconciler
+        get_reconciler(app).start()
+
+
 def _setup_cors(app: Flask) -> None:
     origins = app.config.get("CORS_ORIGINS", "*")
     if isinstance(origins, str) and origins != "*":
@@ -179,26 +290,24 @@ def _setup_logging(app: Flask) -> None:
         # Fallback to stdout only if directory cannot be created
         pass
 
+    handlers = []
     # Rotating file handler
     log_path = os.path.join(log_dir, "app.log")
     try:
-        file_handler = RotatingFileHandler(log_path, maxBytes=2 * 1024 * 1024, backupCount=5)
-        file_handler.setLevel(log_level)
-        file_formatter = logging.Formatter(
-            "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-        )
-        file_handler.setFormatter(file_formatter)
-        app.logger.addHandler(file_handler)
+        handlers.append(RotatingFileHandler(log_path, maxBytes=2 * 1024 * 1024, backupCount=5))
     except Exception:
         # If file handler fails, continue with stream handler only
         pass
 
     # Stream handler (stdout)
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(log_level)
-    stream_formatter = logging.Formatter("%(levelname)s | %(message)s")
-    stream_handler.setFormatter(stream_formatter)
-    app.logger.addHandler(stream_handler)
+    handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setLevel(log_level)
+
+    # Written by a background thread, as JSON lines with the request id (see app/log_pipeline.py)
+    from . import log_pipeline
+    log_pipeline.setup_logging(app, handlers)
+    log_pipeline.init_app(app)
 
 
 # Convenience import for models so migrations and shell can access db/models directly
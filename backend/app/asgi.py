@@ -0,0 +1,278 @@
+"""
+ASGI serving mode for the LLM-bound endpoints.
+
+Under gunicorn every request holds a thread for its whole life, so a worker
+with 2 threads waiting on OpenRouter serves 2 requests at a time. Behind an
+ASGI server these routes instead await the model call on the event loop:
+
+    POST /api/check-fraud     (synchronous checks; "async": true still queues a job)
+    POST /api/ask-ai
+    POST /api/mpesa-max
+
+Only the DB work before and after the call runs on a thread, in a small pool
+(ASYNC_DB_THREADS) and inside a Flask request context, so it uses the same
+helpers, sessions and after_request hooks (CORS, Server-Timing, X-Request-ID
+and the per-request log record) as the Flask routes. One worker can then hold as many model calls in flight as
+ASYNC_HTTP_MAX_CONNECTIONS allows (see app/async_http.py).
+
+Every other request is passed to the Flask app unchanged on a second pool
+(ASYNC_WSGI_THREADS); streamed bodies such as /api/mpesa-max/stream are
+forwarded chunk by chunk.
+
+    uvicorn --app-dir backend asgi:app --workers 2
+"""
+
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from flask import Flask, g, jsonify, request
+
+from .financial_strategist import NOT_CONFIGURED, UNAVAILABLE, FinancialStrategist
+from .fraud_detector import FraudDetector
+from .log_pipeline import start_request
+from .metrics import record_request
+from .routes.api_routes import (
+    _ask_ai_body, _ask_ai_question, _authorize_fraud_check, _mpesa_max_body, _mpesa_max_context,
+    _plan_fraud_check, _record_fraud_result, _submit_fraud_job, _wants_async,
+)
+
+# (status, headers, body) of a finished response
+Reply = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+# Request state on flask.g that lives across the stages of one request
+CARRIED_G = ('db_queries', 'db_seconds', 'request_id', 'log_start')
+
+INTERNAL_ERROR = b'{"error":"internal_server_error","message":"An unexpected error occurred"}\n'
+
+
+class AsgiApp:
+    def __init__(self, flask_app: Flask, db_threads: Optional[int] = None, wsgi_threads: Optional[int] = None):
+        config = flask_app.config
+        self.flask_app = flask_app
+        self._db_pool = ThreadPoolExecutor(
+            max_workers=db_threads or int(config.get("ASYNC_DB_THREADS", 8)), thread_name_prefix='asgi-db')
+        self._wsgi_pool = ThreadPoolExecutor(
+            max_workers=wsgi_threads or int(config.get("ASYNC_WSGI_THREADS", 8)), thread_name_prefix='asgi-wsgi')
+        prefix = config.get("API_PREFIX", "/api")
+        self._routes = {
+            f"{prefix}/check-fraud": ('api.check_fraud', self._check_fraud),
+            f"{prefix}/ask-ai": ('api.ask_ai', self._ask_ai),
+            f"{prefix}/mpesa-max": ('api.ask_mpesa_max', self._mpesa_max),
+        }
+        # /metrics is only registered when metrics are enabled
+        self._metrics = 'metrics' in flask_app.view_functions
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = await _read_body(receive)
+        if body is None:
+            return
+        route = self._routes.get(scope['path']) if scope['method'] == 'POST' else None
+        if route is None:
+            await self._wsgi(scope, body, send)
+            return
+
+        endpoint, handler = route
+        start = time.perf_counter()
+        try:
+            status, headers, content = await handler(scope, body)
+        except Exception:
+            self.flask_app.logger.exception(f"Error in {scope['path']}")
+            status, headers, content = 500, [(b'content-type', b'application/json')], INTERNAL_ERROR
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': headers + [(b'content-length', str(len(content)).encode())]})
+        await send({'type': 'http.response.body', 'body': content})
+        if self._metrics:
+            record_request(endpoint, scope['method'], status, time.perf_counter() - start)
+
+    # Endpoints
+
+    async def _check_fraud(self, scope, body) -> Reply:
+        def prepare():
+            payload = request.get_json(silent=True) or {}
+            user, transaction_data, error = _authorize_fraud_check(payload)
+            if error:
+                return self._reply(error), None
+            if _wants_async(payload):
+                return self._reply(_submit_fraud_job(user, transaction_data, payload.get('callback_url'))), None
+            cached, plan = _plan_fraud_check(user.id, transaction_data)
+            if cached is not None:
+                return self._reply((jsonify(cached), 200)), None
+            return None, (user.id, transaction_data, plan)
+
+        reply, work = await self._in_request(scope, body, prepare)
+        if reply:
+            return reply
+        user_id, transaction_data, (detector, history_data, prescore) = work
+        fraud_result = await detector.detect_fraud_async(history_data, transaction_data, prescore)
+        return await self._in_request(scope, body, lambda: self._reply(
+            (jsonify(_record_fraud_result(user_id, transaction_data, fraud_result)), 200)))
+
+    async def _ask_ai(self, scope, body) -> Reply:
+        strategist = FinancialStrategist()
+
+        def prepare():
+            question, error = _ask_ai_question(request.get_json(silent=True) or {})
+            if error:
+                return self._reply(error), None
+            answer = NOT_CONFIGURED if not strategist.api_key else strategist.cached_answer(question)
+            if answer is not None:
+                return self._reply((jsonify(_ask_ai_body(question, answer)), 200)), None
+            return None, question
+
+        reply, question = await self._in_request(scope, body, prepare)
+        if reply:
+            return reply
+        answer = await strategist.model_answer_async(question)
+
+        def finish():
+            if answer:
+                strategist.store_answer(question, answer)
+            return self._reply((jsonify(_ask_ai_body(question, answer or UNAVAILABLE)), 200))
+
+        return await self._in_request(scope, body, finish)
+
+    async def _mpesa_max(self, scope, body) -> Reply:
+        def prepare():
+            user_query, user_context, error = _mpesa_max_context(request.get_json(silent=True) or {})
+            if error:
+                return self._reply(error), None
+            return None, (user_query, user_context)
+
+        reply, work = await self._in_request(scope, body, prepare)
+        if reply:
+            return reply
+        user_query, user_context = work
+        max_response = await FraudDetector().get_mpesa_max_response_async(user_query, user_context)
+        return await self._in_request(scope, body, lambda: self._reply(
+            (jsonify(_mpesa_max_body(user_query, user_context, max_response)), 200)))
+
+    # Thread-offload boundary
+
+    async def _in_request(self, scope, body: bytes, fn: Callable):
+        """Run ``fn`` on the DB pool inside a Flask request context for this request."""
+        carried = scope.setdefault('shieldai.g', {})
+        return await asyncio.get_running_loop().run_in_executor(
+            self._db_pool, self._call_in_request, environ_from_scope(scope, body), fn, carried)
+
+    def _call_in_request(self, environ, fn: Callable, carried: dict):
+        # Popping the context removes the scoped session, so no connection outlives the stage
+        with self.flask_app.request_context(environ):
+            if carried:
+                for name, value in carried.items():
+                    setattr(g, name, value)
+            else:
+                # First stage: the request id and log start time then hold for the whole request,
+                # and DB time accumulates across stages so Server-Timing covers all of them
+                g.db_queries, g.db_seconds = 0, 0.0
+                start_request()
+            try:
+                return fn()
+            finally:
+                carried.update((name, g.get(name)) for name in CARRIED_G)
+
+    def _reply(self, rv) -> Reply:
+        """Turn a view return value into a reply, applying the app's after_request hooks."""
+        response = self.flask_app.process_response(self.flask_app.make_response(rv))
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in response.headers.items() if name.lower() != 'content-length']
+        return response.status_code, headers, response.get_data()
+
+    # Everything else: the Flask app on a thread
+
+    async def _wsgi(self, scope, body: bytes, send) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._wsgi_pool, self._run_wsgi, environ_from_scope(scope, body), send, loop)
+
+    def _run_wsgi(self, environ, send, loop) -> None:
+        state = {}
+
+        def start_response(status, headers, exc_info=None):
+            state['status'] = int(status.split(' ', 1)[0])
+            state['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def forward(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        result = self.flask_app(environ, start_response)
+        started = False
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started:
+                    forward({'type': 'http.response.start', 'status': state['status'], 'headers': state['headers']})
+                    started = True
+                forward({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                forward({'type': 'http.response.start', 'status': state['status'], 'headers': state['headers']})
+            forward({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Closes generators, e.g. so a streamed model call is settled when the client leaves
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._db_pool.shutdown(wait=False)
+                self._wsgi_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    """The whole request body, or None if the client disconnected first."""
+    parts = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        parts.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(parts)
+
+
+def environ_from_scope(scope, body: bytes) -> dict:
+    """WSGI environ for an ASGI HTTP scope with an already-read body."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
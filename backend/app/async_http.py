@@ -0,0 +1,176 @@
+"""
+Outbound HTTP for the asyncio path (see app/asgi.py).
+
+A small HTTP/1.1 client on asyncio streams, so that an LLM call in flight
+holds a socket rather than a thread. Connections are kept alive and pooled
+per host for each event loop. It covers what the OpenRouter calls need:
+JSON bodies, Content-Length or chunked responses, TLS and timeouts.
+
+- ASYNC_HTTP_MAX_CONNECTIONS: open connections per host (default 256); more
+  concurrent requests wait for a free one
+- HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT: as for app/http_client.py; the
+  read timeout bounds the whole response
+
+A request is only sent twice if its method is idempotent: a POST may have
+reached the server (and been billed) before its connection failed, so that
+failure is raised to the caller.
+"""
+
+import asyncio
+import json as jsonlib
+import os
+import ssl
+import weakref
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .http_client import default_timeout
+
+_Key = Tuple[str, str, int]
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class AsyncResponse:
+    def __init__(self, status_code: int, headers: Dict[str, str], content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self) -> Any:
+        return jsonlib.loads(self.content)
+
+
+class AsyncHTTPClient:
+    """Keep-alive connection pool bound to the event loop it is first used on."""
+
+    def __init__(self, max_connections: Optional[int] = None):
+        if max_connections is None:
+            max_connections = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', '256'))
+        self.max_connections = max_connections
+        self._idle: Dict[_Key, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = defaultdict(list)
+        self._slots: Dict[_Key, asyncio.Semaphore] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, json: Any = None,
+                      connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None
+                      ) -> AsyncResponse:
+        connect_timeout, read_timeout = default_timeout(connect_timeout, read_timeout)
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        body = jsonlib.dumps(json).encode() if json is not None else b''
+        head = self._head(method, parts, key, headers or {}, body, json is not None)
+
+        slots = self._slots.setdefault(key, asyncio.Semaphore(self.max_connections))
+        async with slots:
+            while True:
+                connection, reused = await self._connection(key, connect_timeout)
+                reader, writer = connection
+                try:
+                    writer.write(head + body)
+                    await writer.drain()
+                    status, response_headers, content, keep_alive = await asyncio.wait_for(
+                        self._read_response(reader, method), read_timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # The server may have closed an idle keep-alive connection; only a request that is
+                    # safe to repeat is retried on a fresh one (_connection already skips closed ones)
+                    if reused and method.upper() in IDEMPOTENT_METHODS:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self._idle[key].append(connection)
+                else:
+                    writer.close()
+                return AsyncResponse(status, response_headers, content)
+
+    async def post(self, url: str, **kwargs) -> AsyncResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self) -> None:
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    def _head(self, method, parts, key, headers, body, is_json) -> bytes:
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        default_port = 443 if parts.scheme == 'https' else 80
+        host = parts.hostname if key[2] == default_port else f'{parts.hostname}:{key[2]}'
+        lines = [f'{method} {target} HTTP/1.1', f'Host: {host}', f'Content-Length: {len(body)}']
+        lowered = {name.lower() for name in headers}
+        if is_json and 'content-type' not in lowered:
+            lines.append('Content-Type: application/json')
+        lines.extend(f'{name}: {value}' for name, value in headers.items() if name.lower() not in ('host', 'content-length'))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _connection(self, key: _Key, connect_timeout: float):
+        idle = self._idle[key]
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return (reader, writer), True
+            writer.close()
+        scheme, host, port = key
+        if scheme == 'https' and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if scheme == 'https' else None), connect_timeout)
+        return (reader, writer), False
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader, method: str):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed before the response")
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        status_code = int(status)
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200:
+            return status_code, headers, b'', keep_alive
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return status_code, headers, b''.join(chunks), keep_alive
+        if 'content-length' in headers:
+            return status_code, headers, await reader.readexactly(int(headers['content-length'])), keep_alive
+        return status_code, headers, await reader.read(), False
+
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncHTTPClient]" = weakref.WeakKeyDictionary()
+
+
+def get_client() -> AsyncHTTPClient:
+    """Return the running event loop's client, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncHTTPClient()
+    return client
+
+
+async def post(url: str, **kwargs) -> AsyncResponse:
+    return await get_client().post(url, **kwargs)
@@ -0,0 +1,79 @@
+"""
+Signed session tokens for the PIN-protected API routes.
+
+PINs are stored as werkzeug PBKDF2 hashes, which are deliberately slow to
+check. /api/login checks the PIN once and issues a token signed with
+SECRET_KEY; later requests send it as ``Authorization: Bearer <token>`` and
+are verified with an HMAC check and a primary-key lookup instead of a hash.
+
+A token carries a fingerprint of the PIN hash, so changing the PIN revokes
+every token issued before the change.
+"""
+
+import hashlib
+from typing import Optional, Tuple
+
+from flask import current_app, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from . import db
+from .models import User
+
+TOKEN_SALT = "shieldai-session"
+
+
+def _serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt=TOKEN_SALT)
+
+
+def _pin_fingerprint(user: User) -> str:
+    return hashlib.sha256(user.pin_hash.encode()).hexdigest()[:16]
+
+
+def token_max_age() -> int:
+    return int(current_app.config.get("SESSION_TOKEN_MAX_AGE_SECONDS", 3600))
+
+
+def issue_token(user: User) -> str:
+    return _serializer().dumps({"uid": user.id, "pv": _pin_fingerprint(user)})
+
+
+def load_token_user(token: str) -> Optional[User]:
+    """User the token was issued to, or None if it is invalid, expired or revoked."""
+    try:
+        data = _serializer().loads(token, max_age=token_max_age())
+    except (SignatureExpired, BadSignature):
+        return None
+    user = db.session.get(User, data.get("uid"))
+    if user is None or data.get("pv") != _pin_fingerprint(user):
+        return None
+    return user
+
+
+def bearer_token() -> Optional[str]:
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() == "bearer" and token.strip():
+        return token.strip()
+    return None
+
+
+def authenticate_user(phone: str, pin: Optional[str]) -> Tuple[Optional[User], Optional[tuple]]:
+    """
+    Resolve the user behind ``phone`` from the bearer token if one is sent,
+    otherwise by checking ``pin``. Returns (user, None) on success and
+    (None, (response, status)) otherwise.
+    """
+    token = bearer_token()
+    if token:
+        user = load_token_user(token)
+        if user is None or user.phone != phone:
+            return None, (jsonify({"error": "unauthorized", "message": "Invalid or expired session token"}), 401)
+        return user, None
+
+    user = User.query.filter_by(phone=phone).first()
+    if not user:
+        return None, (jsonify({"error": "not_found", "message": "User not found"}), 404)
+    if not pin or not user.check_pin(pin):
+        return None, (jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401)
+    return user, None
@@ -0,0 +1,220 @@
+"""
+Small TTL + LRU caches with an in-process and a Redis backend.
+
+Caches are configured per name from the app config and created lazily:
+
+    <NAME>_CACHE_BACKEND      memory (default), redis or none
+    <NAME>_CACHE_TTL_SECONDS  entry lifetime
+    <NAME>_CACHE_MAX_ENTRIES  LRU bound
+    REDIS_URL                 used by the redis backend
+
+Values must be JSON-serializable. Backend errors never propagate to the
+caller: a failing Redis simply behaves like a cache miss.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from flask import current_app
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class RedisCache:
+    """Redis-backed cache shared by all workers.
+
+    Entries expire through Redis TTLs. The LRU bound is kept with a sorted set
+    of keys scored by last access time; the least recently used keys beyond
+    ``max_entries`` are deleted on write.
+    """
+
+    def __init__(self, client, namespace: str, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.client = client
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._index_key = f"{namespace}:lru"
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self.client.get(self._key(key))
+            if raw is not None:
+                self.client.zadd(self._index_key, {key: time.time()})
+        except Exception:
+            raw = None
+            self._count('errors')
+        if raw is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        now = time.time()
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(self._key(key), json.dumps(value), ex=max(1, int(ttl)))
+            pipe.zadd(self._index_key, {key: now})
+            # Index members whose entry has already expired through its TTL
+            pipe.zremrangebyscore(self._index_key, 0, now - ttl)
+            pipe.zcard(self._index_key)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                self._evict(size - self.max_entries)
+        except Exception:
+            self._count('errors')
+
+    def _evict(self, count: int) -> None:
+        stale = self.client.zrange(self._index_key, 0, count - 1)
+        if not stale:
+            return
+        stale = [k.decode() if isinstance(k, bytes) else k for k in stale]
+        pipe = self.client.pipeline()
+        pipe.delete(*[self._key(k) for k in stale])
+        pipe.zrem(self._index_key, *stale)
+        pipe.execute()
+        self._count('evictions', len(stale))
+
+    def delete(self, key: str) -> None:
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(self._key(key))
+            pipe.zrem(self._index_key, key)
+            pipe.execute()
+        except Exception:
+            self._count('errors')
+
+    def clear(self) -> None:
+        try:
+            keys = self.client.zrange(self._index_key, 0, -1)
+            keys = [k.decode() if isinstance(k, bytes) else k for k in keys]
+            if keys:
+                self.client.delete(*[self._key(k) for k in keys])
+            self.client.delete(self._index_key)
+        except Exception:
+            self._count('errors')
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            entries = self.client.zcard(self._index_key)
+        except Exception:
+            entries = None
+        with self._lock:
+            return {
+                'backend': 'redis',
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors,
+            }
+
+
+def stable_hash(data: Any) -> str:
+    """SHA-256 of the canonical JSON encoding of ``data``."""
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def build_cache(name: str, config) -> Optional[Any]:
+    prefix = name.upper()
+    backend = (config.get(f"{prefix}_CACHE_BACKEND") or 'memory').lower()
+    ttl = float(config.get(f"{prefix}_CACHE_TTL_SECONDS") or 300)
+    max_entries = int(config.get(f"{prefix}_CACHE_MAX_ENTRIES") or 10000)
+
+    if backend == 'none':
+        return None
+    if backend == 'redis':
+        import redis
+
+        client = redis.Redis.from_url(config.get("REDIS_URL") or "redis://localhost:6379/0")
+        return RedisCache(client, namespace=f"shieldai:{name}", max_entries=max_entries, ttl_seconds=ttl)
+    return MemoryCache(max_entries=max_entries, ttl_seconds=ttl)
+
+
+_build_lock = threading.Lock()
+
+
+def get_cache(name: str):
+    """Return the named cache for the current app (None when disabled)."""
+    caches = current_app.extensions.setdefault('shieldai_caches', {})
+    if name not in caches:
+        with _build_lock:
+            if name not in caches:
+                caches[name] = build_cache(name, current_app.config)
+    return caches[name]
+
+
+def cache_snapshots() -> Dict[str, Any]:
+    """Counters for the caches the current app has created so far."""
+    caches = current_app.extensions.get('shieldai_caches', {})
+    return {name: cache.stats() for name, cache in caches.items() if cache is not None}
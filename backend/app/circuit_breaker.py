@@ -0,0 +1,221 @@
+"""
+Per-dependency circuit breakers for LLM models.
+
+Each model gets one breaker per process, shared by all request threads of a
+gunicorn worker. A breaker tracks a rolling time window of call outcomes and a
+reservoir of recent latencies:
+
+- closed: calls go through; once the window holds at least ``min_calls`` and
+  the failure rate reaches ``failure_rate_threshold`` the breaker opens
+- open: calls are rejected instantly for ``open_seconds``
+- half_open: a single probe call is let through; success closes the breaker,
+  failure opens it again
+
+Calls slower than ``slow_call_seconds`` count as failures even if they succeed.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from flask import current_app, has_app_context
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is rejected because the breaker is open."""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    LATENCY_SAMPLES = 200
+
+    def __init__(self,
+                 name: str,
+                 window_seconds: float = 60.0,
+                 min_calls: int = 5,
+                 failure_rate_threshold: float = 0.5,
+                 open_seconds: float = 30.0,
+                 slow_call_seconds: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (timestamp, succeeded)
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self._state = self.CLOSED
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._last_error: Optional[str] = None
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def allow_request(self) -> bool:
+        """Return True if a call may proceed; in half-open state only one probe is admitted."""
+        with self._lock:
+            state = self._current_state(self._clock())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            now = self._clock()
+            self._latencies.append(latency)
+            slow = self.slow_call_seconds is not None and latency > self.slow_call_seconds
+            if slow:
+                self._last_error = f"slow call ({latency:.2f}s)"
+            self._record(now, succeeded=not slow)
+
+    def record_failure(self, error: Any = None) -> None:
+        with self._lock:
+            self._last_error = str(error)[:200] if error is not None else 'error'
+            self._record(self._clock(), succeeded=False)
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """Run ``fn`` under the breaker, raising CircuitOpenError if it is open."""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit open for {self.name}")
+        start = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success(time.monotonic() - start)
+        return result
+
+    async def call_async(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """``call`` for a coroutine function; the breaker's lock is only held briefly."""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit open for {self.name}")
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success(time.monotonic() - start)
+        return result
+
+    def latency_percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(pct / 100.0 * len(samples)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            self._prune(now)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            rejected = self._rejected
+            last_error = self._last_error
+        return {
+            'state': state,
+            'window_calls': calls,
+            'window_error_rate': round(failures / calls, 4) if calls else 0.0,
+            'latency_p50_ms': _to_ms(self.latency_percentile(50)),
+            'latency_p95_ms': _to_ms(self.latency_percentile(95)),
+            'rejected_calls': rejected,
+            'last_error': last_error,
+        }
+
+    # Internal helpers (caller holds the lock)
+    def _current_state(self, now: float) -> str:
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            return self.HALF_OPEN
+        return self._state
+
+    def _record(self, now: float, succeeded: bool) -> None:
+        state = self._current_state(now)
+        if state == self.HALF_OPEN or self._probe_in_flight:
+            self._probe_in_flight = False
+            if succeeded:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            else:
+                self._trip(now)
+            return
+
+        self._outcomes.append((now, succeeded))
+        self._prune(now)
+        if state == self.CLOSED and len(self._outcomes) >= self.min_calls:
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if failures / len(self._outcomes) >= self.failure_rate_threshold:
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self._state = self.OPEN
+        self._opened_at = now
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000.0, 1) if seconds is not None else None
+
+
+_registry_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def _setting(key: str, default: str) -> Any:
+    """App config value inside an app context, otherwise the environment."""
+    if has_app_context() and key in current_app.config:
+        return current_app.config[key]
+    return os.getenv(key, default)
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide breaker for ``name``, configured from app config or the environment."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                slow = _setting('LLM_BREAKER_SLOW_CALL_SECONDS', '15')
+                breaker = CircuitBreaker(
+                    name,
+                    window_seconds=float(_setting('LLM_BREAKER_WINDOW_SECONDS', '60')),
+                    min_calls=int(_setting('LLM_BREAKER_MIN_CALLS', '5')),
+                    failure_rate_threshold=float(_setting('LLM_BREAKER_FAILURE_RATE', '0.5')),
+                    open_seconds=float(_setting('LLM_BREAKER_OPEN_SECONDS', '30')),
+                    slow_call_seconds=float(slow) if slow else None,
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def breaker_snapshots() -> Dict[str, Dict[str, Any]]:
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def reset_breakers() -> None:
+    with _registry_lock:
+        _breakers.clear()
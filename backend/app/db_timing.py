@@ -0,0 +1,59 @@
+"""
+Per-request database time.
+
+SQLAlchemy cursor events accumulate the number of statements and the time
+spent executing them on ``flask.g``. Each response reports the totals in a
+``Server-Timing: db;dur=<ms>;desc="<n> queries"`` header, which browsers'
+dev tools and the benchmarks can read, and they are logged at DEBUG.
+"""
+
+import time
+
+from flask import Flask, current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import observe_dependency
+
+_listening = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    observe_dependency('db', elapsed)
+    if has_app_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+
+
+def db_stats() -> dict:
+    """Statements and milliseconds of DB time so far in the current app context."""
+    return {"queries": g.get('db_queries', 0), "ms": round(g.get('db_seconds', 0.0) * 1000, 3)}
+
+
+def init_app(app: Flask) -> None:
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+    @app.before_request
+    def _reset_db_time():
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    @app.after_request
+    def _report_db_time(response):
+        stats = db_stats()
+        if stats["queries"]:
+            response.headers.add('Server-Timing', f'db;dur={stats["ms"]};desc="{stats["queries"]} queries"')
+            current_app.logger.debug(f"db time {stats['ms']}ms over {stats['queries']} queries")
+        return response
@@ -2,7 +2,7 @@ from flask import Blueprint, jsonify, request
 from datetime import datetime, timedelta
 import random
 from . import db
-from .models import User, Transaction
+from .models import User, Transaction, UserFeatureProfile, UserSpendingDaily
 from .fraud_detector import FraudDetector
 
 demo_bp = Blueprint("demo", __name__)
@@ -134,6 +134,8 @@ def reset_demo_data():
     """Reset all demo data."""
     try:
         # Clear all transactions and users
+        UserFeatureProfile.query.delete()
+        UserSpendingDaily.query.delete()
         Transaction.query.delete()
         User.query.delete()
         db.session.commit()
@@ -1,10 +1,32 @@
 import os
+import re
 import json
-from typing import List, Dict, Any
-import requests
+import logging
+import unicodedata
+from typing import Dict, Any
 from datetime import datetime
 
-from .models import Transaction
+from flask import has_app_context
+
+from . import async_http, http_client
+from .cache import get_cache, stable_hash
+from .circuit_breaker import get_breaker
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+NOT_CONFIGURED = "AI service is not configured. Please contact support."
+UNAVAILABLE = "I'm sorry, but I'm unable to answer your question right now. Please try again later."
+
+
+def normalize_question(question: str) -> str:
+    """Fold case, punctuation and whitespace so equivalent questions share a cache entry."""
+    text = unicodedata.normalize('NFKC', question).casefold()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
 
 
 class FinancialStrategist:
@@ -16,59 +38,95 @@ class FinancialStrategist:
         self.http_referer = os.getenv('OPENROUTER_HTTP_REFERER', 'http://localhost:5000')
         self.timeout_seconds = 20
 
-    def ask_question(self, question: str, user_id: int, plan_data: Dict[str, Any] = None) -> str:
+    def ask_question(self, question: str) -> str:
         """
-        Answer a user's question about their financial plan using AI.
+        Answer a user's question about personal finance using AI.
+
+        The prompt depends only on the question, so answers are cached by the
+        normalized question (AI_ANSWER_CACHE_* settings). Only model answers
+        are cached, never the fallback apology.
         """
         if not self.api_key:
-            return "AI service is not configured. Please contact support."
+            return NOT_CONFIGURED
 
-        # Get user's recent transactions for context
-        try:
-            transactions = Transaction.history_for_user(user_id, limit=20)
-            transactions_data = [tx.to_dict() for tx in transactions]
-        except Exception:
-            transactions_data = []
+        cached = self.cached_answer(question)
+        if cached is not None:
+            return cached
 
-        prompt = self._build_conversation_prompt(question, plan_data or {}, transactions_data)
+        prompt = self._build_conversation_prompt(question)
 
         # Try primary model first, then fallback
         for model in (self.primary_model, self.fallback_model):
             try:
-                response = self._call_openrouter(model, prompt)
-                parsed = self._parse_response(response)
+                # Skips models whose circuit is open instead of waiting out the timeout
+                parsed = get_breaker(model).call(lambda: self._parse_response(self._call_openrouter(model, prompt)))
                 if parsed:
+                    self.store_answer(question, parsed)
                     return parsed
             except Exception as e:
                 print(f"Model {model} failed: {e}")
                 continue
 
-        return "I'm sorry, but I'm unable to answer your question right now. Please try again later."
+        return UNAVAILABLE
 
-    def _build_conversation_prompt(self, question: str, plan_data: Dict[str, Any], transactions: List[Dict[str, Any]]) -> str:
-        plan_summary = f"""
-Current Financial Plan:
-- Weekly Budget: KSH {plan_data.get('weekly_budget', 'N/A')}
-- Monthly Budget: KSH {plan_data.get('monthly_budget', 'N/A')}
-- Financial Health Score: {plan_data.get('financial_health_score', 'N/A')}/100
-"""
+    async def model_answer_async(self, question: str):
+        """The model part of ask_question for the asyncio path: an answer, or None if no model gave one.
+
+        Cache lookups stay with the caller, which makes them off the event loop.
+        """
+        prompt = self._build_conversation_prompt(question)
+        for model in (self.primary_model, self.fallback_model):
+            try:
+                async def call():
+                    return self._parse_response(await self._call_openrouter_async(model, prompt))
+
+                parsed = await get_breaker(model).call_async(call)
+                if parsed:
+                    return parsed
+            except Exception as e:
+                # No app context on the event loop; this logger propagates to app.logger's handlers
+                logger.warning(f"Model {model} failed: {e}")
+        return None
 
-        if plan_data.get('categories'):
-            plan_summary += "\nSpending Categories:\n"
-            for cat in plan_data['categories']:
-                plan_summary += f"- {cat['name']}: Allocated KSH {cat['allocated']}\n"
+    def cached_answer(self, question: str):
+        cache = get_cache("ai_answer") if has_app_context() else None
+        return cache.get(self._cache_key(question)) if cache is not None else None
 
-        recent_transactions = "\nRecent Transactions (Last 10):\n"
-        for tx in transactions[:10]:
-            recent_transactions += f"- {tx['timestamp'][:10]}: KSH {tx['amount']} to {tx['recipient']}\n"
+    def store_answer(self, question: str, answer: str) -> None:
+        cache = get_cache("ai_answer") if has_app_context() else None
+        if cache is not None:
+            cache.set(self._cache_key(question), answer)
 
+    def _cache_key(self, question: str) -> str:
+        # Model names are part of the key so switching models doesn't serve stale answers
+        return stable_hash([self.primary_model, self.fallback_model, normalize_question(question)])
+
+    def _build_conversation_prompt(self, question: str) -> str:
         return f"""You are a financial advisor specializing in Kenyan M-Pesa users. Answer the user's question with 2-3 key actionable tips.
 
 USER'S QUESTION: {question}
 
 IMPORTANT: Keep your response under 80 words. Use bullet points. Be specific to Kenyan context and M-Pesa usage. Focus on practical, immediate actions."""
 
+    @timed('openrouter')
     def _call_openrouter(self, model: str, prompt: str) -> Dict[str, Any]:
+        headers, payload = self._openrouter_request(model, prompt)
+        resp = http_client.post(self.base_url, headers=headers, json=payload, read_timeout=self.timeout_seconds)
+        if resp.status_code >= 400:
+            raise RuntimeError(f"OpenRouter error {resp.status_code}: {resp.text[:200]}")
+
+        return resp.json()
+
+    @timed('openrouter')
+    async def _call_openrouter_async(self, model: str, prompt: str) -> Dict[str, Any]:
+        headers, payload = self._openrouter_request(model, prompt)
+        resp = await async_http.post(self.base_url, headers=headers, json=payload, read_timeout=self.timeout_seconds)
+        if resp.status_code >= 400:
+            raise RuntimeError(f"OpenRouter error {resp.status_code}: {resp.text[:200]}")
+
+        return resp.json()
+
+    def _openrouter_request(self, model: str, prompt: str):
         headers = {
             'Authorization': f'Bearer {self.api_key}',
             'HTTP-Referer': self.http_referer,
@@ -86,12 +144,7 @@ IMPORTANT: Keep your response under 80 words. Use bullet points. Be specific to
             'temperature': 0.3,
             'max_tokens': 150,
         }
-
-        resp = requests.post(self.base_url, headers=headers, json=payload, timeout=self.timeout_seconds)
-        if resp.status_code >= 400:
-            raise RuntimeError(f"OpenRouter error {resp.status_code}: {resp.text[:200]}")
-
-        return resp.json()
+        return headers, payload
 
     def _parse_response(self, response: Dict[str, Any]) -> str:
         try:
@@ -1,54 +1,240 @@
+import asyncio
 import json
 import os
 import re
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-import requests
+from flask import current_app, has_app_context
+
+from . import async_http, http_client
+from .circuit_breaker import get_breaker
+from .fraud_scoring import FeatureProfile, PreScore, RiskScorer
+from .history_encoding import encode_history
+from .metrics import timed
+
+# Shared by every FraudDetector in the process; bounds the number of in-flight hedged calls
+_hedge_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+# A prompt string (sent under the JSON-only system message) or a complete list of chat messages
+Prompt = Union[str, List[Dict[str, Any]]]
+
+# Hedged calls that lost the race on the asyncio path, kept referenced until they finish
+_hedge_losers = set()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('OPENROUTER_HEDGE_WORKERS', '8')),
+                    thread_name_prefix='llm-hedge',
+                )
+    return _hedge_executor
 
 
 class FraudDetector:
+    # Observed latencies needed before the adaptive ("p95") hedge delay is trusted
+    HEDGE_MIN_LATENCY_SAMPLES = 20
+
     def __init__(self,
                  api_key: Optional[str] = None,
                  base_url: Optional[str] = None,
                  primary_model: Optional[str] = None,
                  fallback_model: Optional[str] = None,
                  http_referer: Optional[str] = None,
-                 timeout_seconds: int = 20):
+                 timeout_seconds: int = 20,
+                 low_risk_threshold: Optional[float] = None,
+                 high_risk_threshold: Optional[float] = None,
+                 hedge_delay: Union[float, str, None] = None,
+                 history_token_budget: Optional[int] = None,
+                 prompt_cache: Optional[bool] = None):
         self.api_key = api_key or os.getenv('OPENROUTER_API_KEY')
         self.base_url = base_url or os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1/chat/completions')
         self.primary_model = primary_model or os.getenv('OPENROUTER_MODEL', 'anthropic/claude-3-sonnet')
         self.fallback_model = fallback_model or os.getenv('OPENROUTER_FALLBACK_MODEL', 'google/gemini-flash-1.5')
         self.http_referer = http_referer or os.getenv('OPENROUTER_HTTP_REFERER', 'https://shieldai.ke')
         self.timeout_seconds = timeout_seconds
-
-    def detect_fraud(self, user_history: List[Dict[str, Any]], current_transaction: Dict[str, Any]) -> Dict[str, Any]:
+        if low_risk_threshold is None:
+            low_risk_threshold = float(os.getenv('FRAUD_PRESCORE_LOW', '0.3'))
+        if high_risk_threshold is None:
+            high_risk_threshold = float(os.getenv('FRAUD_PRESCORE_HIGH', '0.8'))
+        self.scorer = RiskScorer(low_threshold=low_risk_threshold, high_threshold=high_risk_threshold)
+        # Hedging: seconds to wait for the primary model before also firing the fallback,
+        # "p95" to use the primary's observed p95 latency, or empty/None to call them in turn
+        if hedge_delay is None:
+            hedge_delay = (current_app.config.get('OPENROUTER_HEDGE_DELAY') if has_app_context()
+                           else os.getenv('OPENROUTER_HEDGE_DELAY')) or None
+        self.hedge_delay = hedge_delay
+        self.hedge_default_delay = float(os.getenv('OPENROUTER_HEDGE_DEFAULT_DELAY', '5'))
+        # Approximate token budget for the history block of the fraud prompt
+        if history_token_budget is None:
+            history_token_budget = int(os.getenv('FRAUD_PROMPT_TOKEN_BUDGET', '800'))
+        self.history_token_budget = history_token_budget
+        # Mark the stable M-Pesa Max system prompt as a prompt-caching breakpoint (OpenRouter cache_control)
+        if prompt_cache is None:
+            prompt_cache = os.getenv('OPENROUTER_PROMPT_CACHE', '1').lower() not in ('0', 'false', 'off')
+        self.prompt_cache = prompt_cache
+
+    def prescore(self, profile: FeatureProfile, current_transaction: Dict[str, Any]) -> PreScore:
+        """Run the local scoring stage against a user's feature profile."""
+        return self.scorer.score(profile, current_transaction)
+
+    def detect_fraud(self, user_history: List[Dict[str, Any]], current_transaction: Dict[str, Any],
+                     prescore: Optional[PreScore] = None) -> Dict[str, Any]:
         """
+        Scores the transaction locally first and only calls OpenRouter for the ambiguous middle band.
         Calls OpenRouter with the primary model, falls back to a secondary model on failure.
         Expects the model to return a compact JSON with keys: is_fraud (bool), confidence (float), action_required (bool), reason (str).
+        The routing decision, risk score and indicator values are included in the result.
         """
+        if prescore is None:
+            prescore = self.prescore(FeatureProfile.from_history(user_history), current_transaction)
+
+        if prescore.conclusive:
+            return self._local_response(prescore)
+
+        if not self.api_key:
+            return dict(self._fallback_response("Missing OPENROUTER_API_KEY"), **prescore.to_dict())
+
+        prompt = self._build_prompt(user_history, current_transaction)
+
+        parsed, last_error = self._query_models(prompt, self._parse_response)
+        if parsed:
+            return dict(parsed, **prescore.to_dict())
+
+        return dict(self._fallback_response(last_error), **prescore.to_dict())
+
+    async def detect_fraud_async(self, user_history: List[Dict[str, Any]], current_transaction: Dict[str, Any],
+                                 prescore: PreScore) -> Dict[str, Any]:
+        """detect_fraud for the asyncio path (app/asgi.py): the model call is awaited, not run on a thread."""
+        if prescore.conclusive:
+            return self._local_response(prescore)
+
         if not self.api_key:
-            return self._fallback_response("Missing OPENROUTER_API_KEY")
+            return dict(self._fallback_response("Missing OPENROUTER_API_KEY"), **prescore.to_dict())
 
         prompt = self._build_prompt(user_history, current_transaction)
 
+        parsed, last_error = await self._query_models_async(prompt, self._parse_response)
+        if parsed:
+            return dict(parsed, **prescore.to_dict())
+
+        return dict(self._fallback_response(last_error), **prescore.to_dict())
+
+    def _query_models(self, prompt: Prompt, parse: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+                      ) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Return the first valid parsed response from the primary/fallback models and the last error."""
+        delay = self._resolve_hedge_delay()
+        if delay is not None and self.fallback_model != self.primary_model:
+            return self._query_models_hedged(prompt, parse, delay)
+
         # Try primary model first, then fallback
+        last_error = 'Unknown error'
         for model in (self.primary_model, self.fallback_model):
             try:
-                response = self._call_openrouter(model, prompt)
-                parsed = self._parse_response(response)
-                if parsed:
-                    return parsed
+                return self._attempt(model, prompt, parse), last_error
             except Exception as e:
                 # Continue to fallback on any error
                 last_error = str(e)
-                continue
-
-        return self._fallback_response(last_error if 'last_error' in locals() else 'Unknown error')
+        return None, last_error
+
+    def _query_models_hedged(self, prompt: Prompt, parse: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+                             delay: float) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Fire the fallback if the primary has not answered within `delay`; first valid answer wins."""
+        executor = _get_hedge_executor()
+        primary = executor.submit(self._attempt, self.primary_model, prompt, parse)
+        pending = {primary}
+
+        done, _ = wait(pending, timeout=delay)
+        if primary in done and primary.exception() is None:
+            return primary.result(), 'Unknown error'
+
+        # Primary is slow or already failed: race the fallback against it
+        pending.add(executor.submit(self._attempt, self.fallback_model, prompt, parse))
+        last_error = 'Unknown error'
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser is left to finish (or time out) in the pool; its result is ignored
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result(), last_error
+                last_error = str(future.exception())
+        return None, last_error
+
+    async def _query_models_async(self, prompt: Prompt, parse: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+                                  ) -> Tuple[Optional[Dict[str, Any]], str]:
+        """_query_models with the same fallback and hedging rules, on the event loop."""
+        delay = self._resolve_hedge_delay()
+        last_error = 'Unknown error'
+        if delay is None or self.fallback_model == self.primary_model:
+            for model in (self.primary_model, self.fallback_model):
+                try:
+                    return await self._attempt_async(model, prompt, parse), last_error
+                except Exception as e:
+                    last_error = str(e)
+            return None, last_error
+
+        primary = asyncio.ensure_future(self._attempt_async(self.primary_model, prompt, parse))
+        pending = {primary}
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if primary in done and primary.exception() is None:
+            return primary.result(), last_error
+
+        pending.add(asyncio.ensure_future(self._attempt_async(self.fallback_model, prompt, parse)))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # Like the thread pool path, the loser finishes in the background so its breaker is settled
+                    for loser in pending:
+                        _hedge_losers.add(loser)
+                        loser.add_done_callback(_hedge_losers.discard)
+                    return task.result(), last_error
+                last_error = str(task.exception())
+        return None, last_error
+
+    async def _attempt_async(self, model: str, prompt: Prompt,
+                             parse: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        async def call():
+            parsed = parse(await self._call_openrouter_async(model, prompt))
+            if not parsed:
+                raise ValueError(f"Unparseable response from {model}")
+            return parsed
+
+        return await get_breaker(model).call_async(call)
+
+    def _attempt(self, model: str, prompt: Prompt, parse: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+                 ) -> Dict[str, Any]:
+        # Models whose breaker is open are skipped instantly instead of waiting out the timeout
+        def call():
+            parsed = parse(self._call_openrouter(model, prompt))
+            if not parsed:
+                raise ValueError(f"Unparseable response from {model}")
+            return parsed
+
+        return get_breaker(model).call(call)
+
+    def _resolve_hedge_delay(self) -> Optional[float]:
+        if self.hedge_delay in (None, '', 'off'):
+            return None
+        if isinstance(self.hedge_delay, str) and self.hedge_delay.lower().startswith('p'):
+            observed = get_breaker(self.primary_model).latency_percentile(
+                float(self.hedge_delay[1:]), min_samples=self.HEDGE_MIN_LATENCY_SAMPLES)
+            return observed if observed is not None else self.hedge_default_delay
+        return float(self.hedge_delay)
 
     # Internal helpers
     def _build_prompt(self, history: List[Dict[str, Any]], tx: Dict[str, Any]) -> str:
-        history_str = json.dumps(history, ensure_ascii=False)
-        tx_str = json.dumps(tx, ensure_ascii=False)
+        history_str = encode_history(history, token_budget=self.history_token_budget)
+        tx_str = json.dumps(tx, ensure_ascii=False, separators=(',', ':'))
         instructions = (
             "You are an expert fraud detection AI for Kenyan M-Pesa mobile money transactions. "
             "Analyze the user's transaction history and current transaction for fraud patterns specific to Kenya.\n\n"
@@ -67,9 +253,17 @@ class FraudDetector:
             "Return ONLY a valid JSON object with keys: "
             "is_fraud (bool), confidence (0.0-1.0), action_required (bool), reason (string explaining the decision)."
         )
-        return f"{instructions}\n\nUSER_HISTORY={history_str}\nCURRENT_TRANSACTION={tx_str}"
+        return f"{instructions}\n\nUSER_HISTORY:\n{history_str}\nCURRENT_TRANSACTION={tx_str}"
+
+    def _chat_messages(self, prompt: Prompt) -> List[Dict[str, Any]]:
+        if isinstance(prompt, str):
+            return [
+                {"role": "system", "content": "You are a precise JSON-only responder."},
+                {"role": "user", "content": prompt},
+            ]
+        return prompt
 
-    def _call_openrouter(self, model: str, prompt: str) -> Dict[str, Any]:
+    def _openrouter_request(self, model: str, prompt: Prompt) -> Tuple[Dict[str, str], Dict[str, Any]]:
         headers = {
             'Authorization': f'Bearer {self.api_key}',
             'HTTP-Referer': self.http_referer,
@@ -79,13 +273,23 @@ class FraudDetector:
         }
         payload = {
             'model': model,
-            'messages': [
-                {"role": "system", "content": "You are a precise JSON-only responder."},
-                {"role": "user", "content": prompt},
-            ],
+            'messages': self._chat_messages(prompt),
             'temperature': 0.2,
         }
-        resp = requests.post(self.base_url, headers=headers, json=payload, timeout=self.timeout_seconds)
+        return headers, payload
+
+    @timed('openrouter')
+    def _call_openrouter(self, model: str, prompt: Prompt) -> Dict[str, Any]:
+        headers, payload = self._openrouter_request(model, prompt)
+        resp = http_client.post(self.base_url, headers=headers, json=payload, read_timeout=self.timeout_seconds)
+        if resp.status_code >= 400:
+            raise RuntimeError(f"OpenRouter error {resp.status_code}: {resp.text[:200]}")
+        return resp.json()
+
+    @timed('openrouter')
+    async def _call_openrouter_async(self, model: str, prompt: Prompt) -> Dict[str, Any]:
+        headers, payload = self._openrouter_request(model, prompt)
+        resp = await async_http.post(self.base_url, headers=headers, json=payload, read_timeout=self.timeout_seconds)
         if resp.status_code >= 400:
             raise RuntimeError(f"OpenRouter error {resp.status_code}: {resp.text[:200]}")
         return resp.json()
@@ -135,23 +339,151 @@ class FraudDetector:
         if not self.api_key:
             return self._fallback_max_response("Missing OPENROUTER_API_KEY")
 
-        system_prompt = self._get_mpesa_max_system_prompt()
-        context_info = self._build_user_context(user_context) if user_context else ""
+        messages = self._build_mpesa_max_messages(user_query, user_context)
 
-        full_prompt = f"{system_prompt}\n\nUser Query: {user_query}\n{context_info}"
+        parsed, last_error = self._query_models(messages, self._parse_max_response)
+        if parsed:
+            return parsed
 
-        # Try primary model first, then fallback
+        return self._fallback_max_response(last_error)
+
+    async def get_mpesa_max_response_async(self, user_query: str, user_context: Optional[Dict[str, Any]] = None
+                                           ) -> Dict[str, Any]:
+        """get_mpesa_max_response for the asyncio path."""
+        if not self.api_key:
+            return self._fallback_max_response("Missing OPENROUTER_API_KEY")
+
+        messages = self._build_mpesa_max_messages(user_query, user_context)
+
+        parsed, last_error = await self._query_models_async(messages, self._parse_max_response)
+        if parsed:
+            return parsed
+
+        return self._fallback_max_response(last_error)
+
+    def stream_mpesa_max_response(self, user_query: str, user_context: Optional[Dict[str, Any]] = None
+                                  ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of get_mpesa_max_response.
+
+        Yields {'type': 'token', 'content': str} events as OpenRouter streams them,
+        then a single {'type': 'done', ...} event with the assembled response,
+        model_used and timings (or the fallback response with 'error': True).
+        The fallback model is only tried if the primary fails before its first token.
+        """
+        if not self.api_key:
+            yield {'type': 'done', **self._fallback_max_response("Missing OPENROUTER_API_KEY")}
+            return
+
+        messages = self._build_mpesa_max_messages(user_query, user_context)
+        last_error = 'Unknown error'
         for model in (self.primary_model, self.fallback_model):
+            breaker = get_breaker(model)
+            if not breaker.allow_request():
+                last_error = f"Circuit open for {model}"
+                continue
+
+            start = time.monotonic()
+            first_token_at = None
+            parts: List[str] = []
+            model_used = model
             try:
-                response = self._call_openrouter(model, full_prompt)
-                parsed = self._parse_max_response(response)
-                if parsed:
-                    return parsed
+                for delta, reported_model in self._stream_openrouter(model, messages):
+                    model_used = reported_model or model_used
+                    if not delta:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    parts.append(delta)
+                    yield {'type': 'token', 'content': delta}
+            except GeneratorExit:
+                # Client went away mid-stream; settle the breaker before closing the upstream response
+                breaker.record_success(time.monotonic() - start)
+                raise
             except Exception as e:
+                breaker.record_failure(e)
                 last_error = str(e)
+                if not parts:
+                    continue
+                # Tokens already reached the client, so the answer cannot switch models
+                yield {'type': 'done', **self._fallback_max_response(last_error),
+                       'response': ''.join(parts).strip(), 'model_used': model_used}
+                return
+
+            if not parts:
+                breaker.record_failure("empty completion")
+                last_error = f"Empty completion from {model}"
                 continue
 
-        return self._fallback_max_response(last_error if 'last_error' in locals() else 'Unknown error')
+            total = time.monotonic() - start
+            breaker.record_success(total)
+            yield {
+                'type': 'done',
+                'response': ''.join(parts).strip(),
+                'model_used': model_used,
+                'ttft_ms': round((first_token_at - start) * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+            }
+            return
+
+        yield {'type': 'done', **self._fallback_max_response(last_error)}
+
+    def _stream_openrouter(self, model: str, prompt: Prompt) -> Iterator[Tuple[Optional[str], Optional[str]]]:
+        """Yield (content delta, model) pairs from an OpenRouter SSE completion."""
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'HTTP-Referer': self.http_referer,
+            'X-Title': 'Shield AI Fraud Detection',
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        }
+        payload = {
+            'model': model,
+            'messages': self._chat_messages(prompt),
+            'temperature': 0.2,
+            'stream': True,
+        }
+        # read_timeout bounds the gap between chunks rather than the whole answer
+        resp = http_client.post(self.base_url, headers=headers, json=payload,
+                                read_timeout=self.timeout_seconds, stream=True)
+        try:
+            if resp.status_code >= 400:
+                raise RuntimeError(f"OpenRouter error {resp.status_code}: {resp.text[:200]}")
+            for line in resp.iter_lines(decode_unicode=True):
+                # Blank separators and ": OPENROUTER PROCESSING" keep-alive comments
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('error'):
+                    raise RuntimeError(f"OpenRouter stream error: {str(chunk['error'])[:200]}")
+                choices = chunk.get('choices') or []
+                delta = (choices[0].get('delta') or {}).get('content') if choices else None
+                yield delta, chunk.get('model')
+        finally:
+            resp.close()
+
+    def _build_mpesa_max_messages(self, user_query: str, user_context: Optional[Dict[str, Any]] = None
+                                  ) -> List[Dict[str, Any]]:
+        """
+        The persona is sent as an unchanging system message so providers can reuse
+        its prefix across requests; only the user message varies per call.
+        """
+        system_prompt = self._get_mpesa_max_system_prompt()
+        if self.prompt_cache:
+            # Anthropic and Gemini need an explicit breakpoint; providers with automatic prefix caching ignore it
+            system_content: Union[str, List[Dict[str, Any]]] = [
+                {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}},
+            ]
+        else:
+            system_content = system_prompt
+        context_info = self._build_user_context(user_context) if user_context else ""
+        return [
+            {"role": "system", "content": system_content},
+            {"role": "user", "content": f"User Query: {user_query}\n{context_info}"},
+        ]
 
     def _get_mpesa_max_system_prompt(self) -> str:
         """Return the complete M-Pesa Max system prompt."""
@@ -263,6 +595,16 @@ Remember: You're not their friend. You're their financial drill sergeant. Push t
             'error': True,
         }
 
+    def _local_response(self, prescore: PreScore) -> Dict[str, Any]:
+        # Verdict for transactions the local scorer is confident about
+        is_fraud = prescore.decision == PreScore.LOCAL_HIGH
+        return dict({
+            'is_fraud': is_fraud,
+            'confidence': round(max(0.0, min(1.0, prescore.risk_score)), 4),
+            'action_required': is_fraud,
+            'reason': self.scorer.explain(prescore),
+        }, **prescore.to_dict())
+
     def _fallback_response(self, message: str) -> Dict[str, Any]:
         # Deterministic conservative fallback
         return {
@@ -0,0 +1,269 @@
+"""
+Deterministic pre-scoring for fraud checks.
+
+Computes the five indicators FraudDetector asks the LLM to look at (amount,
+time of day, recipient novelty, location and velocity) from a summary of the
+user's past behaviour. Clear-cut transactions are decided in-process; only the
+ambiguous middle band is escalated to the model.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Parse an ISO-8601 string or datetime into a naive UTC datetime."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        ts = value
+    else:
+        try:
+            ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _normalize_label(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    label = str(value).strip().lower()
+    return label or None
+
+
+class FeatureProfile:
+    """Running summary of a user's legitimate transaction behaviour."""
+
+    MAX_RECENT_TIMESTAMPS = 20
+    MAX_KNOWN_RECIPIENTS = 500
+    MAX_KNOWN_LOCATIONS = 100
+
+    def __init__(self,
+                 count: int = 0,
+                 amount_mean: float = 0.0,
+                 amount_m2: float = 0.0,
+                 hour_histogram: Optional[List[int]] = None,
+                 recipients: Optional[List[str]] = None,
+                 locations: Optional[List[str]] = None,
+                 recent_timestamps: Optional[List[datetime]] = None):
+        self.count = count
+        self.amount_mean = amount_mean
+        self.amount_m2 = amount_m2
+        self.hour_histogram = list(hour_histogram) if hour_histogram else [0] * 24
+        self.recipients = list(recipients or [])
+        self.locations = list(locations or [])
+        self.recent_timestamps = sorted(recent_timestamps or [])
+
+    @classmethod
+    def from_history(cls, history: Iterable[Dict[str, Any]]) -> 'FeatureProfile':
+        """Build a profile from serialized transactions (any order).
+
+        Transactions already flagged as fraudulent are left out so that they
+        do not become part of the user's "normal" baseline.
+        """
+        profile = cls()
+        rows = []
+        for tx in history:
+            if tx.get('is_fraudulent'):
+                continue
+            rows.append((parse_timestamp(tx.get('timestamp')) or datetime.min, tx))
+        rows.sort(key=lambda row: row[0])
+        for ts, tx in rows:
+            profile.add(tx.get('amount'), tx.get('recipient'), ts, tx.get('location'))
+        return profile
+
+    @property
+    def amount_std(self) -> float:
+        if self.count < 2:
+            return 0.0
+        return (self.amount_m2 / (self.count - 1)) ** 0.5
+
+    def add(self, amount: Any, recipient: Any, timestamp: Any, location: Any = None) -> None:
+        """Fold one transaction into the running statistics."""
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            return
+
+        # Welford's online mean/variance
+        self.count += 1
+        delta = amount - self.amount_mean
+        self.amount_mean += delta / self.count
+        self.amount_m2 += delta * (amount - self.amount_mean)
+
+        ts = parse_timestamp(timestamp)
+        if ts is not None and ts != datetime.min:
+            self.hour_histogram[ts.hour] += 1
+            self.recent_timestamps.append(ts)
+            self.recent_timestamps.sort()
+            del self.recent_timestamps[:-self.MAX_RECENT_TIMESTAMPS]
+
+        self._remember(self.recipients, _normalize_label(recipient), self.MAX_KNOWN_RECIPIENTS)
+        self._remember(self.locations, _normalize_label(location), self.MAX_KNOWN_LOCATIONS)
+
+    @staticmethod
+    def _remember(values: List[str], value: Optional[str], limit: int) -> None:
+        # Most recently used entries live at the end; the oldest are evicted first
+        if value is None:
+            return
+        if value in values:
+            values.remove(value)
+        values.append(value)
+        del values[:-limit]
+
+    def knows_recipient(self, recipient: Any) -> bool:
+        return _normalize_label(recipient) in self.recipients
+
+    def knows_location(self, location: Any) -> bool:
+        return _normalize_label(location) in self.locations
+
+
+class PreScore:
+    """Outcome of the local scoring stage."""
+
+    LOCAL_LOW = 'local_low'
+    LOCAL_HIGH = 'local_high'
+    ESCALATE = 'llm'
+
+    def __init__(self, risk_score: float, indicators: Dict[str, float], decision: str):
+        self.risk_score = risk_score
+        self.indicators = indicators
+        self.decision = decision
+
+    @property
+    def conclusive(self) -> bool:
+        return self.decision != self.ESCALATE
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'routing': self.decision,
+            'risk_score': round(self.risk_score, 4),
+            'risk_indicators': {name: round(value, 4) for name, value in self.indicators.items()},
+        }
+
+
+class RiskScorer:
+    """Scores a transaction against a FeatureProfile.
+
+    Each indicator is in [0, 1]. They are combined with a weighted noisy-OR,
+    so a single strong signal can push a transaction out of the low band and
+    several together reach the high band.
+    """
+
+    DEFAULT_WEIGHTS = {
+        'amount': 0.6,
+        'time': 0.35,
+        'recipient': 0.3,
+        'location': 0.3,
+        'velocity': 0.5,
+    }
+
+    INDICATOR_REASONS = {
+        'amount': 'amount far above typical spending',
+        'time': 'unusual time of day',
+        'recipient': 'new recipient',
+        'location': 'unfamiliar location',
+        'velocity': 'rapid successive transactions',
+    }
+
+    # Below this many transactions the user's own statistics are not trusted
+    MIN_HISTORY = 5
+    # Absolute amounts from the prompt's Kenyan context, used without history
+    TYPICAL_INDIVIDUAL_AMOUNT = 2000.0
+    HIGH_RISK_INDIVIDUAL_AMOUNT = 20000.0
+    SUSPICIOUS_HOURS = range(0, 5)
+
+    def __init__(self,
+                 low_threshold: float = 0.3,
+                 high_threshold: float = 0.8,
+                 weights: Optional[Dict[str, float]] = None,
+                 velocity_window_minutes: int = 10):
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.weights = dict(self.DEFAULT_WEIGHTS, **(weights or {}))
+        self.velocity_window = timedelta(minutes=velocity_window_minutes)
+
+    def score(self, profile: FeatureProfile, tx: Dict[str, Any]) -> PreScore:
+        ts = parse_timestamp(tx.get('timestamp')) or datetime.utcnow()
+        try:
+            amount = float(tx.get('amount'))
+        except (TypeError, ValueError):
+            amount = 0.0
+
+        indicators = {
+            'amount': self._amount_indicator(profile, amount),
+            'time': self._time_indicator(profile, ts),
+            'recipient': self._recipient_indicator(profile, tx.get('recipient')),
+            'location': self._location_indicator(profile, tx.get('location')),
+            'velocity': self._velocity_indicator(profile, ts),
+        }
+
+        remaining = 1.0
+        for name, value in indicators.items():
+            remaining *= 1.0 - self.weights.get(name, 0.0) * value
+        risk_score = _clamp(1.0 - remaining)
+
+        if risk_score < self.low_threshold:
+            decision = PreScore.LOCAL_LOW
+        elif risk_score >= self.high_threshold:
+            decision = PreScore.LOCAL_HIGH
+        else:
+            decision = PreScore.ESCALATE
+        return PreScore(risk_score, indicators, decision)
+
+    def explain(self, prescore: PreScore) -> str:
+        """Human readable reason for a locally decided verdict."""
+        flagged = [
+            self.INDICATOR_REASONS[name]
+            for name, value in sorted(prescore.indicators.items(), key=lambda item: -item[1])
+            if value >= 0.5
+        ]
+        if prescore.decision == PreScore.LOCAL_HIGH:
+            details = ', '.join(flagged) if flagged else 'multiple risk indicators'
+            return f"High risk transaction: {details} (risk score {prescore.risk_score:.2f})"
+        return f"Low risk transaction: consistent with the user's normal pattern (risk score {prescore.risk_score:.2f})"
+
+    # Indicators
+    def _amount_indicator(self, profile: FeatureProfile, amount: float) -> float:
+        if profile.count < self.MIN_HISTORY:
+            span = self.HIGH_RISK_INDIVIDUAL_AMOUNT - self.TYPICAL_INDIVIDUAL_AMOUNT
+            return _clamp((amount - self.TYPICAL_INDIVIDUAL_AMOUNT) / span)
+        if amount <= profile.amount_mean:
+            return 0.0
+        std = profile.amount_std
+        if std <= 0.0:
+            # Every past amount was identical; fall back to a ratio test
+            return _clamp((amount / max(profile.amount_mean, 1.0) - 2.0) / 8.0)
+        z = (amount - profile.amount_mean) / std
+        return _clamp((z - 2.0) / 4.0)
+
+    def _time_indicator(self, profile: FeatureProfile, ts: datetime) -> float:
+        night = ts.hour in self.SUSPICIOUS_HOURS
+        if profile.count < self.MIN_HISTORY:
+            return 1.0 if night else 0.0
+        hist = profile.hour_histogram
+        nearby = hist[(ts.hour - 1) % 24] + hist[ts.hour] + hist[(ts.hour + 1) % 24]
+        share = nearby / max(sum(hist), 1)
+        novelty = 1.0 - min(1.0, share / 0.1)
+        return _clamp(novelty + 0.3) if night and novelty > 0 else novelty
+
+    def _recipient_indicator(self, profile: FeatureProfile, recipient: Any) -> float:
+        if profile.count == 0:
+            return 0.5
+        return 0.0 if profile.knows_recipient(recipient) else 1.0
+
+    def _location_indicator(self, profile: FeatureProfile, location: Any) -> float:
+        if not _normalize_label(location) or not profile.locations:
+            return 0.0
+        return 0.0 if profile.knows_location(location) else 1.0
+
+    def _velocity_indicator(self, profile: FeatureProfile, ts: datetime) -> float:
+        recent = sum(1 for past in profile.recent_timestamps if abs(ts - past) <= self.velocity_window)
+        return _clamp(recent / 3.0)
+
+
+def _clamp(value: float, low: float = 0.0, high: float = 1.0) -> float:
+    return max(low, min(high, value))
@@ -0,0 +1,118 @@
+"""
+Compact transaction-history encoding for LLM prompts.
+
+Instead of one JSON object per transaction (repeating every key and fields the
+model does not need, such as ids and fraud_confidence), the history is sent as
+summary statistics over the whole history plus a pipe-separated table of the
+most recent rows. Recipients and locations are dictionary-encoded (R1, L1, ...)
+because they repeat heavily. Rows are dropped oldest-first until the block
+fits the token budget, so the same history always produces the same prompt.
+"""
+
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+from .fraud_scoring import parse_timestamp
+
+# Rough chars-per-token ratio for English/JSON-like text with common tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _percentile(ordered: Sequence[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def _fmt_amount(value: float) -> str:
+    return f"{value:.0f}" if float(value).is_integer() else f"{value:.2f}"
+
+
+def _sorted_newest_first(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def key(tx):
+        ts = parse_timestamp(tx.get('timestamp'))
+        return (ts.isoformat() if ts else '', tx.get('id') or 0)
+    return sorted(history, key=key, reverse=True)
+
+
+def summarize_history(history: List[Dict[str, Any]]) -> str:
+    """One-line statistics over the full history."""
+    if not history:
+        return "HISTORY_SUMMARY: no previous transactions"
+
+    amounts = sorted(float(tx.get('amount') or 0.0) for tx in history)
+    timestamps = sorted(ts for ts in (parse_timestamp(tx.get('timestamp')) for tx in history) if ts)
+    hours = Counter(ts.hour for ts in timestamps)
+    flagged = sum(1 for tx in history if tx.get('is_fraudulent'))
+    recipients = {tx.get('recipient') for tx in history if tx.get('recipient')}
+    locations = Counter(tx.get('location') for tx in history if tx.get('location'))
+
+    parts = [
+        f"n={len(history)}",
+        f"flagged={flagged}",
+        f"amount mean={_fmt_amount(round(sum(amounts) / len(amounts), 2))}"
+        f" median={_fmt_amount(_percentile(amounts, 50))}"
+        f" p95={_fmt_amount(_percentile(amounts, 95))}"
+        f" max={_fmt_amount(amounts[-1])}",
+        f"distinct_recipients={len(recipients)}",
+    ]
+    if timestamps:
+        parts.append(f"span={timestamps[0].date().isoformat()}..{timestamps[-1].date().isoformat()}")
+        parts.append("busiest_hours=" + ",".join(f"{h:02d}h:{c}" for h, c in sorted(hours.items(), key=lambda i: (-i[1], i[0]))[:4]))
+        parts.append(f"night_0-5h={sum(c for h, c in hours.items() if h < 5)}")
+    if locations:
+        parts.append("top_locations=" + ",".join(f"{loc}:{c}" for loc, c in sorted(locations.items(), key=lambda i: (-i[1], i[0]))[:3]))
+    return "HISTORY_SUMMARY: " + " ".join(parts)
+
+
+def _table(rows: List[Dict[str, Any]]) -> str:
+    recipient_ids: Dict[str, str] = {}
+    location_ids: Dict[str, str] = {}
+    lines = []
+    for tx in rows:
+        recipient = str(tx.get('recipient') or '')
+        location = tx.get('location')
+        r_id = recipient_ids.setdefault(recipient, f"R{len(recipient_ids) + 1}")
+        l_id = location_ids.setdefault(location, f"L{len(location_ids) + 1}") if location else ''
+        ts = parse_timestamp(tx.get('timestamp'))
+        lines.append("|".join([
+            ts.strftime('%Y-%m-%dT%H:%M') if ts else '',
+            _fmt_amount(float(tx.get('amount') or 0.0)),
+            r_id,
+            l_id,
+            'F' if tx.get('is_fraudulent') else '',
+        ]))
+
+    header = [f"HISTORY_ROWS: {len(rows)} most recent, newest first; columns time|amount_ksh|recipient|location|flag (F = previously flagged)"]
+    if recipient_ids:
+        header.append("RECIPIENTS: " + " ".join(f"{rid}={value}" for value, rid in recipient_ids.items()))
+    if location_ids:
+        header.append("LOCATIONS: " + " ".join(f"{lid}={value}" for value, lid in location_ids.items()))
+    return "\n".join(header + lines)
+
+
+def encode_history(history: List[Dict[str, Any]], token_budget: Optional[int] = None) -> str:
+    """Summary line plus as many recent rows as fit in ``token_budget`` (None = all rows)."""
+    summary = summarize_history(history)
+    rows = _sorted_newest_first(history)
+    if not rows:
+        return summary
+
+    def render(count: int) -> str:
+        return summary if count == 0 else f"{summary}\n{_table(rows[:count])}"
+
+    if token_budget is None or estimate_tokens(render(len(rows))) <= token_budget:
+        return render(len(rows))
+
+    # Largest prefix of recent rows that fits; rendered size grows with the row count
+    low, high = 0, len(rows)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(render(mid)) <= token_budget:
+            low = mid
+        else:
+            high = mid - 1
+    return render(low)
@@ -0,0 +1,143 @@
+"""
+Shared outbound HTTP client for OpenRouter and Daraja calls.
+
+One requests.Session per process keeps connections alive and pooled, so only
+the first call to a host pays the TCP + TLS handshake. Pool sizes and the
+connect/read timeouts are configurable through environment variables:
+
+- HTTP_POOL_CONNECTIONS: number of per-host pools to keep (default 10)
+- HTTP_POOL_MAXSIZE: connections kept per host (default 10)
+- HTTP_POOL_HOST_SIZES: per-host overrides, e.g. "openrouter.ai=20,api.safaricom.co.ke=4"
+- HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT: default timeouts in seconds
+
+request_to_address() sends one request to an already resolved IP address
+(for callers that vetted the address, e.g. job webhooks) on its own
+unpooled session.
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+
+
+def _host_pool_sizes() -> Dict[str, int]:
+    sizes = {}
+    for item in os.getenv('HTTP_POOL_HOST_SIZES', '').split(','):
+        host, _, size = item.partition('=')
+        if host.strip() and size.strip().isdigit():
+            sizes[host.strip().lower()] = int(size)
+    return sizes
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    pool_connections = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))
+    pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+
+    default_adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('https://', default_adapter)
+    session.mount('http://', default_adapter)
+
+    # Longer mount prefixes win, so these take precedence over the defaults
+    for host, size in _host_pool_sizes().items():
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount(f'https://{host}/', adapter)
+        session.mount(f'http://{host}/', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide session, creating it on first use.
+
+    The owning PID is remembered so a gunicorn worker forked from a preloaded
+    master builds its own pool instead of sharing the parent's sockets.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def reset_session() -> None:
+    """Close pooled connections and rebuild the session on next use."""
+    global _session, _session_pid
+    with _lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def default_timeout(connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None):
+    return (
+        connect_timeout if connect_timeout is not None else float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05')),
+        read_timeout if read_timeout is not None else float(os.getenv('HTTP_READ_TIMEOUT', '30')),
+    )
+
+
+def request(method: str, url: str,
+            connect_timeout: Optional[float] = None,
+            read_timeout: Optional[float] = None,
+            **kwargs) -> requests.Response:
+    """Send a request over the pooled session with separate connect/read timeouts."""
+    kwargs.setdefault('timeout', default_timeout(connect_timeout, read_timeout))
+    return get_session().request(method, url, **kwargs)
+
+
+class _PinnedHostAdapter(HTTPAdapter):
+    """Verifies TLS (SNI and certificate) for ``hostname`` while connecting to an IP address."""
+
+    def __init__(self, hostname: str):
+        self.hostname = hostname
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        # urllib3 drops these for plain http pools
+        kwargs['server_hostname'] = self.hostname
+        kwargs['assert_hostname'] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def request_to_address(method: str, url: str, address: str,
+                       connect_timeout: Optional[float] = None,
+                       read_timeout: Optional[float] = None,
+                       **kwargs) -> requests.Response:
+    """Send a request for ``url`` to ``address`` without resolving the URL's host again.
+
+    The Host header, TLS server name and certificate check still use the
+    URL's host name, so the server sees the same request as for ``url``.
+    """
+    parts = urlsplit(url)
+    netloc = f'[{address}]' if ':' in address else address
+    if parts.port:
+        netloc = f'{netloc}:{parts.port}'
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Host'] = parts.netloc.rpartition('@')[2]
+    kwargs.setdefault('timeout', default_timeout(connect_timeout, read_timeout))
+    with requests.Session() as session:
+        # No proxies from the environment: they would resolve the name themselves
+        session.trust_env = False
+        adapter = _PinnedHostAdapter(parts.hostname)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session.request(method, urlunsplit(parts._replace(netloc=netloc)), headers=headers, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
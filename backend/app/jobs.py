@@ -0,0 +1,326 @@
+"""
+Background job queue for slow request work (e.g. LLM-backed fraud checks).
+
+Handlers are registered by name and run inside an app context on a bounded
+pool of worker threads, so a slow job never holds a gunicorn request thread.
+Two backends are available through JOB_QUEUE_BACKEND:
+
+- memory (default): jobs and results live in the worker process. Status
+  polling must reach the same process, which holds for a single worker.
+- redis: job records and the pending queue live in Redis (REDIS_URL), so any
+  worker can accept, execute or report on a job and queued jobs survive a
+  restart. Each process claims jobs into its own processing list and keeps a
+  heartbeat key alive; a starting process puts jobs claimed by processes whose
+  heartbeat has expired back on the queue.
+
+When a job has a callback_url, the finished job record is POSTed to it.
+Callback hosts must be listed in JOB_WEBHOOK_ALLOWED_HOSTS (no list, no
+callbacks), and are resolved before delivery so that a listed name pointing
+at a loopback, private or link-local address is refused. The POST is sent to
+the address that was checked (http_client.request_to_address), so a second,
+different DNS answer (rebinding) cannot send it elsewhere.
+"""
+
+import abc
+import ipaddress
+import json
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from flask import Flask, current_app
+
+from . import http_client
+
+_handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the queue already holds the maximum number of pending jobs."""
+
+
+def register_handler(kind: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]]) -> None:
+    """Register the function executed for jobs of ``kind``; it receives the job payload."""
+    _handlers[kind] = handler
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class JobQueue(abc.ABC):
+    """Shared job lifecycle; backends implement storage and dispatch."""
+
+    def __init__(self, app: Flask, result_ttl_seconds: int = 3600, webhook_timeout: float = 5.0,
+                 webhook_allowed_hosts: Optional[set] = None):
+        self.app = app
+        self.result_ttl_seconds = result_ttl_seconds
+        self.webhook_timeout = webhook_timeout
+        self.webhook_allowed_hosts = webhook_allowed_hosts or set()
+
+    def submit(self, kind: str, payload: Dict[str, Any], callback_url: Optional[str] = None) -> Dict[str, Any]:
+        if kind not in _handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        if callback_url and not self.callback_allowed(callback_url):
+            raise ValueError("callback_url host is not allowed")
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': 'queued',
+            'payload': payload,
+            'callback_url': callback_url,
+            'created_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+        self._enqueue(job)
+        return job
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The stored job record, or None if unknown or expired."""
+
+    def callback_allowed(self, url: str) -> bool:
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            return False
+        # Deny by default: an open list would let any caller make the server POST to internal URLs
+        return parsed.hostname.lower() in self.webhook_allowed_hosts
+
+    @abc.abstractmethod
+    def _enqueue(self, job: Dict[str, Any]) -> None:
+        """Store a new job and hand it to a worker."""
+
+    @abc.abstractmethod
+    def _save(self, job: Dict[str, Any]) -> None:
+        """Persist the current state of ``job``."""
+
+    def _execute(self, job: Dict[str, Any]) -> None:
+        job.update(status='running', started_at=_now())
+        self._save(job)
+        with self.app.app_context():
+            try:
+                job['result'] = _handlers[job['kind']](job['payload'])
+                job['status'] = 'succeeded'
+            except Exception as e:
+                current_app.logger.exception(f"Job {job['id']} ({job['kind']}) failed")
+                job['status'] = 'failed'
+                job['error'] = str(e)[:500]
+            job['finished_at'] = _now()
+            self._save(job)
+            if job.get('callback_url'):
+                self._notify(job)
+
+    def _notify(self, job: Dict[str, Any]) -> None:
+        hostname = urlparse(job['callback_url']).hostname or ''
+        address = _public_address(hostname) if self.callback_allowed(job['callback_url']) else None
+        if address is None:
+            current_app.logger.warning(f"Webhook for job {job['id']} refused: {hostname} is not an allowed public host")
+            job['webhook_status'] = 'refused'
+            self._save(job)
+            return
+        try:
+            # Redirects are not followed, so an allowed host cannot bounce the POST to an internal one
+            resp = http_client.request_to_address('POST', job['callback_url'], address, json=public_view(job),
+                                                  read_timeout=self.webhook_timeout, allow_redirects=False)
+            job['webhook_status'] = resp.status_code
+        except Exception as e:
+            current_app.logger.warning(f"Webhook for job {job['id']} failed: {e}")
+            job['webhook_status'] = 'failed'
+        self._save(job)
+
+
+class InProcessJobQueue(JobQueue):
+    def __init__(self, app: Flask, workers: int = 2, max_pending: int = 100, **kwargs):
+        super().__init__(app, **kwargs)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job-worker')
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._expires: Dict[str, float] = {}
+        self._pending = 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _enqueue(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError("Job queue is full")
+            self._pending += 1
+            self._purge()
+            self._jobs[job['id']] = job
+        self._executor.submit(self._run, job)
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        try:
+            self._execute(job)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job['id']] = job
+            if job['status'] in ('succeeded', 'failed'):
+                self._expires[job['id']] = time.monotonic() + self.result_ttl_seconds
+
+    def _purge(self) -> None:
+        # Caller holds the lock
+        now = time.monotonic()
+        for job_id in [job_id for job_id, expires in self._expires.items() if expires <= now]:
+            self._jobs.pop(job_id, None)
+            del self._expires[job_id]
+
+
+class RedisJobQueue(JobQueue):
+    HEARTBEAT_SECONDS = 30
+
+    def __init__(self, app: Flask, client, workers: int = 2, max_pending: int = 1000,
+                 namespace: str = 'shieldai:jobs', **kwargs):
+        super().__init__(app, **kwargs)
+        self.client = client
+        self.max_pending = max_pending
+        self.namespace = namespace
+        self.consumer_id = uuid.uuid4().hex
+        self._queue_key = f"{namespace}:queue"
+        self._processing_key = f"{namespace}:processing:{self.consumer_id}"
+        self._heartbeat_key = f"{namespace}:consumer:{self.consumer_id}"
+        self._stop = threading.Event()
+        self._heartbeat()
+        self.requeue_abandoned()
+        self._threads = [
+            threading.Thread(target=self._consume, name=f'job-consumer-{i}', daemon=True)
+            for i in range(workers)
+        ] + [threading.Thread(target=self._keep_alive, name='job-heartbeat', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.namespace}:{job_id}"
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self._key(job_id))
+        return json.loads(raw) if raw else None
+
+    def _enqueue(self, job: Dict[str, Any]) -> None:
+        if self.client.llen(self._queue_key) >= self.max_pending:
+            raise QueueFullError("Job queue is full")
+        self._save(job)
+        self.client.lpush(self._queue_key, job['id'])
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        self.client.set(self._key(job['id']), json.dumps(job, default=str), ex=self.result_ttl_seconds)
+
+    def _heartbeat(self) -> None:
+        self.client.set(self._heartbeat_key, 1, ex=self.HEARTBEAT_SECONDS)
+
+    def _keep_alive(self) -> None:
+        while not self._stop.wait(self.HEARTBEAT_SECONDS / 3):
+            try:
+                self._heartbeat()
+            except Exception:
+                pass
+
+    def requeue_abandoned(self) -> int:
+        """Put jobs claimed by consumers that are no longer alive back on the queue."""
+        requeued = 0
+        prefix = f"{self.namespace}:processing:"
+        for key in self.client.scan_iter(match=f"{prefix}*"):
+            key = key.decode() if isinstance(key, bytes) else key
+            consumer_id = key[len(prefix):]
+            if consumer_id == self.consumer_id or self.client.exists(f"{self.namespace}:consumer:{consumer_id}"):
+                continue
+            while True:
+                job_id = self.client.rpoplpush(key, self._queue_key)
+                if job_id is None:
+                    break
+                job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+                job = self.get(job_id)
+                if job is not None and job['status'] == 'running':
+                    # The worker died mid-job; run it again from the start
+                    job.update(status='queued', started_at=None)
+                    self._save(job)
+                requeued += 1
+        if requeued:
+            self.app.logger.warning(f"Requeued {requeued} job(s) abandoned by stopped workers")
+        return requeued
+
+    def _consume(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job_id = self.client.brpoplpush(self._queue_key, self._processing_key, timeout=5)
+                if job_id is None:
+                    continue
+                job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+                job = self.get(job_id)
+                if job is not None and job['status'] == 'queued':
+                    self._execute(job)
+                self.client.lrem(self._processing_key, 1, job_id)
+            except Exception:
+                # Redis unavailable; back off instead of spinning
+                time.sleep(1)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _public_address(hostname: str) -> Optional[str]:
+    """An address ``hostname`` resolves to, or None unless all of them are globally routable."""
+    try:
+        infos = socket.getaddrinfo(hostname, None)
+    except (socket.gaierror, UnicodeError):
+        return None
+    addresses = [info[4][0].split('%', 1)[0] for info in infos]
+    for text in addresses:
+        address = ipaddress.ip_address(text)
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            return None
+    return addresses[0] if addresses else None
+
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job record as returned to clients (the request payload is not echoed back)."""
+    return {key: value for key, value in job.items() if key != 'payload'}
+
+
+def build_job_queue(app: Flask) -> JobQueue:
+    config = app.config
+    allowed = {h.strip().lower() for h in (config.get("JOB_WEBHOOK_ALLOWED_HOSTS") or "").split(",") if h.strip()}
+    options = dict(
+        workers=int(config.get("JOB_QUEUE_WORKERS", 2)),
+        max_pending=int(config.get("JOB_QUEUE_MAX_PENDING", 100)),
+        result_ttl_seconds=int(config.get("JOB_RESULT_TTL_SECONDS", 3600)),
+        webhook_allowed_hosts=allowed,
+    )
+    if (config.get("JOB_QUEUE_BACKEND") or "memory").lower() == "redis":
+        import redis
+
+        client = redis.Redis.from_url(config.get("REDIS_URL") or "redis://localhost:6379/0")
+        return RedisJobQueue(app, client, **options)
+    return InProcessJobQueue(app, **options)
+
+
+_build_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the current app's job queue, creating it (and its workers) on first use."""
+    app = current_app._get_current_object()
+    if 'shieldai_jobs' not in app.extensions:
+        with _build_lock:
+            if 'shieldai_jobs' not in app.extensions:
+                app.extensions['shieldai_jobs'] = build_job_queue(app)
+    return app.extensions['shieldai_jobs']
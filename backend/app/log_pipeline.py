@@ -0,0 +1,254 @@
+"""
+Non-blocking, structured application logging.
+
+Request threads only put records on a bounded in-memory queue
+(logging.handlers.QueueHandler); a background thread per process
+(QueueListener) formats them and writes logs/app.log and stdout. When the
+queue is full a record is dropped and counted in
+shieldai_log_records_dropped_total instead of blocking the request.
+
+Records are JSON lines (LOG_FORMAT=json) carrying the id, method and path of
+the request they were logged from. The request id is taken from an incoming
+X-Request-ID header or generated, and returned in the same header. With
+LOG_REQUESTS on, every response also logs one record with its status and
+duration_ms.
+
+Large payloads go through log_payload(), which attaches them to a sampled
+share (LOG_PAYLOAD_SAMPLE_RATE) of records, cut to LOG_PAYLOAD_MAX_CHARS.
+Messages longer than LOG_MAX_MESSAGE_CHARS are cut as well.
+
+    LOG_ASYNC                 1 (default), or 0 to write from the request thread
+    LOG_FORMAT                json (default) or text
+    LOG_QUEUE_SIZE            records waiting for the writer before drops (default 10000)
+    LOG_REQUESTS              1 (default): one record per response
+    LOG_PAYLOAD_SAMPLE_RATE   share of log_payload() calls that keep the payload (default 0)
+    LOG_PAYLOAD_MAX_CHARS     default 2000
+    LOG_MAX_MESSAGE_CHARS     default 4000
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import time
+import uuid
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, List
+
+from flask import Flask, current_app, g, has_app_context, has_request_context, request
+
+from .metrics import REGISTRY
+
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+
+def _enabled(value: Any) -> bool:
+    return str(value).lower() not in ('0', 'false', 'off', 'no', '')
+
+
+def truncate(text: str, limit: int) -> str:
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} chars truncated]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, then any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the request's id, method and path and cuts long messages, on the calling thread."""
+
+    def __init__(self, max_message_chars: int):
+        super().__init__()
+        self.max_message_chars = max_message_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if has_request_context() and not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id')
+            record.method = request.method
+            record.path = request.path
+        message = record.getMessage()
+        if len(message) > self.max_message_chars:
+            record.msg, record.args = truncate(message, self.max_message_chars), None
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def __init__(self, pipeline: "_Pipeline"):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the arguments now (they may change after this call) but leave
+        # the formatting to the writer thread
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+            REGISTRY.inc('shieldai_log_records_dropped_total', {})
+
+
+class _Pipeline:
+    """A bounded queue and the listener thread that drains it into ``handlers``."""
+
+    def __init__(self, handlers: List[logging.Handler], size: int):
+        self.handlers = handlers
+        self.size = size
+        self.dropped = 0
+        self.queue: "queue.Queue[logging.LogRecord]" = queue.Queue(size)
+        self.handler = _QueueHandler(self)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        _pipelines.add(self)
+
+    def restart(self) -> None:
+        # The writer thread does not survive a fork (gunicorn --preload)
+        self.queue = self.handler.queue = queue.Queue(self.size)
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Write out what is queued and stop the thread."""
+        if self.listener._thread is None:
+            return
+        try:
+            self.listener.stop()
+        except queue.Full:
+            pass
+        for handler in self.handlers:
+            handler.close()
+
+
+_pipelines: "weakref.WeakSet[_Pipeline]" = weakref.WeakSet()
+
+
+def _restart_pipelines() -> None:
+    for pipeline in list(_pipelines):
+        pipeline.restart()
+
+
+def _stop_pipelines() -> None:
+    for pipeline in list(_pipelines):
+        pipeline.stop()
+
+
+os.register_at_fork(after_in_child=_restart_pipelines)
+atexit.register(_stop_pipelines)
+
+
+def setup_logging(app: Flask, handlers: List[logging.Handler]) -> None:
+    """Attach ``handlers`` to ``app.logger``, behind a queue unless LOG_ASYNC is off."""
+    config = app.config
+    formatter = JsonFormatter() if config.get("LOG_FORMAT", "json") == "json" else logging.Formatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    logger = app.logger
+    # app.logger is shared by every app built in this process: replace what an earlier one installed,
+    # including Flask's own synchronous stderr handler
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+        if isinstance(old, _QueueHandler):
+            old.pipeline.stop()
+        elif getattr(old, '_shieldai', False):
+            old.close()
+
+    context = RequestContextFilter(int(config.get("LOG_MAX_MESSAGE_CHARS", 4000)))
+    if _enabled(config.get("LOG_ASYNC", "1")):
+        installed = [_Pipeline(handlers, int(config.get("LOG_QUEUE_SIZE", 10000))).handler]
+    else:
+        installed = handlers
+    for handler in installed:
+        handler._shieldai = True
+        handler.addFilter(context)
+        logger.addHandler(handler)
+
+
+def init_app(app: Flask) -> None:
+    """Request ids on every response, and one record per request unless LOG_REQUESTS is off."""
+    if _enabled(app.config.get("LOG_REQUESTS", "1")):
+        app.before_request(_start_request)
+        app.after_request(_log_request)
+    else:
+        app.before_request(_assign_request_id)
+        app.after_request(_return_request_id)
+
+
+def start_request() -> None:
+    """Run the before_request hook init_app installed, for requests served outside Flask dispatch (app/asgi.py)."""
+    if _enabled(current_app.config.get("LOG_REQUESTS", "1")):
+        _start_request()
+    else:
+        _assign_request_id()
+
+
+def _assign_request_id() -> None:
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+
+def _return_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+
+def _start_request() -> None:
+    _assign_request_id()
+    g.log_start = time.perf_counter()
+
+
+def _log_request(response):
+    start = g.pop('log_start', None)
+    if start is not None:
+        duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        current_app.logger.info(f"{request.method} {request.path} {response.status_code} {duration_ms}ms",
+                                extra={'status': response.status_code, 'duration_ms': duration_ms})
+    return _return_request_id(response)
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, level: int = logging.INFO) -> None:
+    """Log ``message``, attaching ``payload`` (cut to size) to a sampled share of the records."""
+    config = current_app.config if has_app_context() else {}
+    rate = float(config.get("LOG_PAYLOAD_SAMPLE_RATE", 0))
+    extra = {}
+    if rate > 0 and random.random() < rate:
+        text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+        extra['payload'] = truncate(text, int(config.get("LOG_PAYLOAD_MAX_CHARS", 2000)))
+    logger.log(level, message, extra=extra)
@@ -0,0 +1,344 @@
+"""
+Request and dependency metrics in the Prometheus text format.
+
+Recorded series:
+
+    shieldai_http_request_duration_seconds{endpoint,method}   histogram per Flask endpoint
+    shieldai_http_requests_total{endpoint,method,status}      counter
+    shieldai_dependency_duration_seconds{dependency}          histogram: openrouter, mpesa,
+                                                              mpesa_oauth, db, pin_hash
+    shieldai_dependency_errors_total{dependency}              counter
+    shieldai_log_records_dropped_total                        counter (see app/log_pipeline.py)
+    shieldai_mpesa_reconcile_*                                runs, checks by outcome, run duration and
+                                                              pending lag (see app/mpesa/reconciler.py)
+
+and are served at GET /metrics. Values live in a process-wide registry, so
+timers work from any thread. Under gunicorn each worker has its own
+registry; with METRICS_BACKEND=redis every worker adds its increments to one
+Redis hash (REDIS_URL) every METRICS_FLUSH_SECONDS and /metrics reports the
+totals of all workers, whichever worker answers the scrape.
+
+    METRICS_ENABLED         1 (default) or 0
+    METRICS_BACKEND         redis (default when REDIS_URL is set) or memory (per process;
+                            only consistent with a single worker)
+    METRICS_FLUSH_SECONDS   redis flush interval
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from flask import Flask, Response, current_app, g, request
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS = {
+    'shieldai_http_request_duration_seconds': ('histogram', 'Request latency by Flask endpoint.'),
+    'shieldai_http_requests_total': ('counter', 'Responses by Flask endpoint and status code.'),
+    'shieldai_dependency_duration_seconds': ('histogram', 'Time spent in calls to dependencies.'),
+    'shieldai_dependency_errors_total': ('counter', 'Dependency calls that raised.'),
+    'shieldai_log_records_dropped_total': ('counter', 'Log records dropped because the log queue was full.'),
+    'shieldai_mpesa_reconcile_runs_total': ('counter', 'Completed M-Pesa reconciliation runs.'),
+    'shieldai_mpesa_reconcile_checked_total': ('counter', 'Pending STK pushes queried on Daraja, by outcome.'),
+    'shieldai_mpesa_reconcile_run_duration_seconds': ('histogram', 'Duration of M-Pesa reconciliation runs.'),
+    'shieldai_mpesa_reconcile_oldest_pending_age_seconds': (
+        'gauge', 'Age of the oldest pending STK push at the end of the last reconciliation run.'),
+    'shieldai_mpesa_reconcile_last_run_timestamp_seconds': (
+        'gauge', 'Unix time the last M-Pesa reconciliation run finished.'),
+}
+
+
+def _series(name: str, labels: Dict[str, str], suffix: str = '') -> str:
+    # Flat string keys make merging workers and storing in a Redis hash trivial
+    return json.dumps([name, sorted((k, str(v)) for k, v in labels.items()), suffix], separators=(',', ':'))
+
+
+@lru_cache(maxsize=4096)
+def _histogram_series(name: str, labels: Tuple[Tuple[str, str], ...]) -> Tuple[Tuple[str, ...], str, str, str]:
+    """(bucket keys, +Inf key, count key, sum key); cached because every DB query is observed."""
+    label_dict = dict(labels)
+    return (tuple(_series(name, label_dict, f'le={bound}') for bound in BUCKETS),
+            _series(name, label_dict, 'le=+Inf'), _series(name, label_dict, 'count'), _series(name, label_dict, 'sum'))
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and cumulative histograms, with changes kept for a shared store."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = defaultdict(float)
+        self._pending: Dict[str, float] = defaultdict(float)
+        self._pending_gauges: Dict[str, float] = {}
+
+    def inc(self, name: str, labels: Dict[str, str], amount: float = 1.0) -> None:
+        key = _series(name, labels)
+        with self._lock:
+            self._values[key] += amount
+            self._pending[key] += amount
+
+    def set(self, name: str, labels: Dict[str, str], value: float) -> None:
+        """Set a gauge; the shared store keeps the last value pushed by any process."""
+        key = _series(name, labels)
+        with self._lock:
+            self._values[key] = value
+            self._pending_gauges[key] = value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        buckets, inf_key, count_key, sum_key = _histogram_series(name, tuple(sorted(labels.items())))
+        keys = [key for bound, key in zip(BUCKETS, buckets) if value <= bound] + [inf_key, count_key]
+        with self._lock:
+            for key in keys:
+                self._values[key] += 1
+                self._pending[key] += 1
+            self._values[sum_key] += value
+            self._pending[sum_key] += value
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def take_pending(self) -> Dict[str, float]:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        return pending
+
+    def restore_pending(self, pending: Dict[str, float]) -> None:
+        with self._lock:
+            for key, amount in pending.items():
+                self._pending[key] += amount
+
+    def take_gauges(self) -> Dict[str, float]:
+        with self._lock:
+            gauges, self._pending_gauges = self._pending_gauges, {}
+        return gauges
+
+    def restore_gauges(self, gauges: Dict[str, float]) -> None:
+        with self._lock:
+            # A value set since the failed push is newer
+            self._pending_gauges = dict(gauges, **self._pending_gauges)
+
+    def reset(self) -> None:
+        # Replace the lock too: a forked child may inherit it held
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+        self._pending = defaultdict(float)
+        self._pending_gauges = {}
+
+
+REGISTRY = MetricsRegistry()
+# gunicorn --preload forks workers from a process that already recorded startup queries
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+def observe_dependency(dependency: str, seconds: float, error: bool = False) -> None:
+    REGISTRY.observe('shieldai_dependency_duration_seconds', {'dependency': dependency}, seconds)
+    if error:
+        REGISTRY.inc('shieldai_dependency_errors_total', {'dependency': dependency})
+
+
+@contextmanager
+def dependency_timer(dependency: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe_dependency(dependency, time.perf_counter() - start, error=True)
+        raise
+    observe_dependency(dependency, time.perf_counter() - start)
+
+
+def timed(dependency: str) -> Callable:
+    """Decorator recording each call of the function (or coroutine function) as a ``dependency`` timing."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with dependency_timer(dependency):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with dependency_timer(dependency):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_request(endpoint: str, method: str, status: int, seconds: float) -> None:
+    labels = {'endpoint': endpoint, 'method': method}
+    REGISTRY.observe('shieldai_http_request_duration_seconds', labels, seconds)
+    REGISTRY.inc('shieldai_http_requests_total', dict(labels, status=str(status)))
+
+
+def render(values: Dict[str, float]) -> str:
+    """Prometheus text exposition of flat series values."""
+    grouped: Dict[str, list] = defaultdict(list)
+    for key, value in values.items():
+        name, labels, suffix = json.loads(key)
+        grouped[name].append((labels, suffix, value))
+
+    # Buckets below a series' smallest observation were never incremented; expose them as 0
+    for name, samples in grouped.items():
+        if METRICS.get(name, ('',))[0] == 'histogram':
+            present = {(json.dumps(labels), suffix) for labels, suffix, _ in samples}
+            for labels in {json.dumps(labels) for labels, suffix, _ in samples if suffix == 'count'}:
+                samples.extend((json.loads(labels), f'le={bound}', 0.0)
+                               for bound in BUCKETS if (labels, f'le={bound}') not in present)
+
+    lines = []
+    for name in sorted(grouped):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, suffix, value in sorted(grouped[name], key=_sort_key):
+            sample, extra = name, []
+            if suffix.startswith('le='):
+                sample, extra = f"{name}_bucket", [('le', suffix[3:])]
+            elif suffix:
+                sample = f"{name}_{suffix}"
+            label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels + extra)
+            lines.append(f"{sample}{{{label_text}}} {_number(value)}" if label_text else f"{sample} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _sort_key(sample):
+    labels, suffix, _ = sample
+    if suffix.startswith('le='):
+        bound = suffix[3:]
+        return labels, 0, float('inf') if bound == '+Inf' else float(bound)
+    return labels, 1 if suffix == 'sum' else 2, 0.0
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class RedisMetricsStore:
+    """Totals of every worker in one Redis hash; workers push their increments and gauge values."""
+
+    def __init__(self, client, key: str = 'shieldai:metrics'):
+        self.client = client
+        self.key = key
+
+    def push(self, deltas: Dict[str, float], gauges: Optional[Dict[str, float]] = None) -> None:
+        if not deltas and not gauges:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for series, amount in deltas.items():
+            pipe.hincrbyfloat(self.key, series, amount)
+        for series, value in (gauges or {}).items():
+            pipe.hset(self.key, series, value)
+        pipe.execute()
+
+    def read(self) -> Dict[str, float]:
+        raw = self.client.hgetall(self.key)
+        return {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in raw.items()}
+
+
+class _Flusher:
+    """Per-worker thread pushing registry increments to the shared store."""
+
+    def __init__(self, store: RedisMetricsStore, interval: float):
+        self.store = store
+        self.interval = interval
+        self.pid = os.getpid()
+        self.errors = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, gauges = REGISTRY.take_pending(), REGISTRY.take_gauges()
+            try:
+                self.store.push(pending, gauges)
+            except Exception:
+                # Keep the increments for the next attempt
+                REGISTRY.restore_pending(pending)
+                REGISTRY.restore_gauges(gauges)
+                self.errors += 1
+                raise
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+_flusher_lock = threading.Lock()
+
+
+def _flusher(app: Flask) -> Optional[_Flusher]:
+    store = app.extensions.get('shieldai_metrics_store')
+    if store is None:
+        return None
+    flusher = app.extensions.get('shieldai_metrics_flusher')
+    # Threads don't survive gunicorn's fork, so each worker starts its own
+    if flusher is None or flusher.pid != os.getpid():
+        with _flusher_lock:
+            flusher = app.extensions.get('shieldai_metrics_flusher')
+            if flusher is None or flusher.pid != os.getpid():
+                flusher = app.extensions['shieldai_metrics_flusher'] = _Flusher(
+                    store, float(app.config.get("METRICS_FLUSH_SECONDS", 5)))
+    return flusher
+
+
+def flush(app: Flask) -> None:
+    """Push this process's metrics to the shared store now, e.g. from a command that serves no requests."""
+    flusher = _flusher(app)
+    if flusher is not None:
+        try:
+            flusher.flush()
+        except Exception:
+            app.logger.warning("Metrics store unavailable; metrics kept for the next flush")
+
+
+def init_app(app: Flask) -> None:
+    if str(app.config.get("METRICS_ENABLED", "1")).lower() in ('0', 'false', 'off'):
+        return
+
+    if (app.config.get("METRICS_BACKEND") or 'memory').lower() == 'redis':
+        import redis
+
+        client = redis.Redis.from_url(app.config.get("REDIS_URL") or "redis://localhost:6379/0")
+        app.extensions['shieldai_metrics_store'] = RedisMetricsStore(client)
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        _flusher(app)
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None and request.endpoint != 'metrics':
+            # Endpoint names (not paths) keep label cardinality bounded; streamed bodies count until the first byte
+            record_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                           time.perf_counter() - start)
+        return response
+
+    @app.route('/metrics', methods=['GET'], endpoint='metrics')
+    def metrics():
+        values = REGISTRY.snapshot()
+        flusher = _flusher(app)
+        if flusher is not None:
+            try:
+                flusher.flush()
+                values = flusher.store.read()
+            except Exception:
+                current_app.logger.warning("Metrics store unavailable; reporting this worker only")
+        return Response(render(values), mimetype='text/plain; version=0.0.4')
@@ -1,5 +1,7 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from . import db
+from .fraud_scoring import FeatureProfile, parse_timestamp
+from .metrics import dependency_timer
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
@@ -29,7 +31,8 @@ class User(db.Model):
         self.pin_hash = generate_password_hash(pin)
 
     def check_pin(self, pin):
-        return check_password_hash(self.pin_hash, pin)
+        with dependency_timer('pin_hash'):
+            return check_password_hash(self.pin_hash, pin)
 
     def to_dict(self, include_transactions: bool = False, limit: int | None = None):
         data = {
@@ -71,6 +74,8 @@ class Transaction(db.Model):
         db.CheckConstraint('amount > 0', name='amount_positive'),
         db.CheckConstraint('fraud_confidence >= 0.0 AND fraud_confidence <= 1.0', name='confidence_range'),
         db.CheckConstraint('length(recipient) >= 10', name='recipient_length_check'),
+        # Newest-first history and keyset pagination per user
+        db.Index('ix_transactions_user_timestamp_id', 'user_id', 'timestamp', 'id'),
     )
 
     def to_dict(self):
@@ -92,6 +97,27 @@ class Transaction(db.Model):
             q = q.limit(limit)
         return q.all()
 
+    @staticmethod
+    def history_for_users(user_ids, limit: int = 50):
+        """Most recent `limit` transactions for each user in one grouped query, newest first."""
+        if not user_ids:
+            return {}
+        rank = db.func.row_number().over(
+            partition_by=Transaction.user_id,
+            order_by=(Transaction.timestamp.desc(), Transaction.id.desc()),
+        ).label("rank")
+        ranked = db.session.query(Transaction.id.label("id"), rank).filter(
+            Transaction.user_id.in_(list(user_ids))
+        ).subquery()
+        rows = Transaction.query.join(ranked, ranked.c.id == Transaction.id).filter(
+            ranked.c.rank <= limit
+        ).order_by(Transaction.user_id, Transaction.timestamp.desc(), Transaction.id.desc()).all()
+
+        history = {user_id: [] for user_id in user_ids}
+        for tx in rows:
+            history[tx.user_id].append(tx)
+        return history
+
 class UserBudgetPlan(db.Model):
     __tablename__ = "user_budget_plans"
 
@@ -111,6 +137,8 @@ class UserBudgetPlan(db.Model):
         db.CheckConstraint('monthly_income > 0', name='income_positive'),
         db.CheckConstraint('savings_goal >= 0', name='savings_goal_non_negative'),
         db.CheckConstraint('savings_period_months > 0', name='savings_period_positive'),
+        # get_active_plan_for_user: filter on (user_id, is_active), newest first
+        db.Index('ix_user_budget_plans_user_active_updated', 'user_id', 'is_active', 'updated_at'),
     )
 
     # Relationship with User
@@ -145,5 +173,311 @@ class UserBudgetPlan(db.Model):
         ).all()
 
 
+class UserFeatureProfile(db.Model):
+    """Per-user rolling fraud features, maintained incrementally as transactions are written."""
+
+    __tablename__ = "user_feature_profiles"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    tx_count = db.Column(db.Integer, default=0, nullable=False)
+    amount_mean = db.Column(db.Float, default=0.0, nullable=False)
+    amount_m2 = db.Column(db.Float, default=0.0, nullable=False)  # Welford sum of squared deviations
+    hour_histogram = db.Column(db.JSON, nullable=False)
+    recipients = db.Column(db.JSON, nullable=False)
+    locations = db.Column(db.JSON, nullable=False)
+    recent_timestamps = db.Column(db.JSON, nullable=False)
+    # Bumped on every transaction written for the user, including flagged ones
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def to_profile(self) -> FeatureProfile:
+        return FeatureProfile(
+            count=self.tx_count or 0,
+            amount_mean=self.amount_mean or 0.0,
+            amount_m2=self.amount_m2 or 0.0,
+            hour_histogram=self.hour_histogram,
+            recipients=self.recipients,
+            locations=self.locations,
+            recent_timestamps=[parse_timestamp(ts) for ts in (self.recent_timestamps or [])],
+        )
+
+    def store(self, profile: FeatureProfile) -> None:
+        # Assign fresh lists so SQLAlchemy notices the JSON columns changed
+        self.tx_count = profile.count
+        self.amount_mean = profile.amount_mean
+        self.amount_m2 = profile.amount_m2
+        self.hour_histogram = list(profile.hour_histogram)
+        self.recipients = list(profile.recipients)
+        self.locations = list(profile.locations)
+        self.recent_timestamps = [ts.isoformat() for ts in profile.recent_timestamps]
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "tx_count": self.tx_count,
+            "amount_mean": self.amount_mean,
+            "amount_std": self.to_profile().amount_std,
+            "hour_histogram": self.hour_histogram,
+            "known_recipients": len(self.recipients or []),
+            "known_locations": len(self.locations or []),
+            "version": self.version,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    @staticmethod
+    def build_from_transactions(user_id: int) -> "UserFeatureProfile":
+        """Build (but do not add to the session) a profile from the user's stored transactions."""
+        history = [tx.to_dict() for tx in Transaction.query.filter_by(user_id=user_id).all()]
+        row = UserFeatureProfile(user_id=user_id, version=len(history))
+        row.store(FeatureProfile.from_history(history))
+        return row
+
+    @staticmethod
+    def profile_for_user(user_id: int) -> FeatureProfile:
+        """O(1) read of a user's features, falling back to a scan for users not yet backfilled."""
+        row = db.session.get(UserFeatureProfile, user_id)
+        if row is None:
+            row = UserFeatureProfile.build_from_transactions(user_id)
+        return row.to_profile()
+
+    @staticmethod
+    def profiles_for_users(user_ids) -> dict:
+        """Feature profiles for several users with one query (users not yet backfilled are scanned)."""
+        rows = {row.user_id: row for row in UserFeatureProfile.query.filter(
+            UserFeatureProfile.user_id.in_(list(user_ids))).all()} if user_ids else {}
+        return {
+            user_id: (rows.get(user_id) or UserFeatureProfile.build_from_transactions(user_id)).to_profile()
+            for user_id in user_ids
+        }
+
+    @staticmethod
+    def history_version(user_id: int) -> int:
+        """Counter that changes whenever a transaction is written for the user."""
+        row = db.session.get(UserFeatureProfile, user_id)
+        return row.version if row is not None else 0
+
+    @staticmethod
+    def rebuild(user_id: int | None = None) -> int:
+        """Recompute profiles from the transactions table. Returns the number of profiles written."""
+        delete_query = UserFeatureProfile.query
+        tx_query = db.session.query(
+            Transaction.user_id, Transaction.amount, Transaction.recipient,
+            Transaction.timestamp, Transaction.location, Transaction.is_fraudulent,
+        )
+        if user_id is not None:
+            delete_query = delete_query.filter_by(user_id=user_id)
+            tx_query = tx_query.filter(Transaction.user_id == user_id)
+        delete_query.delete(synchronize_session=False)
+
+        written = 0
+        current_user, profile, version = None, None, 0
+        for row in tx_query.order_by(Transaction.user_id, Transaction.timestamp).yield_per(2000):
+            if row.user_id != current_user:
+                if current_user is not None:
+                    UserFeatureProfile._write_rebuilt(current_user, profile, version)
+                    written += 1
+                current_user, profile, version = row.user_id, FeatureProfile(), 0
+            version += 1
+            if not row.is_fraudulent:
+                profile.add(row.amount, row.recipient, row.timestamp, row.location)
+        if current_user is not None:
+            UserFeatureProfile._write_rebuilt(current_user, profile, version)
+            written += 1
+
+        db.session.commit()
+        return written
+
+    @staticmethod
+    def _write_rebuilt(user_id: int, profile: FeatureProfile, version: int) -> None:
+        row = UserFeatureProfile(user_id=user_id, version=version)
+        row.store(profile)
+        db.session.add(row)
+
+
+def _create_feature_profile(session, user_id: int) -> "UserFeatureProfile":
+    """Insert a user's first profile, tolerating a concurrent insert of the same row, and lock it.
+
+    A ``SELECT ... FOR UPDATE`` on a missing row locks nothing, so two first
+    transactions for one user would both insert and the second flush would
+    fail on the primary key. Inserting with ON CONFLICT DO NOTHING and then
+    locking whichever row won avoids that.
+    """
+    row = UserFeatureProfile.build_from_transactions(user_id)
+    connection = session.connection()
+    dialect = connection.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        session.add(row)
+        return row
+
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    values = {column.name: getattr(row, column.name) for column in UserFeatureProfile.__table__.columns}
+    values["updated_at"] = values["updated_at"] or datetime.utcnow()
+    connection.execute(insert(UserFeatureProfile.__table__).values(values).on_conflict_do_nothing(
+        index_elements=[UserFeatureProfile.__table__.c.user_id]))
+    return session.get(UserFeatureProfile, user_id, with_for_update=True, populate_existing=True)
+
+
+@db.event.listens_for(db.session, "before_flush")
+def _update_feature_profiles(session, flush_context, instances):
+    """Fold newly inserted transactions into their users' feature profiles.
+
+    Runs inside the same database transaction as the insert, so the profile
+    and the transactions it summarizes are committed (or rolled back) together.
+    """
+    pending = {}
+    for obj in session.new:
+        if isinstance(obj, Transaction) and obj.user_id is not None:
+            pending.setdefault(obj.user_id, []).append(obj)
+    if not pending:
+        return
+
+    now = datetime.utcnow()
+    with session.no_autoflush:
+        for user_id, transactions in pending.items():
+            # populate_existing: the request may have loaded the row before a slow model call, and the
+            # locked database row (with anything committed since) must win over that cached copy
+            row = session.get(UserFeatureProfile, user_id, with_for_update=True, populate_existing=True)
+            if row is None:
+                row = _create_feature_profile(session, user_id)
+
+            profile = row.to_profile()
+            # Naive UTC throughout, so a tz-aware timestamp in the same flush cannot break the sort
+            timed = sorted(((parse_timestamp(tx.timestamp) or now, tx) for tx in transactions), key=lambda item: item[0])
+            for timestamp, tx in timed:
+                if not tx.is_fraudulent:
+                    profile.add(tx.amount, tx.recipient, timestamp, tx.location)
+            row.store(profile)
+            row.version = (row.version or 0) + len(transactions)
+
+
+class UserSpendingDaily(db.Model):
+    """Per-user, per-recipient, per-day spend totals, maintained as transactions are written.
+
+    Rolling 7/30/90-day views read one primary-key range per user instead of
+    aggregating the user's whole transaction history.
+    """
+
+    __tablename__ = "user_spending_daily"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    recipient = db.Column(db.String(64), primary_key=True)
+    total_amount = db.Column(db.Float, default=0.0, nullable=False)
+    tx_count = db.Column(db.Integer, default=0, nullable=False)
+
+    @staticmethod
+    def window_start(days: int, today=None):
+        """First day of a rolling window of ``days`` days ending today (UTC)."""
+        today = today or datetime.utcnow().date()
+        return today - timedelta(days=days - 1)
+
+    @staticmethod
+    def summary(user_id: int, windows=(7, 30, 90), top: int = 5, today=None) -> list:
+        """Total spend, transaction count and top recipients for each rolling window, in one range read."""
+        today = today or datetime.utcnow().date()
+        starts = {days: UserSpendingDaily.window_start(days, today) for days in windows}
+        columns = []
+        for days, start in starts.items():
+            in_window = UserSpendingDaily.day >= start
+            columns.append(db.func.sum(db.case((in_window, UserSpendingDaily.total_amount), else_=0.0)))
+            columns.append(db.func.sum(db.case((in_window, UserSpendingDaily.tx_count), else_=0)))
+        rows = db.session.query(UserSpendingDaily.recipient, *columns).filter(
+            UserSpendingDaily.user_id == user_id,
+            UserSpendingDaily.day >= min(starts.values()),
+            UserSpendingDaily.day <= today,
+        ).group_by(UserSpendingDaily.recipient).all()
+
+        result = []
+        for index, (days, start) in enumerate(starts.items()):
+            per_recipient = [
+                {"recipient": row[0], "amount": float(row[1 + 2 * index] or 0.0), "count": int(row[2 + 2 * index] or 0)}
+                for row in rows
+            ]
+            per_recipient = [r for r in per_recipient if r["count"]]
+            per_recipient.sort(key=lambda r: (-r["amount"], r["recipient"]))
+            result.append({
+                "days": days,
+                "since": start.isoformat(),
+                "total_spent": round(sum(r["amount"] for r in per_recipient), 2),
+                "transaction_count": sum(r["count"] for r in per_recipient),
+                "top_recipients": per_recipient[:top],
+            })
+        return result
+
+    @staticmethod
+    def rebuild(user_id: int | None = None) -> int:
+        """Recompute the aggregates from the transactions table. Returns the number of rows written."""
+        delete_query = UserSpendingDaily.query
+        tx_query = db.session.query(Transaction.user_id, Transaction.recipient, Transaction.timestamp, Transaction.amount)
+        if user_id is not None:
+            delete_query = delete_query.filter_by(user_id=user_id)
+            tx_query = tx_query.filter(Transaction.user_id == user_id)
+        delete_query.delete(synchronize_session=False)
+
+        buckets = {}
+        for row in tx_query.yield_per(5000):
+            bucket = buckets.setdefault((row.user_id, row.timestamp.date(), row.recipient), [0.0, 0])
+            bucket[0] += row.amount
+            bucket[1] += 1
+        db.session.bulk_insert_mappings(UserSpendingDaily, [
+            {"user_id": key[0], "day": key[1], "recipient": key[2], "total_amount": total, "tx_count": count}
+            for key, (total, count) in buckets.items()
+        ])
+        db.session.commit()
+        return len(buckets)
+
+
+def _apply_spending_deltas(session, deltas: dict) -> None:
+    """Add per-(user, day, recipient) totals with one upsert statement where the dialect supports it."""
+    table = UserSpendingDaily.__table__
+    rows = [
+        {"user_id": key[0], "day": key[1], "recipient": key[2], "total_amount": total, "tx_count": count}
+        for key, (total, count) in deltas.items()
+    ]
+    connection = session.connection()
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day, table.c.recipient],
+            set_={
+                "total_amount": table.c.total_amount + stmt.excluded.total_amount,
+                "tx_count": table.c.tx_count + stmt.excluded.tx_count,
+            },
+        )
+        connection.execute(stmt)
+        return
+
+    for row in rows:
+        existing = session.get(UserSpendingDaily, (row["user_id"], row["day"], row["recipient"]), with_for_update=True)
+        if existing is None:
+            session.add(UserSpendingDaily(**row))
+        else:
+            existing.total_amount += row["total_amount"]
+            existing.tx_count += row["tx_count"]
+
+
+@db.event.listens_for(db.session, "before_flush")
+def _update_spending_aggregates(session, flush_context, instances):
+    """Add newly inserted transactions to the daily spending aggregates in the same database transaction."""
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Transaction) and obj.user_id is not None and obj.amount is not None:
+            day = (obj.timestamp or datetime.utcnow()).date()
+            bucket = deltas.setdefault((obj.user_id, day, obj.recipient), [0.0, 0])
+            bucket[0] += float(obj.amount)
+            bucket[1] += 1
+    if deltas:
+        with session.no_autoflush:
+            _apply_spending_deltas(session, deltas)
+
+
 # Import M-Pesa models to ensure they are registered with SQLAlchemy
 from .mpesa import models as mpesa_models  # noqa: E402,F401
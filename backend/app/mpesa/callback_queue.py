@@ -0,0 +1,207 @@
+"""
+Fast acknowledgement for STK push callbacks.
+
+The callback route validates the payload, appends the raw body to the
+``mpesa_callback_inbox`` table and returns 200 straight away. A consumer
+then applies queued callbacks in batches with
+``MpesaCallbackHandler.apply_stk_push_callback``: one query loads the batch's
+transactions and one commit saves them. The handler ignores callbacks for
+transactions that are no longer pending, so redelivery is harmless.
+
+Callbacks that cannot be applied yet (e.g. the STK push row is not committed)
+are retried with backoff and given up after MPESA_CALLBACK_MAX_ATTEMPTS.
+
+    MPESA_CALLBACK_MODE           queue (default) or sync (apply inside the request)
+    MPESA_CALLBACK_CONSUMER       thread (default; one consumer per serving worker, started
+                                  by start_background_workers so a backlog left by a restart
+                                  drains on its own) or none (run "python run.py process-callbacks")
+    MPESA_CALLBACK_BATCH_SIZE     callbacks per batch
+    MPESA_CALLBACK_POLL_SECONDS   idle consumer poll interval
+    MPESA_CALLBACK_MAX_ATTEMPTS   attempts before a callback is given up on
+
+On PostgreSQL batches are claimed with SKIP LOCKED, so consumers in several
+workers never apply the same rows.
+"""
+
+import json
+import os
+import threading
+import weakref
+from datetime import datetime, timedelta
+from typing import Optional
+
+from flask import Flask, current_app
+
+from .. import db
+from .callbacks import MpesaCallbackHandler
+from .models import MpesaCallbackInbox, MpesaTransaction
+
+
+def enqueue_callback(raw_payload: str, checkout_request_id: Optional[str]) -> MpesaCallbackInbox:
+    """Durably store a validated callback; the caller acknowledges once this returns."""
+    entry = MpesaCallbackInbox(payload=raw_payload, checkout_request_id=checkout_request_id)
+    db.session.add(entry)
+    db.session.commit()
+    return entry
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(300, 2 ** attempts))
+
+
+def process_callback_batch(batch_size: int = 100, max_attempts: int = 5) -> int:
+    """Apply up to ``batch_size`` queued callbacks; returns how many were taken from the queue."""
+    now = datetime.utcnow()
+    entries = MpesaCallbackInbox.query\
+        .filter(MpesaCallbackInbox.processed_at.is_(None), MpesaCallbackInbox.available_at <= now)\
+        .order_by(MpesaCallbackInbox.id)\
+        .limit(batch_size)\
+        .with_for_update(skip_locked=True)\
+        .all()
+    if not entries:
+        return 0
+
+    ids = {entry.checkout_request_id for entry in entries if entry.checkout_request_id}
+    transactions = {
+        tx.checkout_request_id: tx
+        # Locked in id order, so the reconciler (which locks one row at a time) cannot apply a query
+        # result to a transaction this batch is finishing
+        for tx in MpesaTransaction.query.filter(MpesaTransaction.checkout_request_id.in_(ids))
+        .order_by(MpesaTransaction.id).with_for_update()
+    } if ids else {}
+
+    handler = MpesaCallbackHandler()
+    for entry in entries:
+        _apply(handler, entry, transactions.get, max_attempts)
+    try:
+        db.session.commit()
+    except Exception:
+        # One bad row (e.g. a duplicate receipt number) fails the whole flush; redo the batch row by row
+        db.session.rollback()
+        current_app.logger.exception("M-Pesa callback batch failed; applying callbacks one at a time")
+        for entry_id in [entry.id for entry in entries]:
+            _apply_one(handler, entry_id, max_attempts)
+    return len(entries)
+
+
+def _apply(handler, entry, find_transaction, max_attempts):
+    entry.attempts += 1
+    try:
+        result, status_code = handler.apply_stk_push_callback(
+            json.loads(entry.payload), find_transaction=find_transaction, raw_payload=entry.payload)
+        error = None if status_code == 200 else result.get("error")
+    except Exception as e:
+        status_code, error = 500, str(e)
+
+    entry.result_status = status_code
+    entry.last_error = error[:256] if error else None
+    if status_code == 200 or entry.attempts >= max_attempts:
+        entry.processed_at = datetime.utcnow()
+        if error:
+            current_app.logger.error(
+                f"Giving up on M-Pesa callback {entry.id} ({entry.checkout_request_id}) after "
+                f"{entry.attempts} attempts: {error}"
+            )
+    else:
+        entry.available_at = datetime.utcnow() + _retry_delay(entry.attempts)
+
+
+def _apply_one(handler, entry_id, max_attempts):
+    entry = db.session.get(MpesaCallbackInbox, entry_id)
+    if entry is None or entry.processed_at is not None:
+        return
+    try:
+        _apply(handler, entry, None, max_attempts)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        entry = db.session.get(MpesaCallbackInbox, entry_id)
+        entry.attempts += 1
+        entry.result_status = 500
+        entry.last_error = str(e)[:256]
+        if entry.attempts >= max_attempts:
+            entry.processed_at = datetime.utcnow()
+        else:
+            entry.available_at = datetime.utcnow() + _retry_delay(entry.attempts)
+        db.session.commit()
+
+
+def drain_callbacks(batch_size: int = 100, max_attempts: int = 5) -> int:
+    """Apply batches until nothing is ready; returns the number of callbacks taken."""
+    total = 0
+    while True:
+        taken = process_callback_batch(batch_size, max_attempts)
+        total += taken
+        if taken < batch_size:
+            return total
+
+
+class CallbackConsumer:
+    """Background thread applying queued callbacks; woken by each enqueue, polls when idle."""
+
+    def __init__(self, app: Flask, batch_size: int = 100, poll_seconds: float = 5.0, max_attempts: int = 5):
+        self.app = app
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._start()
+        _consumers.add(self)
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='mpesa-callbacks', daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    drain_callbacks(self.batch_size, self.max_attempts)
+                except Exception:
+                    current_app.logger.exception("M-Pesa callback consumer failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+_consumers: "weakref.WeakSet[CallbackConsumer]" = weakref.WeakSet()
+
+
+def _restart_consumers() -> None:
+    # The consumer thread does not survive a fork (gunicorn --preload)
+    for consumer in list(_consumers):
+        if not consumer._stop.is_set():
+            consumer._start()
+
+
+os.register_at_fork(after_in_child=_restart_consumers)
+
+_build_lock = threading.Lock()
+
+
+def get_callback_consumer(app: Optional[Flask] = None) -> Optional[CallbackConsumer]:
+    """Return the app's consumer, starting it on first use (None when disabled)."""
+    app = app or current_app._get_current_object()
+    if 'shieldai_mpesa_callbacks' not in app.extensions:
+        with _build_lock:
+            if 'shieldai_mpesa_callbacks' not in app.extensions:
+                consumer = None
+                if (app.config.get("MPESA_CALLBACK_CONSUMER") or "thread").lower() == "thread":
+                    consumer = CallbackConsumer(
+                        app,
+                        batch_size=int(app.config.get("MPESA_CALLBACK_BATCH_SIZE", 100)),
+                        poll_seconds=float(app.config.get("MPESA_CALLBACK_POLL_SECONDS", 5)),
+                        max_attempts=int(app.config.get("MPESA_CALLBACK_MAX_ATTEMPTS", 5)),
+                    )
+                app.extensions['shieldai_mpesa_callbacks'] = consumer
+    return app.extensions['shieldai_mpesa_callbacks']
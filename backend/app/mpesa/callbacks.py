@@ -11,84 +11,100 @@ class MpesaCallbackHandler:
         """Handle STK Push callback from Safaricom"""
 
         try:
-            # Extract callback data
-            stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
-
-            if not stk_callback:
-                current_app.logger.error("Invalid callback data: missing stkCallback")
-                return {"error": "Invalid callback data"}, 400
-
-            merchant_request_id = stk_callback.get('MerchantRequestID')
-            checkout_request_id = stk_callback.get('CheckoutRequestID')
-            result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc')
-            callback_metadata = stk_callback.get('CallbackMetadata', {})
-
-            # Find the transaction
-            transaction = MpesaTransaction.query.filter_by(
-                checkout_request_id=checkout_request_id
-            ).first()
-
-            if not transaction:
-                current_app.logger.error(f"Transaction not found for CheckoutRequestID: {checkout_request_id}")
-                return {"error": "Transaction not found"}, 404
-
-            # Store callback data
-            transaction.callback_data = json.dumps(callback_data)
-
-            # Process based on result code
-            if result_code == 0:
-                # Success - extract payment details
-                amount = None
-                receipt_number = None
-                transaction_date = None
-                phone_number = None
-
-                if 'Item' in callback_metadata:
-                    for item in callback_metadata['Item']:
-                        if item.get('Name') == 'Amount':
-                            amount = item.get('Value')
-                        elif item.get('Name') == 'MpesaReceiptNumber':
-                            receipt_number = item.get('Value')
-                        elif item.get('Name') == 'TransactionDate':
-                            transaction_date = item.get('Value')
-                        elif item.get('Name') == 'PhoneNumber':
-                            phone_number = item.get('Value')
-
-                # Update transaction
-                transaction.mark_completed(receipt_number, result_desc)
-                transaction.mpesa_receipt_number = receipt_number
-
-                current_app.logger.info(
-                    f"STK Push successful: {receipt_number}, amount: {amount}, "
-                    f"user: {transaction.user_id}"
-                )
-
-                # TODO: Here you could trigger additional business logic
-                # like updating user balance, sending notifications, etc.
-
-            else:
-                # Failed or cancelled
-                if result_code == 1032:
-                    transaction.mark_cancelled(result_desc)
-                else:
-                    transaction.mark_failed(result_code, result_desc)
-
-                current_app.logger.warning(
-                    f"STK Push failed: {result_code} - {result_desc}, "
-                    f"user: {transaction.user_id}"
-                )
-
-            # Save changes
-            db.session.commit()
-
-            return {"success": True, "message": "Callback processed successfully"}, 200
+            result, status_code = self.apply_stk_push_callback(callback_data)
+            if status_code == 200:
+                db.session.commit()
+            return result, status_code
 
         except Exception as e:
             current_app.logger.exception(f"Error processing STK Push callback: {e}")
             db.session.rollback()
             return {"error": "Internal server error"}, 500
 
+    def apply_stk_push_callback(self, callback_data, find_transaction=None, raw_payload=None):
+        """
+        Apply a callback to its transaction without committing.
+
+        Callbacks for transactions that already left "pending" are acknowledged
+        and ignored, so Safaricom retries and queue redelivery are harmless.
+        ``find_transaction`` maps a CheckoutRequestID to its transaction (the
+        consumer passes a preloaded batch); ``raw_payload`` is stored as-is.
+        """
+        # Extract callback data
+        stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
+
+        if not stk_callback:
+            current_app.logger.error("Invalid callback data: missing stkCallback")
+            return {"error": "Invalid callback data"}, 400
+
+        merchant_request_id = stk_callback.get('MerchantRequestID')
+        checkout_request_id = stk_callback.get('CheckoutRequestID')
+        result_code = stk_callback.get('ResultCode')
+        result_desc = stk_callback.get('ResultDesc')
+        callback_metadata = stk_callback.get('CallbackMetadata', {})
+
+        # Find the transaction
+        find_transaction = find_transaction or MpesaTransaction.get_by_checkout_request_id
+        transaction = find_transaction(checkout_request_id)
+
+        if not transaction:
+            current_app.logger.error(f"Transaction not found for CheckoutRequestID: {checkout_request_id}")
+            return {"error": "Transaction not found"}, 404
+
+        if transaction.status != "pending":
+            current_app.logger.info(
+                f"Duplicate callback for CheckoutRequestID {checkout_request_id} ignored (status {transaction.status})"
+            )
+            return {"success": True, "message": "Callback already processed"}, 200
+
+        # Store callback data
+        transaction.callback_data = raw_payload if raw_payload is not None else json.dumps(callback_data)
+
+        # Process based on result code
+        if result_code == 0:
+            # Success - extract payment details
+            amount = None
+            receipt_number = None
+            transaction_date = None
+            phone_number = None
+
+            if 'Item' in callback_metadata:
+                for item in callback_metadata['Item']:
+                    if item.get('Name') == 'Amount':
+                        amount = item.get('Value')
+                    elif item.get('Name') == 'MpesaReceiptNumber':
+                        receipt_number = item.get('Value')
+                    elif item.get('Name') == 'TransactionDate':
+                        transaction_date = item.get('Value')
+                    elif item.get('Name') == 'PhoneNumber':
+                        phone_number = item.get('Value')
+
+            # Update transaction
+            transaction.mark_completed(receipt_number, result_desc)
+            transaction.mpesa_receipt_number = receipt_number
+
+            current_app.logger.info(
+                f"STK Push successful: {receipt_number}, amount: {amount}, "
+                f"user: {transaction.user_id}"
+            )
+
+            # TODO: Here you could trigger additional business logic
+            # like updating user balance, sending notifications, etc.
+
+        else:
+            # Failed or cancelled
+            if result_code == 1032:
+                transaction.mark_cancelled(result_desc)
+            else:
+                transaction.mark_failed(result_code, result_desc)
+
+            current_app.logger.warning(
+                f"STK Push failed: {result_code} - {result_desc}, "
+                f"user: {transaction.user_id}"
+            )
+
+        return {"success": True, "message": "Callback processed successfully"}, 200
+
     def validate_callback(self, callback_data):
         """Basic validation of callback data"""
         required_fields = ['Body']
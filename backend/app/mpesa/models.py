@@ -37,6 +37,10 @@ class MpesaTransaction(db.Model):
         db.CheckConstraint('amount > 0', name='mpesa_amount_positive'),
         db.CheckConstraint('length(phone_number) >= 10', name='mpesa_phone_length_check'),
         db.CheckConstraint("status IN ('pending', 'completed', 'failed', 'cancelled')", name='mpesa_status_check'),
+        # Newest-first listing and keyset pagination per user
+        db.Index('ix_mpesa_transactions_user_created_id', 'user_id', 'created_at', 'id'),
+        # Listing filtered by status
+        db.Index('ix_mpesa_transactions_user_status_created', 'user_id', 'status', 'created_at', 'id'),
     )
 
     def to_dict(self):
@@ -84,4 +88,27 @@ class MpesaTransaction(db.Model):
         """Mark transaction as cancelled"""
         self.status = "cancelled"
         self.result_code = 1032  # C2B timeout
-        self.result_desc = result_desc
\ No newline at end of file
+        self.result_desc = result_desc
+
+
+class MpesaCallbackInbox(db.Model):
+    """Append-only log of raw STK callbacks, applied by the callback consumer"""
+
+    __tablename__ = "mpesa_callback_inbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    checkout_request_id = db.Column(db.String(64), nullable=True, index=True)
+    payload = db.Column(db.Text, nullable=False)  # request body as received
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Consumer bookkeeping; processed_at is set once the callback is applied or given up on
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    result_status = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.String(256), nullable=True)
+
+    __table_args__ = (
+        # Next batch of unprocessed callbacks in arrival order
+        db.Index('ix_mpesa_callback_inbox_pending', 'processed_at', 'available_at', 'id'),
+    )
@@ -1,8 +1,19 @@
 import os
 import base64
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime
 from flask import current_app
+from .. import http_client
+from ..metrics import timed
+from .token_cache import get_token_cache, token_key
+
+
+class MpesaApiError(Exception):
+    """A failed Daraja request; ``body`` holds the decoded error response, if there was one."""
+
+    def __init__(self, message, body=None):
+        super().__init__(message)
+        self.body = body if isinstance(body, dict) else {}
 
 
 class MpesaService:
@@ -24,13 +35,12 @@ class MpesaService:
         self.c2b_register_url = f"{self.base_url}/mpesa/c2b/v1/registerurl"
         self.c2b_simulate_url = f"{self.base_url}/mpesa/c2b/v1/simulate"
 
+        # Read timeout for Daraja calls; the connect timeout comes from http_client
+        self.timeout_seconds = float(os.getenv('MPESA_TIMEOUT_SECONDS', '30'))
+
         # Validate configuration
         self._validate_config()
 
-        # Cache for access token
-        self._access_token = None
-        self._token_expires_at = None
-
     def _validate_config(self):
         """Validate that all required configuration is present"""
         required = [
@@ -42,12 +52,15 @@ class MpesaService:
             raise ValueError(f"Missing M-Pesa configuration: {', '.join(missing)}")
 
     def get_access_token(self):
-        """Get OAuth access token from Safaricom with caching"""
-        # Check if we have a valid cached token
-        if self._access_token and self._token_expires_at:
-            if datetime.now() < self._token_expires_at:
-                return self._access_token
+        """Get OAuth access token from Safaricom, shared through the process-wide token cache"""
+        return get_token_cache().get(self._token_key(), self._fetch_access_token)
+
+    def _token_key(self):
+        return token_key(self.base_url, self.consumer_key)
 
+    @timed('mpesa_oauth')
+    def _fetch_access_token(self):
+        """Request a new token from Safaricom; returns (token, expires_in seconds)"""
         try:
             # Prepare authentication
             auth = base64.b64encode(
@@ -60,27 +73,24 @@ class MpesaService:
             }
 
             # Make request
-            response = requests.get(
+            response = http_client.get(
                 self.oauth_url,
                 params={"grant_type": "client_credentials"},
                 headers=headers,
-                timeout=30
+                read_timeout=self.timeout_seconds
             )
             response.raise_for_status()
 
             data = response.json()
             access_token = data.get('access_token')
-            expires_in = data.get('expires_in', 3600)  # Default 1 hour
+            # Daraja sends expires_in as a string
+            expires_in = float(data.get('expires_in') or 3600)  # Default 1 hour
 
             if not access_token:
                 raise Exception("No access token received from M-Pesa")
 
-            # Cache the token
-            self._access_token = access_token
-            self._token_expires_at = datetime.now() + timedelta(seconds=expires_in - 60)  # Expire 1 min early
-
             current_app.logger.info("Successfully obtained M-Pesa access token")
-            return access_token
+            return access_token, expires_in
 
         except requests.RequestException as e:
             current_app.logger.error(f"Failed to get M-Pesa access token: {e}")
@@ -95,31 +105,40 @@ class MpesaService:
         password = base64.b64encode(password_string.encode()).decode()
         return password, timestamp
 
+    @timed('mpesa')
     def make_api_request(self, method, url, data=None, params=None):
         """Make authenticated API request to M-Pesa"""
         try:
-            access_token = self.get_access_token()
-
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-
-            response = requests.request(
-                method=method,
-                url=url,
-                json=data,
-                params=params,
-                headers=headers,
-                timeout=30
-            )
+            response = self._authorized_request(method, url, data, params)
+            if response.status_code == 401:
+                # The shared token was revoked or expired early; fetch a new one and retry once
+                get_token_cache().invalidate(self._token_key())
+                response = self._authorized_request(method, url, data, params)
 
             response.raise_for_status()
             return response.json()
 
         except requests.RequestException as e:
             current_app.logger.error(f"M-Pesa API request failed: {e}")
-            raise Exception(f"M-Pesa API request failed: {str(e)}")
+            try:
+                body = e.response.json() if e.response is not None else None
+            except ValueError:
+                body = None
+            raise MpesaApiError(f"M-Pesa API request failed: {str(e)}", body)
+
+    def _authorized_request(self, method, url, data, params):
+        headers = {
+            "Authorization": f"Bearer {self.get_access_token()}",
+            "Content-Type": "application/json"
+        }
+        return http_client.request(
+            method,
+            url,
+            json=data,
+            params=params,
+            headers=headers,
+            read_timeout=self.timeout_seconds
+        )
 
     def format_phone_number(self, phone_number):
         """Format phone number to international format (254XXXXXXXXX)"""
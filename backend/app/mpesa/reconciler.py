@@ -0,0 +1,267 @@
+"""
+Reconciliation of STK pushes whose callback never arrived.
+
+Pending transactions older than MPESA_RECONCILE_MIN_AGE_SECONDS are paged by
+id in chunks. Each chunk's CheckoutRequestIDs are queried on Daraja by a
+small thread pool, limited to MPESA_RECONCILE_RATE_PER_SECOND requests. The
+answers are applied with ``MpesaCallbackHandler.apply_stk_push_callback``,
+so a query result makes the same state transitions a callback would, and a
+late callback afterwards is ignored. Each answer is applied to the row
+re-read under a row lock (SELECT ... FOR UPDATE) and committed on its own,
+so a callback the consumer applied while the queries were in flight is never
+overwritten; such rows are counted as already_resolved. Checkouts Daraja
+reports as still processing (error code 500.001.1001, counted as still_pending) or that fail
+to query (counted as errors) stay pending and are tried again on the next run.
+
+    MPESA_RECONCILER                   none (default) or thread; with none run
+                                       "python run.py reconcile" in one process
+    MPESA_RECONCILE_INTERVAL_SECONDS   pause between runs
+    MPESA_RECONCILE_MIN_AGE_SECONDS    pending rows younger than this are left to their callback
+    MPESA_RECONCILE_CHUNK_SIZE         pending rows read and queried per chunk
+    MPESA_RECONCILE_CONCURRENCY        Daraja queries in flight
+    MPESA_RECONCILE_RATE_PER_SECOND    Daraja queries started per second
+
+Each run is recorded in the shieldai_mpesa_reconcile_* series on /metrics:
+runs, checks by outcome (throughput), run duration and the age of the oldest
+pending transaction (lag). With METRICS_BACKEND=redis a run made by
+"python run.py reconcile" is pushed to the shared store when it ends, so it
+shows on every worker's /metrics. /api/health additionally reports the
+in-process reconciler (MPESA_RECONCILER=thread) under mpesa_reconciler.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Flask, current_app
+
+from .. import db, metrics
+from ..metrics import REGISTRY
+from .callbacks import MpesaCallbackHandler
+from .mpesa_service import MpesaApiError
+from .models import MpesaTransaction
+from .stk_push import StkPushService
+
+# Daraja's STK query answer while the customer has not yet responded to the prompt
+STILL_PROCESSING_CODE = '500.001.1001'
+# Outcome of a query answer for a transaction a callback finished in the meantime
+ALREADY_RESOLVED = 'already_resolved'
+
+
+class RateLimiter:
+    """Spaces acquisitions at least 1/rate seconds apart across threads."""
+
+    def __init__(self, rate_per_second: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = self._clock()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            self._sleep(slot - now)
+
+
+class MpesaReconciler:
+    def __init__(self, app: Flask, chunk_size: int = 100, concurrency: int = 4, rate_per_second: float = 5.0,
+                 min_age_seconds: float = 120.0, interval_seconds: float = 60.0):
+        self.app = app
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate_per_second)
+        self.min_age_seconds = min_age_seconds
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, Any] = {
+            'runs': 0,
+            'checked': 0,
+            'resolved': {'completed': 0, 'failed': 0, 'cancelled': 0},
+            'still_pending': 0,
+            'already_resolved': 0,
+            'errors': 0,
+            'last_run': None,
+        }
+
+    def run_once(self) -> Dict[str, Any]:
+        """Reconcile every stale pending transaction once; returns the run's metrics."""
+        started = time.monotonic()
+        started_at = datetime.utcnow()
+        cutoff = started_at - timedelta(seconds=self.min_age_seconds)
+        service = StkPushService()
+        handler = MpesaCallbackHandler()
+        run = {'checked': 0, 'resolved': 0, 'still_pending': 0, 'already_resolved': 0, 'errors': 0,
+               'max_resolved_lag_seconds': None}
+
+        after_id = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='mpesa-reconcile') as pool:
+            while True:
+                chunk = MpesaTransaction.query\
+                    .filter(MpesaTransaction.status == 'pending',
+                            MpesaTransaction.checkout_request_id.isnot(None),
+                            MpesaTransaction.created_at <= cutoff,
+                            MpesaTransaction.id > after_id)\
+                    .order_by(MpesaTransaction.id)\
+                    .limit(self.chunk_size)\
+                    .all()
+                if not chunk:
+                    break
+                after_id = chunk[-1].id
+
+                checkout_ids = [tx.checkout_request_id for tx in chunk]
+                # Release the read before the slow queries; answers are applied to freshly locked rows
+                db.session.commit()
+                for checkout_request_id, result, error in pool.map(
+                        lambda cid: self._query(service, cid), checkout_ids):
+                    run['checked'] += 1
+                    if error:
+                        run['errors'] += 1
+                        REGISTRY.inc('shieldai_mpesa_reconcile_checked_total', {'outcome': 'error'})
+                        continue
+                    outcome, created_at = self._apply(handler, checkout_request_id, result)
+                    if outcome in (None, ALREADY_RESOLVED):
+                        key = 'still_pending' if outcome is None else ALREADY_RESOLVED
+                        run[key] += 1
+                        REGISTRY.inc('shieldai_mpesa_reconcile_checked_total', {'outcome': key})
+                        continue
+                    run['resolved'] += 1
+                    REGISTRY.inc('shieldai_mpesa_reconcile_checked_total', {'outcome': outcome})
+                    self._count_resolved(outcome)
+                    lag = (datetime.utcnow() - created_at).total_seconds()
+                    run['max_resolved_lag_seconds'] = max(run['max_resolved_lag_seconds'] or 0.0, round(lag, 3))
+
+                if len(chunk) < self.chunk_size:
+                    break
+
+        elapsed = time.monotonic() - started
+        oldest = db.session.query(db.func.min(MpesaTransaction.created_at))\
+            .filter(MpesaTransaction.status == 'pending').scalar()
+        run.update({
+            'started_at': started_at.isoformat(),
+            'seconds': round(elapsed, 3),
+            'checked_per_second': round(run['checked'] / elapsed, 2) if elapsed > 0 else None,
+            # Lag: how long the oldest transaction still pending has been waiting for a final state
+            'oldest_pending_age_seconds': round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else None,
+        })
+        REGISTRY.inc('shieldai_mpesa_reconcile_runs_total', {})
+        REGISTRY.observe('shieldai_mpesa_reconcile_run_duration_seconds', {}, elapsed)
+        REGISTRY.set('shieldai_mpesa_reconcile_oldest_pending_age_seconds', {},
+                     run['oldest_pending_age_seconds'] or 0.0)
+        REGISTRY.set('shieldai_mpesa_reconcile_last_run_timestamp_seconds', {}, time.time())
+        metrics.flush(self.app)
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['checked'] += run['checked']
+            self._stats['still_pending'] += run['still_pending']
+            self._stats['already_resolved'] += run['already_resolved']
+            self._stats['errors'] += run['errors']
+            self._stats['last_run'] = run
+        return run
+
+    def _query(self, service, checkout_request_id):
+        self.limiter.acquire()
+        with self.app.app_context():
+            try:
+                return checkout_request_id, service.query_transaction_status(checkout_request_id), None
+            except Exception as e:
+                if isinstance(e, MpesaApiError) and e.body.get('errorCode') == STILL_PROCESSING_CODE:
+                    # Not an error: the customer has not answered yet; no result means still pending
+                    return checkout_request_id, None, None
+                current_app.logger.info(f"STK query for {checkout_request_id} not resolved: {e}")
+                return checkout_request_id, None, str(e)
+
+    def _apply(self, handler, checkout_request_id, result) -> Tuple[Optional[str], Optional[datetime]]:
+        """Apply a query result as a callback and commit it.
+
+        Returns the new status (None if still pending, ALREADY_RESOLVED if a
+        callback finished the transaction first) and the transaction's created_at.
+        """
+        result_code = (result or {}).get('ResultCode')
+        if result_code is None or str(result_code).strip() == '':
+            return None, None
+        transaction = MpesaTransaction.query\
+            .filter_by(checkout_request_id=checkout_request_id)\
+            .with_for_update()\
+            .populate_existing()\
+            .first()
+        if transaction is None or transaction.status != 'pending':
+            db.session.commit()
+            return ALREADY_RESOLVED, None
+        callback = {'Body': {'stkCallback': {
+            'MerchantRequestID': result.get('MerchantRequestID'),
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': int(result_code),
+            'ResultDesc': result.get('ResultDesc'),
+        }}}
+        handler.apply_stk_push_callback(callback, find_transaction=lambda _: transaction,
+                                        raw_payload=json.dumps(result))
+        status, created_at = transaction.status, transaction.created_at
+        db.session.commit()
+        return (status if status != 'pending' else None), created_at
+
+    def _count_resolved(self, status: str) -> None:
+        with self._lock:
+            self._stats['resolved'][status] = self._stats['resolved'].get(status, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='mpesa-reconciler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception:
+                    current_app.logger.exception("M-Pesa reconciliation run failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def build_reconciler(app: Flask) -> MpesaReconciler:
+    config = app.config
+    return MpesaReconciler(
+        app,
+        chunk_size=int(config.get("MPESA_RECONCILE_CHUNK_SIZE", 100)),
+        concurrency=int(config.get("MPESA_RECONCILE_CONCURRENCY", 4)),
+        rate_per_second=float(config.get("MPESA_RECONCILE_RATE_PER_SECOND", 5)),
+        min_age_seconds=float(config.get("MPESA_RECONCILE_MIN_AGE_SECONDS", 120)),
+        interval_seconds=float(config.get("MPESA_RECONCILE_INTERVAL_SECONDS", 60)),
+    )
+
+
+_build_lock = threading.Lock()
+
+
+def get_reconciler(app: Optional[Flask] = None) -> MpesaReconciler:
+    """Return the app's reconciler, creating it on first use."""
+    app = app or current_app._get_current_object()
+    if 'shieldai_mpesa_reconciler' not in app.extensions:
+        with _build_lock:
+            if 'shieldai_mpesa_reconciler' not in app.extensions:
+                app.extensions['shieldai_mpesa_reconciler'] = build_reconciler(app)
+    return app.extensions['shieldai_mpesa_reconciler']
+
+
+def reconciler_snapshot() -> Optional[Dict[str, Any]]:
+    """Metrics of the current app's reconciler, or None if it has not been created."""
+    reconciler = current_app.extensions.get('shieldai_mpesa_reconciler')
+    return reconciler.snapshot() if reconciler is not None else None
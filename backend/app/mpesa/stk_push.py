@@ -1,4 +1,5 @@
 import os
+import requests
 from datetime import datetime
 from flask import current_app
 from .. import db
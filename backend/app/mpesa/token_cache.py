@@ -0,0 +1,190 @@
+"""
+Daraja OAuth access tokens shared across requests, threads and workers.
+
+A Daraja token is valid for an hour, but services are created per request,
+so a token held on the instance was fetched again for every STK push. The
+cache lives for the life of the process (``app.extensions``) and refreshes
+single-flight: when the token has expired, one thread fetches a new one
+while the others wait for it. With the redis backend the token and the
+refresh lock are shared by all gunicorn workers.
+
+    MPESA_TOKEN_CACHE_BACKEND   memory (default) or redis
+    MPESA_TOKEN_REFRESH_MARGIN  seconds before expiry to treat a token as stale (default 60)
+    REDIS_URL                   used by the redis backend
+
+Redis errors fall back to fetching the token in-process.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import current_app
+
+# fetch() returns the token and its lifetime in seconds
+Fetch = Callable[[], Tuple[str, float]]
+
+
+class AccessTokenCache:
+    """In-process token cache with a per-credential refresh lock."""
+
+    def __init__(self, refresh_margin: float = 60.0, clock: Callable[[], float] = time.time):
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refresh_locks: Dict[str, threading.Lock] = {}
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self.fetches = 0
+
+    def get(self, key: str, fetch: Fetch) -> str:
+        token = self._peek(key)
+        if token:
+            return token
+        with self._refresh_lock(key):
+            # Another thread may have refreshed while this one waited
+            token = self._peek(key)
+            if token:
+                return token
+            return self._refresh(key, fetch)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._tokens.pop(key, None)
+
+    def _refresh_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._refresh_locks.setdefault(key, threading.Lock())
+
+    def _peek(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._tokens.get(key)
+        if entry and entry[1] > self._clock():
+            return entry[0]
+        return None
+
+    def _refresh(self, key: str, fetch: Fetch) -> str:
+        token, expires_in = fetch()
+        with self._lock:
+            self.fetches += 1
+            self._tokens[key] = (token, self._clock() + max(0.0, expires_in - self.refresh_margin))
+        return token
+
+
+class RedisAccessTokenCache(AccessTokenCache):
+    """Token shared by all workers through Redis.
+
+    Threads in a worker still queue on the local lock first. The thread that
+    gets through takes a short-lived ``SET NX`` lock in Redis, so a single
+    worker fetches while the others poll for the token it stores.
+    """
+
+    def __init__(self, client, namespace: str = "shieldai:mpesa_token", refresh_margin: float = 60.0,
+                 lock_seconds: float = 10.0, poll_interval: float = 0.05,
+                 clock: Callable[[], float] = time.time):
+        super().__init__(refresh_margin=refresh_margin, clock=clock)
+        self.client = client
+        self.namespace = namespace
+        self.lock_seconds = lock_seconds
+        self.poll_interval = poll_interval
+        self.errors = 0
+
+    def _peek(self, key: str) -> Optional[str]:
+        token = super()._peek(key)
+        if token:
+            return token
+        try:
+            raw = self.client.get(f"{self.namespace}:{key}")
+            ttl = self.client.ttl(f"{self.namespace}:{key}") if raw is not None else None
+        except Exception:
+            self.errors += 1
+            return None
+        if raw is None or not ttl or ttl <= 0:
+            return None
+        token = raw.decode() if isinstance(raw, bytes) else raw
+        # Keep a local copy for the remaining Redis TTL (already net of the margin)
+        with self._lock:
+            self._tokens[key] = (token, self._clock() + ttl)
+        return token
+
+    def _refresh(self, key: str, fetch: Fetch) -> str:
+        lock_key = f"{self.namespace}:{key}:lock"
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_seconds
+        try:
+            while not self.client.set(lock_key, owner, ex=max(1, int(self.lock_seconds)), nx=True):
+                # Another worker is fetching; use its token once stored
+                token = self._peek(key)
+                if token:
+                    return token
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(self.poll_interval)
+        except Exception:
+            self.errors += 1
+            return super()._refresh(key, fetch)
+
+        try:
+            # The previous holder may have stored a token just before releasing the lock
+            token = self._peek(key)
+            if token:
+                return token
+            token, expires_in = fetch()
+            with self._lock:
+                self.fetches += 1
+            lifetime = max(1, int(expires_in - self.refresh_margin))
+            try:
+                self.client.set(f"{self.namespace}:{key}", token, ex=lifetime)
+            except Exception:
+                self.errors += 1
+            with self._lock:
+                self._tokens[key] = (token, self._clock() + lifetime)
+            return token
+        finally:
+            try:
+                if self._decode(self.client.get(lock_key)) == owner:
+                    self.client.delete(lock_key)
+            except Exception:
+                self.errors += 1
+
+    def invalidate(self, key: str) -> None:
+        super().invalidate(key)
+        try:
+            self.client.delete(f"{self.namespace}:{key}")
+        except Exception:
+            self.errors += 1
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+
+def token_key(base_url: str, consumer_key: str) -> str:
+    """Cache key for one set of Daraja credentials (the key itself is not stored)."""
+    return hashlib.sha256(f"{base_url}|{consumer_key}".encode()).hexdigest()[:32]
+
+
+def build_token_cache(config) -> AccessTokenCache:
+    backend = (config.get("MPESA_TOKEN_CACHE_BACKEND") or 'memory').lower()
+    margin = float(config.get("MPESA_TOKEN_REFRESH_MARGIN") or 60)
+    if backend == 'redis':
+        import redis
+
+        client = redis.Redis.from_url(config.get("REDIS_URL") or "redis://localhost:6379/0")
+        return RedisAccessTokenCache(client, refresh_margin=margin)
+    return AccessTokenCache(refresh_margin=margin)
+
+
+_build_lock = threading.Lock()
+
+
+def get_token_cache() -> AccessTokenCache:
+    """Return the current app's token cache, creating it on first use."""
+    cache = current_app.extensions.get('shieldai_mpesa_token')
+    if cache is None:
+        with _build_lock:
+            cache = current_app.extensions.get('shieldai_mpesa_token')
+            if cache is None:
+                cache = current_app.extensions['shieldai_mpesa_token'] = build_token_cache(current_app.config)
+    return cache
@@ -0,0 +1,55 @@
+"""
+Keyset (cursor) pagination for newest-first listings.
+
+Pages are ordered by (sort column, id) descending and the next page starts
+strictly after the last row returned, so the database seeks straight to it
+through a (user_id, sort column, id) index instead of counting past OFFSET
+rows, and rows inserted while a client is scrolling cannot shift a page and
+produce duplicates. Cursors are opaque to clients: a url-safe base64 encoding
+of the last row's sort value and id.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    raw = json.dumps([sort_value.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_page(query, sort_column, id_column, limit: Optional[int], cursor: Optional[str] = None) -> Tuple[List[Any], Optional[str]]:
+    """
+    Return (rows, next_cursor) for the page of ``query`` after ``cursor``.
+
+    ``query`` must not be ordered yet. Without a limit every remaining row is
+    returned and next_cursor is None.
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+    query = query.order_by(sort_column.desc(), id_column.desc())
+    if not limit:
+        return query.all(), None
+
+    # One extra row tells whether another page exists
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
@@ -0,0 +1,74 @@
+"""
+EXPLAIN plans for the hot queries, used by ``python run.py explain``.
+
+Each entry rebuilds the statement a hot path issues (same filters and
+ordering) so its plan can be checked against the composite indexes after
+schema or query changes. SQLite uses EXPLAIN QUERY PLAN; PostgreSQL uses
+EXPLAIN, or EXPLAIN ANALYZE when ``analyze`` is set (this executes the query).
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import select, tuple_
+
+from . import db
+from .models import Transaction, User, UserBudgetPlan
+from .mpesa.models import MpesaTransaction
+
+
+def _hot_queries(user_id: int) -> Dict[str, Callable]:
+    since = datetime(2025, 1, 1)
+    return {
+        # Transaction.history_for_user and the first page of /users/<id>/transactions
+        "transactions: history for user": lambda: select(Transaction)
+            .where(Transaction.user_id == user_id)
+            .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+            .limit(20),
+        # Deep page of /users/<id>/transactions in cursor mode
+        "transactions: keyset page": lambda: select(Transaction)
+            .where(Transaction.user_id == user_id,
+                   tuple_(Transaction.timestamp, Transaction.id) < tuple_(since, 1_000_000))
+            .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+            .limit(20),
+        # Spending patterns in /mpesa-max
+        "transactions: 30-day spend by recipient": lambda: select(Transaction.recipient, db.func.sum(Transaction.amount))
+            .where(Transaction.user_id == user_id, Transaction.amount > 0,
+                   Transaction.timestamp >= since - timedelta(days=30))
+            .group_by(Transaction.recipient)
+            .order_by(db.func.sum(Transaction.amount).desc())
+            .limit(5),
+        # UserBudgetPlan.get_active_plan_for_user
+        "user_budget_plans: active plan": lambda: select(UserBudgetPlan)
+            .filter_by(user_id=user_id, is_active=True)
+            .order_by(UserBudgetPlan.updated_at.desc())
+            .limit(1),
+        # /api/mpesa/transactions?user_id=&status=
+        "mpesa_transactions: by user and status": lambda: select(MpesaTransaction)
+            .where(MpesaTransaction.user_id == user_id, MpesaTransaction.status == "completed")
+            .order_by(MpesaTransaction.created_at.desc(), MpesaTransaction.id.desc())
+            .limit(20),
+        # Login and every PIN-authenticated route
+        "users: by phone": lambda: select(User).where(User.phone == "254700000000"),
+    }
+
+
+def explain_hot_queries(user_id: int = 1, analyze: bool = False) -> List[Tuple[str, str, List[str]]]:
+    """Return (name, sql, plan lines) for every hot query on the current database."""
+    dialect = db.engine.dialect
+    if dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    elif dialect.name == "postgresql":
+        prefix = "EXPLAIN ANALYZE " if analyze else "EXPLAIN "
+    else:
+        raise ValueError(f"EXPLAIN output is not supported for {dialect.name}")
+
+    results = []
+    with db.engine.connect() as conn:
+        for name, build in _hot_queries(user_id).items():
+            sql = str(build().compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.exec_driver_sql(prefix + sql).fetchall()
+            # SQLite rows are (id, parent, notused, detail); PostgreSQL rows are one text column
+            plan = [row[-1] for row in rows]
+            results.append((name, sql, plan))
+    return results
@@ -1,9 +1,20 @@
-from flask import Blueprint, jsonify, request, current_app
+import json
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, jsonify, request, current_app, g, stream_with_context, url_for
+from flask.globals import request_ctx
 from datetime import datetime
 from .. import db
-from ..models import User, Transaction, UserBudgetPlan
+from ..models import User, Transaction, UserBudgetPlan, UserFeatureProfile, UserSpendingDaily
 from ..fraud_detector import FraudDetector
 from ..financial_strategist import FinancialStrategist
+from ..circuit_breaker import breaker_snapshots
+from ..cache import cache_snapshots, get_cache, stable_hash
+from ..fraud_scoring import parse_timestamp
+from ..auth import authenticate_user, bearer_token, issue_token, load_token_user, token_max_age
+from ..pagination import keyset_page
+from ..user_context import load_user_context
+from ..mpesa.reconciler import reconciler_snapshot
+from ..jobs import QueueFullError, get_job_queue, public_view, register_handler
 
 api_bp = Blueprint("api", __name__)
 
@@ -13,10 +24,21 @@ def health():
     try:
         # Check database connection by querying users table
         User.query.limit(1).all()
-        return jsonify({"status": "healthy", "database": "connected"}), 200
+        return jsonify({
+            "status": "healthy",
+            "database": "connected",
+            "llm_circuits": breaker_snapshots(),
+            "caches": cache_snapshots(),
+            "mpesa_reconciler": reconciler_snapshot(),
+        }), 200
     except Exception as e:
         current_app.logger.exception("Database health check failed")
-        return jsonify({"status": "unhealthy", "database": "disconnected", "error": str(e)}), 500
+        return jsonify({
+            "status": "unhealthy",
+            "database": "disconnected",
+            "error": str(e),
+            "llm_circuits": breaker_snapshots(),
+        }), 500
 
 
 @api_bp.route("/login", methods=["POST"])
@@ -40,7 +62,11 @@ def login():
         if not user.check_pin(pin):
             return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
 
-        return jsonify(user.to_dict()), 200
+        # Session token so that later requests skip the PIN hash check
+        response = user.to_dict()
+        response['token'] = issue_token(user)
+        response['token_expires_in'] = token_max_age()
+        return jsonify(response), 200
 
     except Exception as e:
         current_app.logger.exception("Error in /login")
@@ -51,104 +77,495 @@ def login():
 def check_fraud():
     try:
         payload = request.get_json(silent=True) or {}
+        user, transaction_data, error = _authorize_fraud_check(payload)
+        if error:
+            return error
 
-        # Validate required fields
-        user_id = payload.get('user_id')
-        pin = payload.get('pin')
-        transaction_data = payload.get('transaction', {})
+        if _wants_async(payload):
+            return _submit_fraud_job(user, transaction_data, payload.get('callback_url'))
 
-        if not user_id or not pin or not transaction_data:
-            return jsonify({"error": "bad_request", "message": "Missing user_id, pin, or transaction data"}), 400
+        fraud_result = _run_fraud_check(user, transaction_data)
+        return jsonify(fraud_result), 200
 
-        required_fields = ['amount', 'recipient', 'timestamp']
-        for field in required_fields:
-            if field not in transaction_data:
-                return jsonify({"error": "bad_request", "message": f"Missing required field: {field}"}), 400
+    except Exception as e:
+        current_app.logger.exception("Error in /check-fraud")
+        db.session.rollback()
+        return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
 
-        # Get user and their transaction history
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
 
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+def _authorize_fraud_check(payload: dict):
+    """Validate a fraud check request and authenticate its user: (user, transaction data, error response)."""
+    # Validate required fields
+    user_id = payload.get('user_id')
+    pin = payload.get('pin')
+    transaction_data = payload.get('transaction', {})
+
+    if not user_id or not (pin or bearer_token()) or not transaction_data:
+        return None, None, (jsonify({"error": "bad_request", "message": "Missing user_id, pin, or transaction data"}), 400)
+
+    required_fields = ['amount', 'recipient', 'timestamp']
+    for field in required_fields:
+        if field not in transaction_data:
+            return None, None, (jsonify({"error": "bad_request", "message": f"Missing required field: {field}"}), 400)
 
-        # Get recent transaction history for fraud detection
-        history = Transaction.history_for_user(user.id, limit=50)
+    # Authenticate with the session token or the PIN
+    user, auth_error = authenticate_user(user_id, pin)
+    if auth_error:
+        return None, None, auth_error
+    return user, transaction_data, None
+
+
+def _wants_async(payload: dict) -> bool:
+    flag = payload.get('async', request.args.get('async'))
+    return flag is True or str(flag).lower() in ('1', 'true', 'yes')
+
+
+def _submit_fraud_job(user: User, transaction_data: dict, callback_url=None):
+    try:
+        job = get_job_queue().submit(
+            'fraud_check',
+            {'user_id': user.id, 'transaction': transaction_data},
+            callback_url=callback_url,
+        )
+    except QueueFullError:
+        return jsonify({"error": "service_unavailable", "message": "Too many pending fraud checks, retry later"}), 503
+    except ValueError as e:
+        return jsonify({"error": "bad_request", "message": str(e)}), 400
+
+    status_url = url_for('api.get_fraud_job', job_id=job['id'])
+    response = jsonify({"job_id": job['id'], "status": job['status'], "status_url": status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+
+def _fraud_check_job(job_payload: dict) -> dict:
+    user = db.session.get(User, job_payload['user_id'])
+    if user is None:
+        raise ValueError("User no longer exists")
+    try:
+        return _run_fraud_check(user, job_payload['transaction'])
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+register_handler('fraud_check', _fraud_check_job)
+
+
+@api_bp.get("/check-fraud/jobs/<job_id>")
+def get_fraud_job(job_id):
+    try:
+        # The same credentials as the check itself: a session token, or ?user_id= and ?pin=
+        token = bearer_token()
+        if token:
+            user = load_token_user(token)
+            if user is None:
+                return jsonify({"error": "unauthorized", "message": "Invalid or expired session token"}), 401
+        else:
+            phone, pin = request.args.get('user_id'), request.args.get('pin')
+            if not phone or not pin:
+                return jsonify({"error": "bad_request", "message": "user_id and PIN, or a session token, are required"}), 400
+            user, auth_error = authenticate_user(phone, pin)
+            if auth_error:
+                return auth_error
+
+        job = get_job_queue().get(job_id)
+        # Another user's job is reported as missing, so job ids cannot be probed
+        if job is None or job.get('kind') != 'fraud_check' or job['payload'].get('user_id') != user.id:
+            return jsonify({"error": "not_found", "message": "Job not found or expired"}), 404
+        return jsonify(public_view(job)), 200
+    except Exception as e:
+        current_app.logger.exception(f"Error fetching fraud job {job_id}")
+        return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
+
+
+def _build_detector() -> FraudDetector:
+    return FraudDetector(
+        low_risk_threshold=current_app.config.get("FRAUD_PRESCORE_LOW"),
+        high_risk_threshold=current_app.config.get("FRAUD_PRESCORE_HIGH"),
+    )
+
+
+def _new_transaction(user_id: int, transaction_data: dict, fraud_result: dict) -> Transaction:
+    return Transaction(
+        user_id=user_id,
+        amount=float(transaction_data['amount']),
+        recipient=str(transaction_data['recipient']),
+        timestamp=datetime.fromisoformat(transaction_data['timestamp'].replace('Z', '+00:00')),
+        location=transaction_data.get('location'),
+        is_fraudulent=fraud_result['is_fraud'],
+        fraud_confidence=fraud_result['confidence']
+    )
+
+
+def _verdict_cache_key(user_id: int, transaction_data: dict, history_version: int) -> str:
+    # Canonical form so that client retries of the same transaction map to one key
+    try:
+        amount = round(float(transaction_data.get('amount')), 2)
+    except (TypeError, ValueError):
+        amount = transaction_data.get('amount')
+    timestamp = parse_timestamp(transaction_data.get('timestamp'))
+    return stable_hash({
+        'user': user_id,
+        'amount': amount,
+        'recipient': str(transaction_data.get('recipient', '')).strip(),
+        'timestamp': timestamp.isoformat() if timestamp else transaction_data.get('timestamp'),
+        'location': (transaction_data.get('location') or '').strip().lower(),
+        'history_version': history_version,
+    })
+
+
+def _run_fraud_check(user: User, transaction_data: dict) -> dict:
+    """Score a transaction for an authenticated user and record it.
+
+    Identical requests (typically mobile retries) are answered from the
+    verdict cache with the original transaction_id, without a model call or
+    a second insert.
+    """
+    cached, plan = _plan_fraud_check(user.id, transaction_data)
+    if cached is not None:
+        return cached
+
+    detector, history_data, prescore = plan
+    fraud_result = detector.detect_fraud(history_data, transaction_data, prescore=prescore)
+    return _record_fraud_result(user.id, transaction_data, fraud_result)
+
+
+def _plan_fraud_check(user_id: int, transaction_data: dict):
+    """The DB work before the model call: (cached result, None) or (None, (detector, history, prescore))."""
+    cache = get_cache("verdict")
+    if cache is not None:
+        cached = cache.get(_verdict_cache_key(user_id, transaction_data, UserFeatureProfile.history_version(user_id)))
+        if cached is not None:
+            return dict(cached, cached=True), None
+
+    # Score against the user's stored feature profile (clear-cut cases are decided locally)
+    detector = _build_detector()
+    prescore = detector.prescore(UserFeatureProfile.profile_for_user(user_id), transaction_data)
+
+    # Only the LLM needs the raw history, so load it just for escalated checks
+    history_data = []
+    if not prescore.conclusive:
+        history = Transaction.history_for_user(user_id, limit=50)
         history_data = [tx.to_dict() for tx in history]
+    return None, (detector, history_data, prescore)
 
-        # Perform fraud detection
-        detector = FraudDetector()
-        fraud_result = detector.detect_fraud(history_data, transaction_data)
 
-        # Save transaction to database
-        try:
-            transaction = Transaction(
-                user_id=user.id,
-                amount=float(transaction_data['amount']),
-                recipient=str(transaction_data['recipient']),
-                timestamp=datetime.fromisoformat(transaction_data['timestamp'].replace('Z', '+00:00')),
-                location=transaction_data.get('location'),
-                is_fraudulent=fraud_result['is_fraud'],
-                fraud_confidence=fraud_result['confidence']
-            )
-            db.session.add(transaction)
-            db.session.commit()
+def _record_fraud_result(user_id: int, transaction_data: dict, fraud_result: dict) -> dict:
+    """Save the scored transaction and cache the verdict for retries."""
+    cache = get_cache("verdict")
+    try:
+        transaction = _new_transaction(user_id, transaction_data, fraud_result)
+        db.session.add(transaction)
+        db.session.commit()
 
-            # Add transaction ID to response
-            fraud_result['transaction_id'] = transaction.id
+        # Add transaction ID to response
+        fraud_result['transaction_id'] = transaction.id
 
-        except Exception as db_error:
-            db.session.rollback()
-            current_app.logger.error(f"Database error saving transaction: {db_error}")
-            # Still return fraud result even if save fails
-            fraud_result['warning'] = 'Transaction detected but not saved to database'
+        # A retry sees the history version that includes this insert, so cache under that one
+        if cache is not None:
+            version = UserFeatureProfile.history_version(user_id)
+            cache.set(_verdict_cache_key(user_id, transaction_data, version), fraud_result)
 
-        return jsonify(fraud_result), 200
+    except Exception as db_error:
+        db.session.rollback()
+        current_app.logger.error(f"Database error saving transaction: {db_error}")
+        # Still return fraud result even if save fails
+        fraud_result['warning'] = 'Transaction detected but not saved to database'
+
+    return fraud_result
+
+
+@api_bp.route("/check-fraud/batch", methods=["POST"])
+def check_fraud_batch():
+    """Score many transactions (possibly for different users) in one request.
+
+    Users, feature profiles and histories are loaded with one query each,
+    escalated items are sent to the LLM concurrently, and all resulting
+    transactions are inserted with a single commit. Every item gets its own
+    result, in input order, so one bad item never fails the batch.
+    """
+    try:
+        payload = request.get_json(silent=True) or {}
+        items = payload.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "bad_request", "message": "items must be a non-empty list"}), 400
+
+        max_items = current_app.config.get("FRAUD_BATCH_MAX_ITEMS", 500)
+        if len(items) > max_items:
+            return jsonify({"error": "bad_request", "message": f"A batch may contain at most {max_items} items"}), 400
+
+        # A session token authenticates the whole batch for its user; otherwise every item carries a PIN
+        token = bearer_token()
+        token_user = load_token_user(token) if token else None
+        if token and token_user is None:
+            return jsonify({"error": "unauthorized", "message": "Invalid or expired session token"}), 401
+
+        results = [None] * len(items)
+
+        def fail(index, error, message):
+            results[index] = {"index": index, "status": "error", "error": error, "message": message}
+
+        # Validate items, then authenticate each user once
+        phones = {str(item.get('user_id')) for item in items if isinstance(item, dict) and item.get('user_id')}
+        users = {user.phone: user for user in User.query.filter(User.phone.in_(phones)).all()} \
+            if phones and not token_user else {}
+        valid = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                fail(index, "bad_request", "Item must be an object")
+                continue
+            transaction_data = item.get('transaction') or {}
+            if not item.get('user_id') or not (token_user or item.get('pin')) or not transaction_data:
+                fail(index, "bad_request", "Missing user_id, pin, or transaction data")
+                continue
+            problem = _invalid_batch_transaction(transaction_data)
+            if problem:
+                fail(index, "bad_request", problem)
+                continue
+            if token_user:
+                if str(item['user_id']) != token_user.phone:
+                    fail(index, "unauthorized", "Session token does not match user_id")
+                    continue
+                valid.append((index, token_user, None, transaction_data))
+                continue
+            user = users.get(str(item['user_id']))
+            if not user:
+                fail(index, "not_found", "User not found")
+                continue
+            valid.append((index, user, str(item['pin']), transaction_data))
+
+        # One PIN attempt per user per batch: a user whose items carry different PINs is
+        # rejected without checking any of them, so a batch cannot be used to guess PINs
+        pins = {}
+        for _, user, pin, _ in valid:
+            pins.setdefault(user.id, set()).add(pin)
+        authenticated = {user_id for user_id, user_pins in pins.items() if len(user_pins) == 1 and (
+            token_user is not None or db.session.get(User, user_id).check_pin(next(iter(user_pins))))}
+        accepted = []
+        for index, user, pin, transaction_data in valid:
+            if len(pins[user.id]) > 1:
+                fail(index, "unauthorized", "All items for a user must carry the same PIN")
+            elif user.id not in authenticated:
+                fail(index, "unauthorized", "Invalid PIN")
+            else:
+                accepted.append((index, user, transaction_data))
+
+        # Retries of already-recorded transactions are answered from the verdict cache
+        cache = get_cache("verdict")
+        user_ids = {user.id for _, user, _ in accepted}
+        if cache is not None and accepted:
+            versions = _history_versions(user_ids)
+            remaining = []
+            for index, user, transaction_data in accepted:
+                cached = cache.get(_verdict_cache_key(user.id, transaction_data, versions.get(user.id, 0)))
+                if cached is not None:
+                    results[index] = dict(cached, index=index, status="ok", cached=True)
+                else:
+                    remaining.append((index, user, transaction_data))
+            accepted = remaining
+
+        # Pre-score in timestamp order per user, folding earlier batch items into the
+        # in-memory profile so velocity and novelty see the rest of the batch
+        detector = _build_detector()
+        profiles = UserFeatureProfile.profiles_for_users({user.id for _, user, _ in accepted})
+        prescores = {}
+        for index, user, transaction_data in sorted(
+                accepted, key=lambda entry: (entry[1].id, str(entry[2].get('timestamp')), entry[0])):
+            profile = profiles[user.id]
+            prescores[index] = detector.prescore(profile, transaction_data)
+            profile.add(transaction_data.get('amount'), transaction_data.get('recipient'),
+                        transaction_data.get('timestamp'), transaction_data.get('location'))
+
+        escalated_users = {user.id for index, user, _ in accepted if not prescores[index].conclusive}
+        histories = {
+            user_id: [tx.to_dict() for tx in rows]
+            for user_id, rows in Transaction.history_for_users(escalated_users, limit=50).items()
+        }
+
+        def score(entry):
+            index, user, transaction_data = entry
+            return detector.detect_fraud(histories.get(user.id, []), transaction_data, prescore=prescores[index])
+
+        verdicts = {}
+        escalated = [entry for entry in accepted if not prescores[entry[0]].conclusive]
+        for entry in accepted:
+            if prescores[entry[0]].conclusive:
+                verdicts[entry[0]] = score(entry)
+        if escalated:
+            workers = max(1, min(current_app.config.get("FRAUD_BATCH_MAX_WORKERS", 4), len(escalated)))
+            context, request_id = request_ctx._get_current_object(), g.get('request_id')
+
+            def score_in_request(entry):
+                # Each pool thread gets its own copy of this request's context (and so its own
+                # app context and DB session); the request id keeps its log records attributable
+                with context.copy():
+                    g.request_id = request_id
+                    return score(entry)
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fraud-batch") as pool:
+                futures = {entry[0]: pool.submit(score_in_request, entry) for entry in escalated}
+            for index, future in futures.items():
+                try:
+                    verdicts[index] = future.result()
+                except Exception as e:
+                    current_app.logger.error(f"Batch fraud scoring failed for item {index}: {e}")
+                    fail(index, "scoring_failed", "Fraud scoring failed for this item")
+
+        # Insert everything that was scored in one commit
+        scored = [(index, user, data) for index, user, data in accepted if index in verdicts]
+        rows = {index: _new_transaction(user.id, data, verdicts[index]) for index, user, data in scored}
+        saved = _bulk_save_transactions(rows)
+
+        versions = _history_versions(user_ids) if cache is not None and saved else {}
+        for index, user, transaction_data in scored:
+            result = dict(verdicts[index], index=index, status="ok")
+            if index in saved:
+                result['transaction_id'] = rows[index].id
+                if cache is not None:
+                    cache.set(
+                        _verdict_cache_key(user.id, transaction_data, versions.get(user.id, 0)),
+                        {k: v for k, v in result.items() if k not in ('index', 'status')},
+                    )
+            else:
+                result['warning'] = 'Transaction detected but not saved to database'
+            results[index] = result
+
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        return jsonify({
+            "results": results,
+            "summary": {"total": len(results), "succeeded": succeeded, "failed": len(results) - succeeded},
+        }), 200
 
     except Exception as e:
-        current_app.logger.exception("Error in /check-fraud")
+        current_app.logger.exception("Error in /check-fraud/batch")
         db.session.rollback()
         return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
 
 
+def _invalid_batch_transaction(transaction_data: dict):
+    # Checked up front so a single bad row cannot abort the shared commit
+    for field in ('amount', 'recipient', 'timestamp'):
+        if field not in transaction_data:
+            return f"Missing required field: {field}"
+    try:
+        if float(transaction_data['amount']) <= 0:
+            return "Amount must be greater than 0"
+    except (TypeError, ValueError):
+        return "Invalid amount format"
+    if len(str(transaction_data['recipient'])) < 10:
+        return "Invalid recipient"
+    try:
+        datetime.fromisoformat(str(transaction_data['timestamp']).replace('Z', '+00:00'))
+    except ValueError:
+        return "Invalid timestamp format"
+    return None
+
+
+def _history_versions(user_ids) -> dict:
+    if not user_ids:
+        return {}
+    rows = db.session.query(UserFeatureProfile.user_id, UserFeatureProfile.version).filter(
+        UserFeatureProfile.user_id.in_(list(user_ids))).all()
+    return {user_id: version for user_id, version in rows}
+
+
+def _bulk_save_transactions(rows: dict) -> set:
+    """Insert all rows in one commit; if that fails, retry one by one to isolate the bad rows."""
+    if not rows:
+        return set()
+    try:
+        db.session.add_all(rows.values())
+        db.session.commit()
+        return set(rows)
+    except Exception as db_error:
+        db.session.rollback()
+        current_app.logger.error(f"Batch insert failed, retrying rows individually: {db_error}")
+
+    saved = set()
+    for index, transaction in rows.items():
+        try:
+            db.session.add(transaction)
+            db.session.commit()
+            saved.add(index)
+        except Exception as db_error:
+            db.session.rollback()
+            current_app.logger.error(f"Database error saving batch item {index}: {db_error}")
+    return saved
+
+
 @api_bp.route("/users/<string:user_id>/transactions", methods=["GET"])
 def get_transactions(user_id: str):
     try:
         # Get PIN from query params
         pin = request.args.get('pin')
-        if not pin:
-            return jsonify({"error": "bad_request", "message": "PIN is required"}), 400
-
-        # Find user by phone number
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
+        if not pin and not bearer_token():
+            return jsonify({"error": "bad_request", "message": "PIN or session token is required"}), 400
 
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
 
         # Get query parameters
         limit = request.args.get('limit', type=int)
-        offset = request.args.get('offset', 0, type=int)
+        query = Transaction.query.filter_by(user_id=user.id)
+
+        # Legacy offset mode, kept for clients that still send ?offset=
+        if 'offset' in request.args:
+            offset = request.args.get('offset', 0, type=int)
+            query = query.order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+            if limit:
+                query = query.limit(limit)
+            if offset:
+                query = query.offset(offset)
+            return jsonify({"transactions": [tx.to_dict() for tx in query.all()]}), 200
 
-        # Query transactions
-        query = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.timestamp.desc())
+        try:
+            transactions, next_cursor = keyset_page(
+                query, Transaction.timestamp, Transaction.id, limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({"error": "bad_request", "message": "Invalid cursor"}), 400
 
-        if limit:
-            query = query.limit(limit)
-        if offset:
-            query = query.offset(offset)
+        return jsonify({
+            "transactions": [tx.to_dict() for tx in transactions],
+            "next_cursor": next_cursor,
+        }), 200
 
-        transactions = query.all()
-        transaction_data = [tx.to_dict() for tx in transactions]
+    except Exception as e:
+        current_app.logger.exception("Error in /users/<user_id>/transactions")
+        return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
 
-        return jsonify({"transactions": transaction_data}), 200
+
+@api_bp.route("/users/<string:user_id>/spending-summary", methods=["GET"])
+def get_spending_summary(user_id: str):
+    """Rolling spend totals and top recipients from the daily aggregates"""
+    try:
+        pin = request.args.get('pin')
+        if not pin and not bearer_token():
+            return jsonify({"error": "bad_request", "message": "PIN or session token is required"}), 400
+
+        try:
+            windows = sorted({int(d) for d in request.args.get('days', '7,30,90').split(',') if d.strip()})
+            top = request.args.get('top', 5, type=int)
+        except ValueError:
+            return jsonify({"error": "bad_request", "message": "days must be a comma-separated list of integers"}), 400
+        if not windows or any(d < 1 or d > 366 for d in windows) or not 1 <= top <= 50:
+            return jsonify({"error": "bad_request", "message": "days must be between 1 and 366 and top between 1 and 50"}), 400
+
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
+
+        return jsonify({
+            "user_id": user.phone,
+            "as_of": datetime.utcnow().date().isoformat(),
+            "windows": UserSpendingDaily.summary(user.id, windows=windows, top=top),
+        }), 200
 
     except Exception as e:
-        current_app.logger.exception("Error in /users/<user_id>/transactions")
+        current_app.logger.exception("Error in /users/<user_id>/spending-summary")
         return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
 
 
@@ -197,7 +614,7 @@ def update_balance(user_id: str):
         balance = payload.get('balance')
         pin = payload.get('pin')
 
-        if balance is None or pin is None:
+        if balance is None or (pin is None and not bearer_token()):
             return jsonify({"error": "bad_request", "message": "Balance and PIN are required"}), 400
 
         try:
@@ -207,14 +624,10 @@ def update_balance(user_id: str):
         except (TypeError, ValueError):
             return jsonify({"error": "bad_request", "message": "Invalid balance format"}), 400
 
-        # Find user by phone number
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
-
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
 
         # Update balance
         user.mpesa_balance = balance
@@ -236,63 +649,57 @@ def ask_ai():
     """Ask AI a question about financial planning"""
     try:
         payload = request.get_json(silent=True) or {}
-
-        # Validate required fields
-        user_id = payload.get('user_id')
-        question = payload.get('question')
-
-        if not user_id or not question:
-            return jsonify({"error": "bad_request", "message": "Missing user_id or question"}), 400
-
-        # Get user (PIN validation removed for AI conversations - user should be authenticated)
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
-
-        # Get user's current plan data (simplified for now)
-        plan_data = {
-            'weekly_budget': 2500,
-            'monthly_budget': 10000,
-            'financial_health_score': 75,
-            'categories': [
-                {'name': 'Food', 'allocated': 1500},
-                {'name': 'Transport', 'allocated': 800},
-                {'name': 'Airtime', 'allocated': 500},
-            ]
-        }
+        question, error = _ask_ai_question(payload)
+        if error:
+            return error
 
         # Ask AI the question
         strategist = FinancialStrategist()
-        answer = strategist.ask_question(question, user.id, plan_data)
+        answer = strategist.ask_question(question)
 
-        return jsonify({
-            "question": question,
-            "answer": answer,
-            "timestamp": datetime.utcnow().isoformat()
-        }), 200
+        return jsonify(_ask_ai_body(question, answer)), 200
 
     except Exception as e:
         current_app.logger.exception("Error in /ask-ai")
         return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
 
 
+def _ask_ai_question(payload: dict):
+    """Validate an /ask-ai request: (question, error response)."""
+    # Validate required fields
+    user_id = payload.get('user_id')
+    question = payload.get('question')
+
+    if not user_id or not question:
+        return None, (jsonify({"error": "bad_request", "message": "Missing user_id or question"}), 400)
+
+    # Get user (PIN validation removed for AI conversations - user should be authenticated)
+    if not db.session.query(User.id).filter_by(phone=user_id).first():
+        return None, (jsonify({"error": "not_found", "message": "User not found"}), 404)
+    return question, None
+
+
+def _ask_ai_body(question: str, answer: str) -> dict:
+    return {
+        "question": question,
+        "answer": answer,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
 @api_bp.route("/users/<string:user_id>/budget-plans", methods=["GET"])
 def get_user_budget_plans(user_id: str):
     """Get all budget plans for a user"""
     try:
         # Get PIN from query params
         pin = request.args.get('pin')
-        if not pin:
-            return jsonify({"error": "bad_request", "message": "PIN is required"}), 400
+        if not pin and not bearer_token():
+            return jsonify({"error": "bad_request", "message": "PIN or session token is required"}), 400
 
-        # Find user by phone number
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
-
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
 
         # Get all plans for user
         plans = UserBudgetPlan.get_all_plans_for_user(user.id)
@@ -317,17 +724,13 @@ def create_user_budget_plan(user_id: str):
         monthly_income = payload.get('monthly_income')
         allocations = payload.get('allocations')
 
-        if not pin or not plan_name or monthly_income is None or not allocations:
+        if not (pin or bearer_token()) or not plan_name or monthly_income is None or not allocations:
             return jsonify({"error": "bad_request", "message": "PIN, plan_name, monthly_income, and allocations are required"}), 400
 
-        # Find user by phone number
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
-
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
 
         # Check if plan name already exists for this user
         existing_plan = UserBudgetPlan.query.filter_by(user_id=user.id, plan_name=plan_name).first()
@@ -382,17 +785,13 @@ def update_user_budget_plan(user_id: str, plan_id: str):
 
         # Validate required fields
         pin = payload.get('pin')
-        if not pin:
-            return jsonify({"error": "bad_request", "message": "PIN is required"}), 400
-
-        # Find user by phone number
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
+        if not pin and not bearer_token():
+            return jsonify({"error": "bad_request", "message": "PIN or session token is required"}), 400
 
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
 
         # Find the plan
         plan = UserBudgetPlan.query.filter_by(id=plan_id, user_id=user.id).first()
@@ -444,17 +843,13 @@ def delete_user_budget_plan(user_id: str, plan_id: str):
     try:
         # Get PIN from query params
         pin = request.args.get('pin')
-        if not pin:
-            return jsonify({"error": "bad_request", "message": "PIN is required"}), 400
-
-        # Find user by phone number
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
+        if not pin and not bearer_token():
+            return jsonify({"error": "bad_request", "message": "PIN or session token is required"}), 400
 
-        # Verify PIN
-        if not user.check_pin(pin):
-            return jsonify({"error": "unauthorized", "message": "Invalid PIN"}), 401
+        # Authenticate with the session token or the PIN
+        user, auth_error = authenticate_user(user_id, pin)
+        if auth_error:
+            return auth_error
 
         # Find and delete the plan
         plan = UserBudgetPlan.query.filter_by(id=plan_id, user_id=user.id).first()
@@ -521,86 +916,108 @@ def ask_mpesa_max():
     """Get financial advice from M-Pesa Max AI assistant"""
     try:
         payload = request.get_json(silent=True) or {}
-
-        # Validate required fields
-        user_id = payload.get('user_id')
-        user_query = payload.get('query')
-
-        if not user_id or not user_query:
-            return jsonify({"error": "bad_request", "message": "Missing user_id or query"}), 400
-
-        # Get user (PIN validation removed for AI conversations - user should be authenticated)
-        user = User.query.filter_by(phone=user_id).first()
-        if not user:
-            return jsonify({"error": "not_found", "message": "User not found"}), 404
-
-        # Build user context for personalized responses
-        user_context = {}
-
-        # Include user's M-Pesa balance
-        user_context['mpesa_balance'] = float(user.mpesa_balance) if user.mpesa_balance is not None else 0.0
-
-        # Include conversation history if provided
-        conversation_history = payload.get('conversation_history', [])
-        if conversation_history:
-            # Format conversation history for context
-            formatted_history = []
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                formatted_history.append({
-                    'role': 'user' if msg.get('is_from_user', msg.get('isFromUser')) else 'assistant',
-                    'content': msg.get('question', msg.get('content', '')) if msg.get('is_from_user', msg.get('isFromUser')) else msg.get('answer', msg.get('content', '')),
-                    'timestamp': msg.get('timestamp', '')
-                })
-            user_context['conversation_history'] = formatted_history
-
-        # Get recent transactions for context
-        recent_transactions = Transaction.query.filter_by(user_id=user.id)\
-            .order_by(Transaction.timestamp.desc())\
-            .limit(10)\
-            .all()
-        if recent_transactions:
-            user_context['recent_transactions'] = [tx.to_dict() for tx in recent_transactions]
-
-        # Get user's active budget plan
-        active_plan = UserBudgetPlan.query.filter_by(user_id=user.id, is_active=True).first()
-        if active_plan:
-            user_context['budget_info'] = active_plan.to_dict()
-
-        # Get spending patterns (last 30 days)
-        from datetime import timedelta
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-
-        spending_query = db.session.query(
-            Transaction.recipient,
-            db.func.sum(Transaction.amount).label('total_spent')
-        ).filter(
-            Transaction.user_id == user.id,
-            Transaction.amount > 0,  # Only outgoing transactions
-            Transaction.timestamp >= thirty_days_ago
-        ).group_by(Transaction.recipient)\
-         .order_by(db.desc('total_spent'))\
-         .limit(5)\
-         .all()
-
-        if spending_query:
-            spending_patterns = [
-                {'recipient': row[0], 'amount': float(row[1])}
-                for row in spending_query
-            ]
-            user_context['spending_patterns'] = spending_patterns
+        user_query, user_context, error = _mpesa_max_context(payload)
+        if error:
+            return error
 
         # Get M-Pesa Max response
         detector = FraudDetector()
         max_response = detector.get_mpesa_max_response(user_query, user_context)
 
-        return jsonify({
-            "question": user_query,
-            "answer": max_response.get('response', 'Unable to generate response'),
-            "model_used": max_response.get('model_used', 'unknown'),
-            "timestamp": datetime.utcnow().isoformat(),
-            "context_used": bool(user_context)
-        }), 200
+        return jsonify(_mpesa_max_body(user_query, user_context, max_response)), 200
 
     except Exception as e:
         current_app.logger.exception("Error in /mpesa-max")
         return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
+
+
+def _mpesa_max_body(user_query: str, user_context: dict, max_response: dict) -> dict:
+    return {
+        "question": user_query,
+        "answer": max_response.get('response', 'Unable to generate response'),
+        "model_used": max_response.get('model_used', 'unknown'),
+        "timestamp": datetime.utcnow().isoformat(),
+        "context_used": bool(user_context)
+    }
+
+
+def _mpesa_max_context(payload: dict):
+    """Validate an M-Pesa Max request and build its user context: (query, context, error response)."""
+    # Validate required fields
+    user_id = payload.get('user_id')
+    user_query = payload.get('query')
+
+    if not user_id or not user_query:
+        return None, None, (jsonify({"error": "bad_request", "message": "Missing user_id or query"}), 400)
+
+    # User, recent transactions, active plan and 30-day spending in one round-trip
+    # (PIN validation removed for AI conversations - user should be authenticated)
+    context = load_user_context(user_id)
+    if context is None:
+        return None, None, (jsonify({"error": "not_found", "message": "User not found"}), 404)
+
+    # Build user context for personalized responses
+    user_context = context.to_prompt_context()
+
+    # Include conversation history if provided
+    conversation_history = payload.get('conversation_history', [])
+    if conversation_history:
+        # Format conversation history for context
+        formatted_history = []
+        for msg in conversation_history[-10:]:  # Last 10 messages for context
+            formatted_history.append({
+                'role': 'user' if msg.get('is_from_user', msg.get('isFromUser')) else 'assistant',
+                'content': msg.get('question', msg.get('content', '')) if msg.get('is_from_user', msg.get('isFromUser')) else msg.get('answer', msg.get('content', '')),
+                'timestamp': msg.get('timestamp', '')
+            })
+        user_context['conversation_history'] = formatted_history
+
+    return user_query, user_context, None
+
+
+@api_bp.route("/mpesa-max/stream", methods=["POST"])
+def ask_mpesa_max_stream():
+    """Streaming M-Pesa Max: tokens are forwarded as server-sent events as the model produces them"""
+    try:
+        payload = request.get_json(silent=True) or {}
+        user_query, user_context, error = _mpesa_max_context(payload)
+        if error:
+            return error
+        # The context is plain data; don't hold a pooled DB connection for the whole stream
+        db.session.close()
+    except Exception as e:
+        current_app.logger.exception("Error in /mpesa-max/stream")
+        return jsonify({"error": "internal_server_error", "message": "An unexpected error occurred"}), 500
+
+    def events():
+        try:
+            for event in FraudDetector().stream_mpesa_max_response(user_query, user_context):
+                if event['type'] == 'token':
+                    yield _sse('token', {"content": event['content']})
+                    continue
+                current_app.logger.info(
+                    f"mpesa-max stream model={event.get('model_used')} ttft_ms={event.get('ttft_ms')} "
+                    f"total_ms={event.get('total_ms')} chars={len(event.get('response') or '')}"
+                )
+                yield _sse('done', {
+                    "question": user_query,
+                    "answer": event.get('response') or 'Unable to generate response',
+                    "model_used": event.get('model_used', 'unknown'),
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "context_used": bool(user_context),
+                    "time_to_first_token_ms": event.get('ttft_ms'),
+                    "error": bool(event.get('error')),
+                })
+        except Exception:
+            current_app.logger.exception("Error streaming /mpesa-max/stream")
+            yield _sse('error', {"error": "internal_server_error", "message": "An unexpected error occurred"})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx-style proxies from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -4,6 +4,9 @@ from ..models import User
 from ..mpesa.models import MpesaTransaction
 from ..mpesa.stk_push import StkPushService
 from ..mpesa.callbacks import MpesaCallbackHandler
+from ..mpesa.callback_queue import enqueue_callback, get_callback_consumer
+from ..log_pipeline import log_payload
+from ..pagination import keyset_page
 
 mpesa_bp = Blueprint("mpesa", __name__)
 
@@ -70,8 +73,6 @@ def mpesa_callback():
             current_app.logger.error("No callback data received")
             return jsonify({"error": "bad_request", "message": "No data received"}), 400
 
-        current_app.logger.info(f"M-Pesa callback received: {callback_data}")
-
         # Initialize callback handler
         handler = MpesaCallbackHandler()
 
@@ -81,6 +82,19 @@ def mpesa_callback():
             current_app.logger.error(f"Invalid callback data: {error_msg}")
             return jsonify({"error": "bad_request", "message": error_msg}), 400
 
+        checkout_request_id = callback_data['Body']['stkCallback'].get('CheckoutRequestID')
+        # The raw body only for a sampled share of callbacks (LOG_PAYLOAD_SAMPLE_RATE, default none)
+        log_payload(current_app.logger, f"M-Pesa callback received: CheckoutRequestID={checkout_request_id}",
+                    request.get_data(as_text=True))
+
+        if current_app.config.get("MPESA_CALLBACK_MODE", "queue") == "queue":
+            # Acknowledge once the raw callback is stored; the consumer applies it
+            enqueue_callback(request.get_data(as_text=True), checkout_request_id)
+            consumer = get_callback_consumer()
+            if consumer is not None:
+                consumer.wake()
+            return jsonify({"success": True, "message": "Callback accepted"}), 200
+
         # Process the callback
         result, status_code = handler.handle_stk_push_callback(callback_data)
 
@@ -121,7 +135,6 @@ def get_user_transactions():
 
         # Get query parameters
         limit = request.args.get('limit', 20, type=int)
-        offset = request.args.get('offset', 0, type=int)
         status = request.args.get('status')
 
         # Build query
@@ -129,17 +142,26 @@ def get_user_transactions():
         if status:
             query = query.filter_by(status=status)
 
-        query = query.order_by(MpesaTransaction.created_at.desc())
-
-        if limit:
-            query = query.limit(limit)
-        if offset:
-            query = query.offset(offset)
-
-        transactions = query.all()
-        transaction_data = [tx.to_dict() for tx in transactions]
-
-        return jsonify({"transactions": transaction_data}), 200
+        # Legacy offset mode, kept for clients that still send ?offset=
+        if 'offset' in request.args:
+            offset = request.args.get('offset', 0, type=int)
+            query = query.order_by(MpesaTransaction.created_at.desc(), MpesaTransaction.id.desc())
+            if limit:
+                query = query.limit(limit)
+            if offset:
+                query = query.offset(offset)
+            return jsonify({"transactions": [tx.to_dict() for tx in query.all()]}), 200
+
+        try:
+            transactions, next_cursor = keyset_page(
+                query, MpesaTransaction.created_at, MpesaTransaction.id, limit, request.args.get('cursor'))
+        except ValueError:
+            return jsonify({"error": "bad_request", "message": "Invalid cursor"}), 400
+
+        return jsonify({
+            "transactions": [tx.to_dict() for tx in transactions],
+            "next_cursor": next_cursor,
+        }), 200
 
     except Exception as e:
         current_app.logger.exception("Error getting user transactions")
@@ -1,12 +1,117 @@
 """
 Database seeder for Shield AI demo data.
 Creates 3 demo users with 30 days of realistic Kenyan M-Pesa transaction patterns.
+
+``generate_synthetic_data`` uses the same student/business/vendor patterns to
+load any number of users with their transactions and STK push history, for
+testing at production volumes:
+
+    python run.py seed-db --users 100000 --days 90 --workers 4
+
+Users are generated in chunks of consecutive ids, each chunk by one worker
+process, and written with PostgreSQL COPY (multi-row INSERTs elsewhere) in
+one transaction per chunk. SQLite allows a single writer, so extra workers
+there only overlap generation with loading.
 """
 
+import csv
+import io
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, text
+
 from . import db
-from .models import User, Transaction
+from .models import User, Transaction, UserFeatureProfile, UserSpendingDaily
+from .mpesa.models import MpesaTransaction
+
+# Transaction patterns per user type: transactions per day, and amount bands
+# as (probability, low, high)
+PROFILES = {
+    'student': {
+        'daily_transactions': (3, 8),  # Frequent small transactions
+        'amounts': [(0.9, 50, 500), (0.1, 1000, 2000)],  # occasional larger for emergencies
+        'share': 0.5,
+    },
+    'business': {
+        'daily_transactions': (2, 5),  # Regular business transactions
+        'amounts': [(0.7, 500, 5000), (0.3, 10000, 20000)],  # some large transfers
+        'share': 0.2,
+    },
+    'vendor': {
+        'daily_transactions': (3, 8),  # Many small customer payments
+        'amounts': [(1.0, 20, 200)],
+        'share': 0.3,
+    },
+}
+
+# Business hours + some evening
+HOURS = [9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]
+HOUR_WEIGHTS = [2, 3, 4, 5, 5, 4, 3, 2, 1, 1, 1, 1]
+
+FRAUD_RATE = 0.05
+
+LOCATIONS = [
+    'Nairobi CBD', 'Westlands', 'Karen', 'Kilimani', 'Langata',
+    'River Road Market', 'Luthuli Avenue', 'Tom Mboya Street',
+    'Koinange Street', 'Westlands Mall', 'Sarit Centre', None
+]
+
+TRANSACTION_COLUMNS = ('user_id', 'amount', 'recipient', 'timestamp', 'location', 'is_fraudulent', 'fraud_confidence')
+USER_COLUMNS = ('id', 'full_name', 'phone', 'pin_hash', 'mpesa_balance', 'created_at')
+MPESA_COLUMNS = ('user_id', 'merchant_request_id', 'checkout_request_id', 'mpesa_receipt_number', 'amount',
+                 'phone_number', 'account_reference', 'transaction_desc', 'result_code', 'result_desc',
+                 'status', 'created_at', 'updated_at')
+
+# (status, result code, result description, probability) of a synthetic STK push
+STK_OUTCOMES = [
+    ('completed', 0, 'The service request is processed successfully.', 0.85),
+    ('cancelled', 1032, 'Request cancelled by user', 0.10),
+    ('failed', 1, 'The balance is insufficient for the transaction', 0.05),
+]
+
+
+def _amount(rng: random.Random, profile: dict) -> float:
+    draw = rng.random()
+    for probability, low, high in profile['amounts']:
+        if draw < probability:
+            return round(rng.uniform(low, high), 2)
+        draw -= probability
+    low, high = profile['amounts'][-1][1:]
+    return round(rng.uniform(low, high), 2)
+
+
+def _transaction_rows(rng: random.Random, user_id: int, profile: dict, start: datetime, days: int,
+                      recipients: List[str]) -> List[tuple]:
+    """Rows in TRANSACTION_COLUMNS order for ``days`` days from ``start``, about 5% fraudulent."""
+    rows = []
+    low, high = profile['daily_transactions']
+    for day in range(days):
+        current_date = start + timedelta(days=day)
+        for hour in rng.choices(HOURS, weights=HOUR_WEIGHTS, k=rng.randint(low, high)):
+            transaction_time = current_date.replace(hour=hour, minute=rng.randint(0, 59))
+            amount = _amount(rng, profile)
+            is_fraud = False
+            fraud_confidence = 0.0
+
+            if rng.random() < FRAUD_RATE:
+                is_fraud = True
+                fraud_confidence = round(rng.uniform(0.7, 0.95), 2)
+
+                # Make fraudulent transactions more suspicious
+                if rng.random() < 0.5:
+                    # Large amount anomaly
+                    amount = round(amount * rng.uniform(3, 10), 2)
+                else:
+                    # Unusual time (3 AM)
+                    transaction_time = transaction_time.replace(hour=3, minute=rng.randint(0, 59))
+
+            rows.append((user_id, amount, rng.choice(recipients), transaction_time, rng.choice(LOCATIONS),
+                         is_fraud, fraud_confidence))
+    return rows
 
 
 def seed_database():
@@ -14,7 +119,10 @@ def seed_database():
     print("Seeding database with demo data...")
 
     # Clear existing data
+    UserFeatureProfile.query.delete()
+    UserSpendingDaily.query.delete()
     Transaction.query.delete()
+    MpesaTransaction.query.delete()
     User.query.delete()
     db.session.commit()
 
@@ -25,24 +133,21 @@ def seed_database():
             'name': 'student_mary',
             'full_name': 'Mary Student',
             'pin': '1234',
-            'daily_avg': 150.0,
-            'transaction_freq': 'high',  # Frequent small transactions
+            'profile': 'student',
         },
         {
             'phone': '254798765432',
             'name': 'business_david',
             'full_name': 'David Business',
             'pin': '5678',
-            'daily_avg': 1500.0,
-            'transaction_freq': 'medium',  # Regular business transactions
+            'profile': 'business',
         },
         {
             'phone': '254711223344',
             'name': 'mama_mboga_sarah',
             'full_name': 'Sarah Mboga',
             'pin': '1122',
-            'daily_avg': 800.0,
-            'transaction_freq': 'high',  # Many small customer payments
+            'profile': 'vendor',
         }
     ]
 
@@ -68,99 +173,186 @@ def seed_database():
         '254700888888', '254711999999', '254722111111', '254733222222'
     ]
 
-    locations = [
-        'Nairobi CBD', 'Westlands', 'Karen', 'Kilimani', 'Langata',
-        'River Road Market', 'Luthuli Avenue', 'Tom Mboya Street',
-        'Koinange Street', 'Westlands Mall', 'Sarit Centre', None
-    ]
-
+    rng = random.Random()
     for user, user_data in users:
-        transactions_created = 0
-        fraud_transactions = 0
-
-        for day in range(30):
-            current_date = base_date + timedelta(days=day)
-
-            # Generate transactions based on user pattern
-            if user_data['transaction_freq'] == 'high':
-                num_transactions = random.randint(3, 8)
-            elif user_data['transaction_freq'] == 'medium':
-                num_transactions = random.randint(2, 5)
-            else:
-                num_transactions = random.randint(1, 3)
-
-            for _ in range(num_transactions):
-                # Generate realistic transaction time (business hours + some evening)
-                hour = random.choices(
-                    [9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20],
-                    weights=[2, 3, 4, 5, 5, 4, 3, 2, 1, 1, 1, 1]
-                )[0]
-                minute = random.randint(0, 59)
-
-                transaction_time = current_date.replace(hour=hour, minute=minute)
-
-                # Generate amount based on user profile
-                if user_data['name'] == 'student_mary':
-                    # Student: small amounts, occasional larger for emergencies
-                    if random.random() < 0.9:
-                        amount = round(random.uniform(50, 500), 2)
-                    else:
-                        amount = round(random.uniform(1000, 2000), 2)
-                elif user_data['name'] == 'business_david':
-                    # Business: varied amounts, some large transfers
-                    if random.random() < 0.7:
-                        amount = round(random.uniform(500, 5000), 2)
-                    else:
-                        amount = round(random.uniform(10000, 20000), 2)
-                else:  # mama_mboga_sarah
-                    # Vendor: many small amounts from customers
-                    amount = round(random.uniform(20, 200), 2)
-
-                # Select recipient
-                recipient = random.choice(kenyan_recipients)
-
-                # Add some fraudulent transactions (about 5% of total)
-                is_fraud = False
-                fraud_confidence = 0.0
-
-                if random.random() < 0.05:  # 5% fraud rate
-                    is_fraud = True
-                    fraud_confidence = round(random.uniform(0.7, 0.95), 2)
-
-                    # Make fraudulent transactions more suspicious
-                    if random.random() < 0.5:
-                        # Large amount anomaly
-                        amount = amount * random.uniform(3, 10)
-                    else:
-                        # Unusual time (3 AM)
-                        transaction_time = transaction_time.replace(hour=3, minute=random.randint(0, 59))
-
-                # Create transaction
-                transaction = Transaction(
-                    user_id=user.id,
-                    amount=amount,
-                    recipient=recipient,
-                    timestamp=transaction_time,
-                    location=random.choice(locations),
-                    is_fraudulent=is_fraud,
-                    fraud_confidence=fraud_confidence
-                )
-
-                db.session.add(transaction)
-                transactions_created += 1
-                if is_fraud:
-                    fraud_transactions += 1
-
-        print(f"Created {transactions_created} transactions for {user_data['name']} ({fraud_transactions} fraudulent)")
+        rows = _transaction_rows(rng, user.id, PROFILES[user_data['profile']], base_date, 30, kenyan_recipients)
+        db.session.bulk_insert_mappings(Transaction, [dict(zip(TRANSACTION_COLUMNS, row)) for row in rows])
+        fraud_transactions = sum(1 for row in rows if row[5])
+        print(f"Created {len(rows)} transactions for {user_data['name']} ({fraud_transactions} fraudulent)")
 
     db.session.commit()
+    # Bulk inserts skip the flush hooks that maintain these
+    UserFeatureProfile.rebuild()
+    UserSpendingDaily.rebuild()
     print("Database seeding completed!")
 
 
+def _user_rows(rng: random.Random, first_id: int, count: int, start: datetime, days: int, end: datetime,
+               pin_hash: str, stk_per_day: float):
+    """Users, transactions and STK pushes for ids first_id .. first_id + count - 1."""
+    names = list(PROFILES)
+    shares = [PROFILES[name]['share'] for name in names]
+    users, transactions, pushes = [], [], []
+    for user_id in range(first_id, first_id + count):
+        profile_name = rng.choices(names, weights=shares)[0]
+        # 2541... numbers, so ids never collide with the 2547... demo and recipient numbers
+        phone = f"2541{user_id:08d}"
+        users.append((user_id, f"Synthetic {profile_name.title()} {user_id}", phone, pin_hash,
+                      round(rng.uniform(0, 5) * PROFILES[profile_name]['amounts'][0][2], 2), start))
+
+        recipients = [f"2547{rng.randrange(10 ** 8):08d}" for _ in range(rng.randint(3, 10))]
+        transactions.extend(_transaction_rows(rng, user_id, PROFILES[profile_name], start, days, recipients))
+
+        for seq in range(int(days * stk_per_day + rng.random())):
+            created_at = start + timedelta(seconds=rng.uniform(0, (end - start).total_seconds()))
+            status, result_code, result_desc = _stk_outcome(rng)
+            pushes.append((
+                user_id, f"syn-mr-{user_id}-{seq}", f"ws_CO_syn{user_id}-{seq}",
+                # Receipt numbers are unique: the user id followed by a fixed-width sequence
+                f"SYN{user_id}{seq:05d}" if status == 'completed' else None,
+                _amount(rng, PROFILES[profile_name]), phone, f"SHIELD{user_id}", "Synthetic STK push",
+                result_code, result_desc, status, created_at, created_at + timedelta(seconds=rng.uniform(5, 60)),
+            ))
+    return users, transactions, pushes
+
+
+def _stk_outcome(rng: random.Random):
+    draw = rng.random()
+    for status, result_code, result_desc, probability in STK_OUTCOMES:
+        if draw < probability:
+            return status, result_code, result_desc
+        draw -= probability
+    return STK_OUTCOMES[0][:3]
+
+
+def _copy_rows(connection, table: str, columns, rows) -> None:
+    """Bulk-load rows: COPY on PostgreSQL, one executemany INSERT elsewhere."""
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    elif connection.dialect.paramstyle in ('qmark', 'format', 'pyformat'):
+        # Tuples straight to the driver's executemany; building dicts per row costs more than the insert
+        marker = '?' if connection.dialect.paramstyle == 'qmark' else '%s'
+        connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([marker] * len(columns))})", rows)
+    else:
+        placeholders = ', '.join(f':{column}' for column in columns)
+        connection.execute(text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"),
+                           [dict(zip(columns, row)) for row in rows])
+
+
+_engines: Dict[str, object] = {}
+
+
+def _load_chunk(task: dict, engine=None) -> dict:
+    """Generate and load one chunk of users (runs in a worker process); returns counts and timings."""
+    uri = task['database_uri']
+    engine = engine or _engines.get(uri)
+    if engine is None:
+        connect_args = {'timeout': 120} if uri.startswith('sqlite') else {}
+        engine = _engines[uri] = create_engine(uri, connect_args=connect_args)
+
+    started = time.perf_counter()
+    rng = random.Random(f"{task['seed']}:{task['first_id']}") if task['seed'] is not None else random.Random()
+    users, transactions, pushes = _user_rows(rng, task['first_id'], task['count'], task['start'], task['days'],
+                                             task['end'], task['pin_hash'], task['stk_per_day'])
+    generated = time.perf_counter()
+    with engine.begin() as connection:
+        _copy_rows(connection, User.__tablename__, USER_COLUMNS, users)
+        _copy_rows(connection, Transaction.__tablename__, TRANSACTION_COLUMNS, transactions)
+        _copy_rows(connection, MpesaTransaction.__tablename__, MPESA_COLUMNS, pushes)
+    return {
+        'users': len(users),
+        'transactions': len(transactions),
+        'mpesa_transactions': len(pushes),
+        'generate_seconds': generated - started,
+        'load_seconds': time.perf_counter() - generated,
+    }
+
+
+def generate_synthetic_data(users: int, days: int = 30, workers: int = 1, chunk_users: int = 1000,
+                            seed: Optional[int] = None, stk_per_day: float = 0.2, pin: str = '0000',
+                            rebuild_aggregates: bool = True, progress=None) -> dict:
+    """Append ``users`` synthetic users with ``days`` of history; returns row counts and rows/sec.
+
+    All synthetic users share ``pin``. Feature profiles and daily spending
+    aggregates are rebuilt afterwards unless ``rebuild_aggregates`` is False.
+    """
+    first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    db.session.commit()
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    # One PBKDF2 hash for every user; hashing per user would dominate the run
+    probe = User(full_name='', phone='')
+    probe.set_pin(pin)
+    uri = db.engine.url.render_as_string(hide_password=False)
+    tasks = [
+        {'database_uri': uri, 'first_id': chunk_first, 'count': min(chunk_users, first_id + users - chunk_first),
+         'start': start, 'end': end, 'days': days, 'pin_hash': probe.pin_hash, 'seed': seed,
+         'stk_per_day': stk_per_day}
+        for chunk_first in range(first_id, first_id + users, chunk_users)
+    ]
+
+    totals = {'users': 0, 'transactions': 0, 'mpesa_transactions': 0, 'generate_seconds': 0.0, 'load_seconds': 0.0}
+    started = time.perf_counter()
+    if workers > 1:
+        # Children open their own connections; don't hand them this process's pool
+        db.engine.dispose()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_load_chunk, tasks)
+            for done, result in enumerate(results, 1):
+                _add_counts(totals, result, progress, done, len(tasks))
+    else:
+        for done, task in enumerate(tasks, 1):
+            _add_counts(totals, _load_chunk(task, db.engine), progress, done, len(tasks))
+    load_elapsed = time.perf_counter() - started
+
+    if db.engine.dialect.name == 'postgresql':
+        # Ids were given explicitly, so move the sequence past them
+        db.session.execute(text("SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT max(id) FROM users))"))
+        db.session.commit()
+
+    rows = totals['users'] + totals['transactions'] + totals['mpesa_transactions']
+    report = {
+        'users': totals['users'],
+        'transactions': totals['transactions'],
+        'mpesa_transactions': totals['mpesa_transactions'],
+        'rows': rows,
+        'workers': workers,
+        'chunks': len(tasks),
+        'seconds': round(load_elapsed, 3),
+        'rows_per_second': round(rows / load_elapsed, 1) if load_elapsed > 0 else None,
+        # Summed over workers: which side is the bottleneck
+        'generate_seconds': round(totals['generate_seconds'], 3),
+        'load_seconds': round(totals['load_seconds'], 3),
+    }
+    if rebuild_aggregates:
+        aggregates_started = time.perf_counter()
+        UserFeatureProfile.rebuild()
+        UserSpendingDaily.rebuild()
+        report['aggregates_seconds'] = round(time.perf_counter() - aggregates_started, 3)
+    return report
+
+
+def _add_counts(totals: dict, result: dict, progress, done: int, chunks: int) -> None:
+    for key in totals:
+        totals[key] += result[key]
+    if progress:
+        progress(done, chunks, totals)
+
+
 def clear_database():
     """Clear all data from database."""
     print("Clearing database...")
+    UserFeatureProfile.query.delete()
+    UserSpendingDaily.query.delete()
     Transaction.query.delete()
+    MpesaTransaction.query.delete()
     User.query.delete()
     db.session.commit()
     print("Database cleared!")
@@ -171,4 +363,4 @@ if __name__ == "__main__":
 
     app = create_app()
     with app.app_context():
-        seed_database()
\ No newline at end of file
+        seed_database()
@@ -0,0 +1,163 @@
+"""
+Per-user context for the AI assistants, loaded in one database round-trip.
+
+/api/mpesa-max used to issue four queries before calling the LLM (user by
+phone, last transactions, active budget plan, 30-day spend per recipient).
+load_user_context sends a single UNION ALL statement instead: each branch
+emits rows tagged with a ``kind`` into a shared set of typed columns, and the
+rows are folded back into a UserContext. Spending is read from the daily
+aggregates in user_spending_daily.
+"""
+
+import json
+from functools import lru_cache
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, String, Text, bindparam, cast, literal, null, select, union_all
+
+from . import db
+from .models import Transaction, User, UserBudgetPlan, UserSpendingDaily
+
+
+@dataclass
+class UserContext:
+    user_id: int
+    phone: str
+    full_name: str
+    mpesa_balance: float
+    recent_transactions: List[Dict[str, Any]] = field(default_factory=list)
+    active_plan: Optional[Dict[str, Any]] = None
+    spending_patterns: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_prompt_context(self) -> Dict[str, Any]:
+        """Dict in the shape FraudDetector.get_mpesa_max_response expects."""
+        context: Dict[str, Any] = {'mpesa_balance': self.mpesa_balance}
+        if self.recent_transactions:
+            context['recent_transactions'] = self.recent_transactions
+        if self.active_plan:
+            context['budget_info'] = self.active_plan
+        if self.spending_patterns:
+            context['spending_patterns'] = self.spending_patterns
+        return context
+
+
+# Column slots shared by every branch of the UNION ALL
+_SLOTS = (
+    ('ref_id', Integer), ('key', String), ('label', String), ('detail', Text),
+    ('num1', Float), ('num2', Float), ('num3', Float),
+    ('ts1', DateTime), ('ts2', DateTime), ('flag', Boolean), ('payload', Text),
+)
+
+
+def _branch(kind: str, source=None, **values):
+    columns = [literal(kind, String).label('kind')]
+    for name, type_ in _SLOTS:
+        value = values.get(name)
+        if value is None:
+            value = cast(null(), type_)
+        elif source is not None:
+            value = source.c[value]
+        columns.append(value.label(name))
+    return select(*columns)
+
+
+@lru_cache(maxsize=8)
+def _context_statement(recent_limit: int, top_recipients: int):
+    # Built once per shape; phone and spending_since are bound at execution time
+    phone = bindparam('phone', type_=String)
+    spending_since = bindparam('spending_since', type_=Date)
+    user_id = select(User.id).where(User.phone == phone).scalar_subquery()
+
+    recent = (select(Transaction)
+              .where(Transaction.user_id == user_id)
+              .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+              .limit(recent_limit)
+              .subquery())
+    plan = (select(UserBudgetPlan.id, UserBudgetPlan.plan_name, UserBudgetPlan.plan_description,
+                   UserBudgetPlan.monthly_income, UserBudgetPlan.savings_goal,
+                   cast(UserBudgetPlan.savings_period_months, Float).label('savings_period_months'),
+                   UserBudgetPlan.created_at, UserBudgetPlan.updated_at, UserBudgetPlan.is_active,
+                   cast(UserBudgetPlan.allocations, Text).label('allocations'))
+            .where(UserBudgetPlan.user_id == user_id, UserBudgetPlan.is_active == db.true())
+            .order_by(UserBudgetPlan.updated_at.desc())
+            .limit(1)
+            .subquery())
+    # Read from the maintained daily aggregates rather than scanning transactions
+    total = db.func.sum(UserSpendingDaily.total_amount)
+    spend = (select(UserSpendingDaily.recipient, total.label('total_spent'))
+             .where(UserSpendingDaily.user_id == user_id, UserSpendingDaily.day >= spending_since)
+             .group_by(UserSpendingDaily.recipient)
+             .order_by(total.desc())
+             .limit(top_recipients)
+             .subquery())
+    person = select(User.id, User.full_name, User.phone, User.mpesa_balance).where(User.phone == phone).subquery()
+
+    return union_all(
+        _branch('user', person, ref_id='id', label='full_name', detail='phone', num1='mpesa_balance')
+        .select_from(person),
+        _branch('tx', recent, ref_id='id', label='recipient', detail='location', num1='amount',
+                num2='fraud_confidence', ts1='timestamp', flag='is_fraudulent').select_from(recent),
+        _branch('plan', plan, key='id', label='plan_name', detail='plan_description', num1='monthly_income',
+                num2='savings_goal', num3='savings_period_months', ts1='created_at', ts2='updated_at',
+                flag='is_active', payload='allocations').select_from(plan),
+        _branch('spend', spend, label='recipient', num1='total_spent').select_from(spend),
+    )
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def load_user_context(phone: str, recent_limit: int = 10, spending_days: int = 30,
+                      top_recipients: int = 5) -> Optional[UserContext]:
+    """Context for the user with ``phone``, or None if there is no such user."""
+    since = UserSpendingDaily.window_start(spending_days)
+    rows = db.session.execute(_context_statement(recent_limit, top_recipients),
+                              {'phone': phone, 'spending_since': since}).all()
+
+    context = None
+    transactions, spending = [], []
+    plan = None
+    for row in rows:
+        if row.kind == 'user':
+            context = UserContext(user_id=row.ref_id, phone=row.detail, full_name=row.label,
+                                  mpesa_balance=float(row.num1) if row.num1 is not None else 0.0)
+        elif row.kind == 'tx':
+            transactions.append(row)
+        elif row.kind == 'plan':
+            plan = row
+        elif row.kind == 'spend':
+            spending.append({'recipient': row.label, 'amount': float(row.num1)})
+    if context is None:
+        return None
+
+    transactions.sort(key=lambda r: (r.ts1, r.ref_id), reverse=True)
+    context.recent_transactions = [{
+        "id": r.ref_id,
+        "user_id": context.user_id,
+        "amount": float(r.num1) if r.num1 is not None else None,
+        "recipient": r.label,
+        "timestamp": _iso(r.ts1),
+        "location": r.detail,
+        "is_fraudulent": bool(r.flag),
+        "fraud_confidence": float(r.num2) if r.num2 is not None else 0.0,
+    } for r in transactions]
+    if plan is not None:
+        allocations = plan.payload
+        context.active_plan = {
+            "id": plan.key,
+            "user_id": context.user_id,
+            "plan_name": plan.label,
+            "plan_description": plan.detail,
+            "monthly_income": float(plan.num1) if plan.num1 is not None else None,
+            "savings_goal": float(plan.num2) if plan.num2 is not None else None,
+            "savings_period_months": int(plan.num3) if plan.num3 is not None else None,
+            "allocations": json.loads(allocations) if isinstance(allocations, str) else allocations,
+            "is_active": bool(plan.flag),
+            "created_at": _iso(plan.ts1),
+            "updated_at": _iso(plan.ts2),
+        }
+    context.spending_patterns = sorted(spending, key=lambda s: s['amount'], reverse=True)
+    return context
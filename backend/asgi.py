@@ -0,0 +1,9 @@
+import os
+from app import create_app, start_background_workers
+from app.asgi import AsgiApp
+
+# The ASGI entry point (e.g. uvicorn --app-dir backend asgi:app); the
+# LLM-bound endpoints run on the event loop, everything else goes to Flask.
+flask_app = create_app(os.getenv("FLASK_ENV") or "production")
+start_background_workers(flask_app)
+app = AsgiApp(flask_app)
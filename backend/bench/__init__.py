@@ -0,0 +1,2 @@
+# Benchmarks and local stub servers. Run from the backend directory, e.g.
+#   python -m bench.http_pool_bench
@@ -0,0 +1,150 @@
+"""
+Minimal HTTP/1.1 server for ASGI apps, for the benchmarks and local runs.
+
+No ASGI server is a dependency of this repo; deployments should run asgi.py
+under uvicorn or hypercorn. This one covers what the benchmarks need:
+keep-alive, Content-Length request bodies and chunked (streamed) responses,
+all on one event loop.
+
+    python -m bench.asgi_server --port 8000 [asgi:app]
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+from http import HTTPStatus
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _handle(app, reader, writer):
+    server = writer.get_extra_info('sockname')[:2]
+    client = writer.get_extra_info('peername')[:2]
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            lookup = dict(headers)
+            if lookup.get(b'transfer-encoding', b'').lower() == b'chunked':
+                writer.write(b'HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            body = await reader.readexactly(int(lookup.get(b'content-length') or 0))
+            keep_alive = version == 'HTTP/1.1' and lookup.get(b'connection', b'').lower() != b'close'
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version.split('/', 1)[1],
+                'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+                'client': client, 'server': server,
+            }
+            await app(scope, _receiver(body), _sender(writer, keep_alive))
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _receiver(body):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Nothing more arrives; the app only waits here if it polls for a disconnect
+        await asyncio.Event().wait()
+
+    return receive
+
+
+def _sender(writer, keep_alive):
+    state = {'started': False, 'chunked': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            state['status'] = message['status']
+            state['headers'] = list(message.get('headers', []))
+            return
+        data = message.get('body', b'')
+        more = message.get('more_body', False)
+        if not state['started']:
+            headers = state['headers']
+            if b'content-length' not in {name.lower() for name, _ in headers}:
+                if more:
+                    headers.append((b'transfer-encoding', b'chunked'))
+                    state['chunked'] = True
+                else:
+                    headers.append((b'content-length', str(len(data)).encode()))
+            if not keep_alive:
+                headers.append((b'connection', b'close'))
+            status = state['status']
+            head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n".encode('latin-1')
+            head += b''.join(name + b': ' + value + b'\r\n' for name, value in headers)
+            writer.write(head + b'\r\n')
+            state['started'] = True
+        if state['chunked']:
+            if data:
+                writer.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+            if not more:
+                writer.write(b'0\r\n\r\n')
+        else:
+            writer.write(data)
+        await writer.drain()
+
+    return send
+
+
+async def _startup(app):
+    messages = asyncio.Queue()
+    await messages.put({'type': 'lifespan.startup'})
+    started = asyncio.Event()
+
+    async def send(message):
+        if message['type'] == 'lifespan.startup.complete':
+            started.set()
+
+    # Kept referenced for the life of the server
+    return asyncio.ensure_future(app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, messages.get, send)), started
+
+
+async def serve(app, host='127.0.0.1', port=8000):
+    lifespan, started = await _startup(app)
+    await started.wait()
+    server = await asyncio.start_server(lambda r, w: _handle(app, r, w), host, port, backlog=2048)
+    print(f"Serving on http://{host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('app', nargs='?', default='asgi:app', help='module:attribute')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    module, _, attribute = args.app.partition(':')
+    app = getattr(importlib.import_module(module), attribute or 'app')
+    try:
+        asyncio.run(serve(app, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Concurrent LLM calls one worker can hold: gunicorn threads vs the ASGI path.
+
+The stub OpenRouter answers after --llm-latency seconds (2 s by default).
+Each mode serves the app from a single process:
+
+- gthread: ``gunicorn wsgi:app --workers 1 --threads T``
+- asgi:    ``asgi:app`` (app/asgi.py) under bench.asgi_server
+
+Bursts of N simultaneous POST /api/mpesa-max requests are sent for
+N = --start, 2N, 4N ... up to --max-concurrency. A level is sustained when
+every response is a 200 and the slowest took at most --slack times the LLM
+latency, i.e. the requests were served together instead of queueing for a
+thread. The report gives the largest sustained level per mode:
+
+    python -m bench.async_bench --llm-latency 2 --max-concurrency 512
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from app.async_http import AsyncHTTPClient
+from bench.load_test import BACKEND_DIR, MAX_QUERIES, _free_port, _Gunicorn, _login, _percentile, seed
+from bench.stub_server import StubServer
+
+
+class _AsgiServer(_Gunicorn):
+    """bench.asgi_server in a subprocess, with the same readiness check and shutdown."""
+
+    def __init__(self, env, log_path):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._log = open(log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "bench.asgi_server", "--port", str(self.port), "asgi:app"],
+            cwd=BACKEND_DIR, env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+
+async def _burst(base_url, users, concurrency, timeout):
+    client = AsyncHTTPClient(max_connections=concurrency)
+
+    async def one(i):
+        user = users[i % len(users)]
+        start = time.perf_counter()
+        try:
+            resp = await client.post(f"{base_url}/api/mpesa-max", read_timeout=timeout,
+                                     headers={"Authorization": f"Bearer {user['token']}"},
+                                     json={"user_id": user["phone"], "query": MAX_QUERIES[i % len(MAX_QUERIES)]})
+            status = resp.status_code
+        except (OSError, asyncio.TimeoutError):
+            status = "error"
+        return status, time.perf_counter() - start
+
+    try:
+        return await asyncio.gather(*(one(i) for i in range(concurrency)))
+    finally:
+        await client.close()
+
+
+def run_levels(base_url, users, start, max_concurrency, llm_latency, slack, timeout):
+    """Double the burst size until one is not sustained; returns (max sustained, per-level results)."""
+    levels, sustained, concurrency = [], 0, start
+    while concurrency <= max_concurrency:
+        results = asyncio.run(_burst(base_url, users, concurrency, timeout))
+        latencies = [seconds for _, seconds in results]
+        ok = sum(1 for status, _ in results if status == 200)
+        passed = ok == concurrency and max(latencies) <= llm_latency * slack
+        levels.append({
+            "concurrency": concurrency, "ok": ok, "sustained": passed,
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+        })
+        print(json.dumps(levels[-1]), file=sys.stderr)
+        if not passed:
+            break
+        sustained = concurrency
+        concurrency *= 2
+        # Let the server settle between bursts
+        time.sleep(0.5)
+    return sustained, levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", default="gthread,asgi")
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads (gthread mode)")
+    parser.add_argument("--start", type=int, default=4)
+    parser.add_argument("--max-concurrency", type=int, default=512)
+    parser.add_argument("--slack", type=float, default=1.5, help="allowed max latency / LLM latency")
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="also write the report here")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="shieldai-async-")
+    database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    users = seed(database_url, args.history_days, random.Random(args.seed))
+    llm = StubServer(latency=args.llm_latency).start()
+    env = dict(os.environ,
+               FLASK_ENV="production", DATABASE_URL=database_url, LOG_DIR=workdir,
+               OPENROUTER_API_KEY="async-bench", OPENROUTER_BASE_URL=llm.openrouter_url,
+               ASYNC_HTTP_MAX_CONNECTIONS=str(args.max_concurrency))
+    # Client timeout well past the pass mark, so a queued request is measured rather than dropped
+    timeout = args.llm_latency * args.slack * 4
+
+    report = {"llm_latency": args.llm_latency, "slack": args.slack, "modes": {}}
+    try:
+        for mode in args.modes.split(","):
+            log_path = os.path.join(workdir, f"{mode}.log")
+            if mode == "gthread":
+                server = _Gunicorn(env, 1, args.threads, log_path)
+            elif mode == "asgi":
+                server = _AsgiServer(env, log_path)
+            else:
+                raise SystemExit(f"Unknown mode: {mode}")
+            try:
+                server.wait_ready()
+                _login(server.url, users)
+                requests.post(f"{server.url}/api/mpesa-max", timeout=timeout,
+                              headers={"Authorization": f"Bearer {users[0]['token']}"},
+                              json={"user_id": users[0]["phone"], "query": MAX_QUERIES[0]})
+                sustained, levels = run_levels(server.url, users, args.start, args.max_concurrency,
+                                               args.llm_latency, args.slack, timeout)
+            finally:
+                server.stop()
+            report["modes"][mode] = {"max_sustained": sustained, "levels": levels}
+            if mode == "gthread":
+                report["modes"][mode]["threads"] = args.threads
+    finally:
+        llm.stop()
+        print(f"server logs and database in {workdir}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
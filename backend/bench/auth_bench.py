@@ -0,0 +1,72 @@
+"""
+Requests/sec on GET /api/users/<id>/transactions with PIN vs. session-token auth.
+
+Runs the app in-process through the Flask test client against an in-memory
+SQLite database holding one user with a page of transactions, and times the
+same request authenticated with ?pin= (PBKDF2 check per request) and with
+the bearer token returned by /api/login.
+
+    python -m bench.auth_bench --requests 200
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Transaction, User
+
+PHONE = "254700009999"
+PIN = "2468"
+
+
+def _seed():
+    user = User(full_name="Bench User", phone=PHONE)
+    user.set_pin(PIN)
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2025, 1, 1, 9, 0)
+    db.session.add_all([
+        Transaction(user_id=user.id, amount=100 + i, recipient=f"2547220000{i % 10:02d}",
+                    timestamp=start + timedelta(hours=i), location="Nairobi")
+        for i in range(50)
+    ])
+    db.session.commit()
+
+
+def _rate(client, url, headers, count):
+    client.get(url, headers=headers)  # warm-up
+    start = time.perf_counter()
+    for _ in range(count):
+        resp = client.get(url, headers=headers)
+        assert resp.status_code == 200, resp.get_json()
+    elapsed = time.perf_counter() - start
+    return {"requests": count, "seconds": round(elapsed, 3), "requests_per_sec": round(count / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        _seed()
+    client = app.test_client()
+
+    token = client.post("/api/login", json={"phone": PHONE, "pin": PIN}).get_json()["token"]
+    url = f"/api/users/{PHONE}/transactions?limit=20"
+    pin_auth = _rate(client, f"{url}&pin={PIN}", {}, args.requests)
+    token_auth = _rate(client, url, {"Authorization": f"Bearer {token}"}, args.requests)
+
+    print(json.dumps({
+        "pin": pin_auth,
+        "token": token_auth,
+        "speedup": round(token_auth["requests_per_sec"] / pin_auth["requests_per_sec"], 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
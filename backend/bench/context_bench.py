@@ -0,0 +1,106 @@
+"""
+DB time per /api/mpesa-max request: four separate queries vs. load_user_context.
+
+Seeds one user (transactions, an active plan) into an in-memory SQLite
+database and measures statements and DB time per context build, using the
+same counters that feed the Server-Timing header. SQLite runs in-process, so
+--rtt-ms adds a sleep per statement to model the network round-trip to a
+PostgreSQL server. SQLite produces most rows while they are fetched, after
+the cursor event fires, so compare wall_ms as well as db_ms there.
+
+    python -m bench.context_bench --transactions 5000 --rtt-ms 1
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import create_app, db
+from app.db_timing import db_stats
+from app.models import Transaction, User, UserBudgetPlan
+from app.user_context import load_user_context
+
+PHONE = "254700000005"
+
+
+def legacy_context(phone):
+    # The pre-builder path in ask_mpesa_max
+    user = User.query.filter_by(phone=phone).first()
+    context = {'mpesa_balance': float(user.mpesa_balance)}
+    recent = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.timestamp.desc()).limit(10).all()
+    context['recent_transactions'] = [tx.to_dict() for tx in recent]
+    plan = UserBudgetPlan.query.filter_by(user_id=user.id, is_active=True).first()
+    context['budget_info'] = plan.to_dict() if plan else None
+    since = datetime.utcnow() - timedelta(days=30)
+    rows = db.session.query(Transaction.recipient, db.func.sum(Transaction.amount).label('total_spent'))\
+        .filter(Transaction.user_id == user.id, Transaction.amount > 0, Transaction.timestamp >= since)\
+        .group_by(Transaction.recipient).order_by(db.desc('total_spent')).limit(5).all()
+    context['spending_patterns'] = [{'recipient': r, 'amount': float(a)} for r, a in rows]
+    return context
+
+
+def _seed(count):
+    user = User(full_name="Context Bench", phone=PHONE, mpesa_balance=4200)
+    user.set_pin("0000")
+    db.session.add(user)
+    db.session.flush()
+    now = datetime.utcnow()
+    db.session.add_all([
+        Transaction(user_id=user.id, amount=50 + i % 700, recipient=f"2547220{i % 40:05d}",
+                    timestamp=now - timedelta(minutes=37 * i))
+        for i in range(count)
+    ])
+    db.session.add(UserBudgetPlan(id="bench-plan", user_id=user.id, plan_name="Main", monthly_income=30000,
+                                  allocations={"Food": 8000, "Transport": 4000}, is_active=True))
+    db.session.commit()
+
+
+def _measure(build, repeat):
+    queries, ms, wall = [], [], []
+    for _ in range(repeat):
+        db.session.expire_all()
+        g.db_queries, g.db_seconds = 0, 0.0
+        start = time.perf_counter()
+        build(PHONE)
+        wall.append((time.perf_counter() - start) * 1000)
+        stats = db_stats()
+        queries.append(stats["queries"])
+        ms.append(stats["ms"])
+    return {"queries": queries[-1], "db_ms_median": round(statistics.median(ms), 3),
+            "wall_ms_median": round(statistics.median(wall), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--transactions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="simulated round-trip per statement")
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        _seed(args.transactions)
+
+        if args.rtt_ms:
+            @event.listens_for(Engine, "before_cursor_execute")
+            def _network(conn, cursor, statement, parameters, context, executemany):
+                time.sleep(args.rtt_ms / 1000.0)
+
+        report = {
+            "transactions": args.transactions,
+            "rtt_ms": args.rtt_ms,
+            "before": _measure(legacy_context, args.repeat),
+            "after": _measure(load_user_context, args.repeat),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
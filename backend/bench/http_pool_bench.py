@@ -0,0 +1,81 @@
+"""
+Per-call latency of outbound HTTP with and without the shared connection pool.
+
+Starts a local stub server and issues the same OpenRouter-shaped POST with
+module-level ``requests.post`` (a new connection per call, as the clients used
+to do) and with ``app.http_client`` (pooled keep-alive connections).
+
+    python -m bench.http_pool_bench --calls 500 --threads 4
+
+Against the real services the gap is larger than shown here because every
+fresh connection also pays a TLS handshake and a longer network round-trip.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app import http_client
+from bench.stub_server import StubServer
+
+PAYLOAD = {
+    "model": "stub-model",
+    "messages": [{"role": "user", "content": "ping"}],
+}
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _measure(send, url, calls, threads):
+    def one(_):
+        start = time.perf_counter()
+        resp = send(url, json=PAYLOAD, timeout=(3.05, 10))
+        resp.raise_for_status()
+        return (time.perf_counter() - start) * 1000.0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        samples = list(pool.map(one, range(calls)))
+    elapsed = time.perf_counter() - started
+    return {
+        "calls": calls,
+        "threads": threads,
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(_percentile(samples, 50), 3),
+        "p95_ms": round(_percentile(samples, 95), 3),
+        "p99_ms": round(_percentile(samples, 99), 3),
+        "calls_per_sec": round(calls / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="artificial server latency")
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency_ms / 1000.0) as stub:
+        # Warm both paths once so imports and the first pooled connect are excluded
+        requests.post(stub.openrouter_url, json=PAYLOAD, timeout=5)
+        http_client.post(stub.openrouter_url, json=PAYLOAD)
+
+        report = {
+            "without_pool": _measure(requests.post, stub.openrouter_url, args.calls, args.threads),
+            "with_pool": _measure(http_client.post, stub.openrouter_url, args.calls, args.threads),
+        }
+
+    http_client.reset_session()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
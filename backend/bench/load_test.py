@@ -0,0 +1,419 @@
+"""
+Open-loop load test of the real app under gunicorn, against stub dependencies.
+
+Starts two stub servers (OpenRouter and Daraja, each with its own latency
+distribution and error rate, see bench.stub_server.parse_latency), seeds a
+database with the DEMO_USERS profiles and their history, then runs
+``gunicorn wsgi:app`` with OPENROUTER_BASE_URL and MPESA_BASE_URL pointing at
+the stubs.
+
+Requests arrive as a Poisson process at --rate per second regardless of how
+fast the app answers (open loop), so a slow app builds a queue instead of
+slowing the generator down. Latency is measured from each request's scheduled
+arrival, which keeps client-side queueing in the numbers. Each arrival picks
+an endpoint from --mix and a demo user; fraud checks use that user's typical
+amounts and hours, with --anomaly-rate of them off-profile so that some reach
+the LLM.
+
+The report (stdout and --output) has p50/p95/p99, req/s and status counts per
+endpoint with sorted keys, so two runs can be diffed directly or with:
+
+    python -m bench.load_test --rate 20 --duration 60 --output before.json
+    python -m bench.load_test --rate 20 --duration 60 --output after.json
+    python -m bench.load_test --compare before.json after.json
+
+SQLite is used by default; pass --database-url for PostgreSQL (its tables are
+created if missing and the demo users replaced).
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from app.demo_controller import DEMO_USERS
+from bench.stub_server import StubServer, parse_latency
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIN = "4321"
+DEFAULT_MIX = "check-fraud=40,transactions=20,ask-ai=10,mpesa-max=10,stkpush=10,callback=10"
+RECIPIENTS = ["254722000000", "254733111111", "254744222222", "254755333333", "254766444444"]
+LOCATIONS = ["nairobi cbd", "westlands", "kilimani", "river road market"]
+QUESTIONS = [
+    "How can I save more each month?",
+    "Should I build an emergency fund first?",
+    "How much should I spend on food?",
+    "Is it better to pay off debt or save?",
+    "How do I budget an irregular income?",
+]
+MAX_QUERIES = [
+    "How am I doing with my budget this month?",
+    "Where is most of my money going?",
+    "Can I afford a 5000 KES purchase this week?",
+    "Give me one tip to cut my spending.",
+]
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _parse_mix(spec):
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name} (choose from {', '.join(SCENARIOS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def seed(database_url, history_days, rng):
+    """Create the DEMO_USERS with ``history_days`` of typical transactions; returns the user list."""
+    os.environ["DATABASE_URL"] = database_url
+    from app import create_app, db
+    from app.models import Transaction, User, UserFeatureProfile, UserSpendingDaily
+
+    app = create_app("production")
+    users = []
+    with app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        for key, profile in DEMO_USERS.items():
+            phone = profile["phone"].lstrip("+")
+            existing = User.query.filter_by(phone=phone).first()
+            if existing:
+                db.session.delete(existing)
+                db.session.flush()
+            user = User(full_name=profile["name"], phone=phone, mpesa_balance=profile["normal_limit"] * 3)
+            user.set_pin(PIN)
+            db.session.add(user)
+            db.session.flush()
+            rows = []
+            for day in range(history_days, 0, -1):
+                for _ in range(rng.randint(1, 4)):
+                    timestamp = (now - timedelta(days=day)).replace(
+                        hour=rng.choice(profile["typical_times"]), minute=rng.randint(0, 59))
+                    rows.append({
+                        "user_id": user.id, "amount": float(rng.choice(profile["typical_amounts"])),
+                        "recipient": rng.choice(RECIPIENTS), "timestamp": timestamp,
+                        "location": rng.choice(LOCATIONS), "is_fraudulent": False, "fraud_confidence": 0.0,
+                    })
+            db.session.bulk_insert_mappings(Transaction, rows)
+            users.append(dict(profile, key=key, id=user.id, phone=phone))
+        db.session.commit()
+        UserFeatureProfile.rebuild()
+        UserSpendingDaily.rebuild()
+    return users
+
+
+def _check_fraud(user, rng, state):
+    anomalous = rng.random() < state["anomaly_rate"]
+    if anomalous:
+        amount = max(user["typical_amounts"]) * rng.uniform(3, 8)
+        hour = rng.choice([h for h in range(24) if h not in user["typical_times"]])
+        recipient = f"2547{rng.randint(10000000, 99999999)}"
+    else:
+        amount = rng.choice(user["typical_amounts"])
+        hour = rng.choice(user["typical_times"])
+        recipient = rng.choice(RECIPIENTS)
+    timestamp = datetime.utcnow().replace(hour=hour, minute=rng.randint(0, 59), microsecond=0)
+    return "POST", "/api/check-fraud", {
+        "user_id": user["phone"],
+        "transaction": {"amount": round(amount, 2), "recipient": recipient,
+                        "timestamp": timestamp.isoformat(), "location": rng.choice(LOCATIONS)},
+    }
+
+
+def _transactions(user, rng, state):
+    return "GET", f"/api/users/{user['phone']}/transactions?limit=20", None
+
+
+def _ask_ai(user, rng, state):
+    return "POST", "/api/ask-ai", {"user_id": user["phone"], "question": rng.choice(QUESTIONS)}
+
+
+def _mpesa_max(user, rng, state):
+    return "POST", "/api/mpesa-max", {"user_id": user["phone"], "query": rng.choice(MAX_QUERIES)}
+
+
+def _stkpush(user, rng, state):
+    return "POST", "/api/stkpush", {
+        "user_id": user["id"], "phone_number": user["phone"],
+        "amount": rng.choice(user["typical_amounts"]), "account_reference": "LOADTEST",
+    }
+
+
+def _callback(user, rng, state):
+    # Answer an STK push made earlier in the run when there is one waiting
+    with state["lock"]:
+        checkout_request_id = state["checkouts"].pop() if state["checkouts"] else f"ws_CO_{uuid.uuid4().hex[:16]}"
+    paid = rng.random() < 0.9
+    callback = {
+        "MerchantRequestID": f"mr-{uuid.uuid4().hex[:12]}",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": 0 if paid else 1032,
+        "ResultDesc": "The service request is processed successfully." if paid else "Request cancelled by user",
+    }
+    if paid:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": rng.choice(user["typical_amounts"])},
+            {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+            {"Name": "PhoneNumber", "Value": int(user["phone"])},
+        ]}
+    return "POST", "/api/callback", {"Body": {"stkCallback": callback}}
+
+
+SCENARIOS = {
+    "check-fraud": _check_fraud,
+    "transactions": _transactions,
+    "ask-ai": _ask_ai,
+    "mpesa-max": _mpesa_max,
+    "stkpush": _stkpush,
+    "callback": _callback,
+}
+
+
+class _Gunicorn:
+    def __init__(self, env, workers, threads, log_path):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._log = open(log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--chdir", BACKEND_DIR, "--workers", str(workers),
+             "--threads", str(threads), "--bind", f"127.0.0.1:{self.port}", "--log-level", "warning", "wsgi:app"],
+            env=env, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise SystemExit(f"gunicorn exited with {self.process.returncode}; see {self._log.name}")
+            try:
+                if requests.get(f"{self.url}/api/health", timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise SystemExit(f"gunicorn did not become ready in {timeout}s; see {self._log.name}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+def _login(base_url, users):
+    for user in users:
+        resp = requests.post(f"{base_url}/api/login", json={"phone": user["phone"], "pin": PIN}, timeout=30)
+        if resp.status_code != 200:
+            raise SystemExit(f"Login as {user['phone']} failed: {resp.status_code} {resp.text}")
+        user["token"] = resp.json()["token"]
+
+
+def run_load(base_url, users, mix, rate, duration, warmup, max_in_flight, rng, state, timeout):
+    """Fire Poisson arrivals for warmup + duration seconds; returns samples recorded after the warmup."""
+    names, weights = list(mix), list(mix.values())
+    local = threading.local()
+    samples = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+
+    def send(name, scheduled, method, path, body, token, measured):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            resp = session.request(method, base_url + path, json=body, timeout=timeout,
+                                   headers={"Authorization": f"Bearer {token}"})
+            status = str(resp.status_code)
+            if name == "stkpush" and resp.status_code == 200:
+                checkout_request_id = resp.json().get("checkout_request_id")
+                if checkout_request_id:
+                    with state["lock"]:
+                        state["checkouts"].append(checkout_request_id)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed_ms = (time.perf_counter() - scheduled) * 1000.0
+        if measured:
+            with lock:
+                samples[name].append(elapsed_ms)
+                statuses[name][status] += 1
+
+    started = time.perf_counter()
+    measure_from = started + warmup
+    end = measure_from + duration
+    scheduled = started
+    late = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled >= end:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.01:
+                late += 1
+            name = rng.choices(names, weights)[0]
+            user = rng.choice(users)
+            method, path, body = SCENARIOS[name](user, rng, state)
+            pool.submit(send, name, scheduled, method, path, body, user["token"], scheduled >= measure_from)
+    return samples, statuses, late
+
+
+def build_report(samples, statuses, duration):
+    endpoints = {}
+    for name in sorted(samples):
+        values = samples[name]
+        ok = sum(count for status, count in statuses[name].items() if status.startswith("2"))
+        endpoints[name] = {
+            "requests": len(values),
+            "ok": ok,
+            "errors": len(values) - ok,
+            "statuses": dict(sorted(statuses[name].items())),
+            "req_per_sec": round(len(values) / duration, 2),
+            "p50_ms": round(_percentile(values, 50), 1),
+            "p95_ms": round(_percentile(values, 95), 1),
+            "p99_ms": round(_percentile(values, 99), 1),
+            "max_ms": round(max(values), 1),
+        }
+    everything = [value for values in samples.values() for value in values]
+    total_ok = sum(e["ok"] for e in endpoints.values())
+    overall = {
+        "requests": len(everything),
+        "ok": total_ok,
+        "errors": len(everything) - total_ok,
+        "req_per_sec": round(len(everything) / duration, 2),
+        "p50_ms": round(_percentile(everything, 50), 1) if everything else None,
+        "p95_ms": round(_percentile(everything, 95), 1) if everything else None,
+        "p99_ms": round(_percentile(everything, 99), 1) if everything else None,
+    }
+    return {"endpoints": endpoints, "overall": overall}
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    rows = [("overall", before["overall"], after["overall"])]
+    for name in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        rows.append((name, before["endpoints"].get(name, {}), after["endpoints"].get(name, {})))
+    print(f"{'endpoint':<14}" + "".join(f"{field:>24}" for field in ("p50_ms", "p95_ms", "p99_ms", "req_per_sec", "errors")))
+    for name, old, new in rows:
+        cells = []
+        for field in ("p50_ms", "p95_ms", "p99_ms", "req_per_sec", "errors"):
+            a, b = old.get(field), new.get(field)
+            cells.append(f"{a} -> {b}" if a is not None and b is not None else "-")
+        print(f"{name:<14}" + "".join(f"{cell:>24}" for cell in cells))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=10.0, help="arrivals per second across all endpoints")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of load before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight,...")
+    parser.add_argument("--anomaly-rate", type=float, default=0.2, help="share of off-profile fraud checks")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--llm-latency", default="lognormal:0.8:0.5")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--daraja-latency", default="lognormal:0.3:0.4")
+    parser.add_argument("--daraja-error-rate", type=float, default=0.0)
+    parser.add_argument("--history-days", type=int, default=60)
+    parser.add_argument("--database-url", default=None, help="default: a temporary SQLite file")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="client threads")
+    parser.add_argument("--timeout", type=float, default=60.0, help="client timeout per request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="also write the report here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="print the change between two reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    mix = _parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="shieldai-load-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    users = seed(database_url, args.history_days, rng)
+
+    llm = StubServer(latency=parse_latency(args.llm_latency, random.Random(args.seed + 1)),
+                     error_rate=args.llm_error_rate, seed=args.seed + 2).start()
+    daraja = StubServer(latency=parse_latency(args.daraja_latency, random.Random(args.seed + 3)),
+                        error_rate=args.daraja_error_rate, seed=args.seed + 4).start()
+    env = dict(os.environ,
+               FLASK_ENV="production", DATABASE_URL=database_url, LOG_DIR=workdir,
+               OPENROUTER_API_KEY="load-test", OPENROUTER_BASE_URL=llm.openrouter_url,
+               MPESA_BASE_URL=daraja.url, MPESA_CONSUMER_KEY="load-test", MPESA_CONSUMER_SECRET="load-test",
+               MPESA_BUSINESS_SHORTCODE="174379", MPESA_PASSKEY="load-test",
+               MPESA_CALLBACK_URL="https://example.test/api/callback")
+    server = _Gunicorn(env, args.workers, args.threads, os.path.join(workdir, "gunicorn.log"))
+    try:
+        server.wait_ready()
+        _login(server.url, users)
+        state = {"anomaly_rate": args.anomaly_rate, "checkouts": [], "lock": threading.Lock()}
+        samples, statuses, late = run_load(server.url, users, mix, args.rate, args.duration, args.warmup,
+                                           args.max_in_flight, rng, state, args.timeout)
+    finally:
+        server.stop()
+        llm.stop()
+        daraja.stop()
+        print(f"gunicorn log and database in {workdir}", file=sys.stderr)
+
+    report = build_report(samples, statuses, args.duration)
+    report["run"] = {
+        "commit": _git_commit(),
+        "rate": args.rate, "duration": args.duration, "warmup": args.warmup, "mix": mix,
+        "anomaly_rate": args.anomaly_rate, "workers": args.workers, "threads": args.threads,
+        "llm": {"latency": args.llm_latency, "error_rate": args.llm_error_rate},
+        "daraja": {"latency": args.daraja_latency, "error_rate": args.daraja_error_rate},
+        "database": database_url.split(":", 1)[0], "seed": args.seed,
+        # Arrivals sent more than 10 ms behind schedule: the generator itself could not keep up
+        "late_arrivals": late,
+    }
+    report["dependency_calls"] = {"openrouter": sum(llm.calls.values()), "daraja": dict(sorted(daraja.calls.items()))}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+STK callback throughput with application logging off, synchronous and queued.
+
+Runs ``gunicorn wsgi:app`` once per mode against a seeded database,
+with callbacks stored and acknowledged (MPESA_CALLBACK_MODE=queue) and no
+consumer applying them, so each request is one insert plus its logging.
+--clients threads post Daraja-shaped callbacks back to back for --duration
+seconds (closed loop):
+
+- off:      LOG_LEVEL=WARNING, no per-request record
+- sync:     LOG_ASYNC=0, file and stream handlers written on the request thread
+- queue:    LOG_ASYNC=1 (default), a background thread writes
+- payload:  queue, with every raw callback attached (LOG_PAYLOAD_SAMPLE_RATE=1)
+
+    python -m bench.logging_bench --duration 15 --clients 16
+
+On SQLite the single writer bounds throughput in every mode; pass
+--database-url for PostgreSQL to see the logging cost more clearly.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import requests
+
+from bench.load_test import _callback, _Gunicorn, _percentile, seed
+
+MODES = {
+    "off": {"LOG_LEVEL": "WARNING", "LOG_REQUESTS": "0"},
+    "sync": {"LOG_ASYNC": "0"},
+    "queue": {"LOG_ASYNC": "1"},
+    "payload": {"LOG_ASYNC": "1", "LOG_PAYLOAD_SAMPLE_RATE": "1"},
+}
+
+
+def run_clients(base_url, users, clients, duration, seed_value):
+    """Post callbacks from ``clients`` threads for ``duration`` seconds; returns (latencies, statuses)."""
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    state = {"checkouts": [], "lock": threading.Lock()}
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(seed_value + index)
+        session = requests.Session()
+        local_latencies, local_statuses = [], Counter()
+        while time.monotonic() < deadline:
+            _, path, body = _callback(rng.choice(users), rng, state)
+            start = time.perf_counter()
+            try:
+                status = session.post(f"{base_url}{path}", json=body, timeout=30).status_code
+            except requests.RequestException:
+                status = "error"
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--database-url", default=None, help="default: a SQLite file per mode")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="also write the report here")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="shieldai-logging-")
+    report = {"clients": args.clients, "duration": args.duration, "workers": args.workers,
+              "threads": args.threads, "modes": {}}
+    for mode in args.modes.split(","):
+        if mode not in MODES:
+            raise SystemExit(f"Unknown mode: {mode} (choose from {', '.join(MODES)})")
+        mode_dir = os.path.join(workdir, mode)
+        os.makedirs(mode_dir)
+        database_url = args.database_url or f"sqlite:///{os.path.join(mode_dir, 'bench.db')}"
+        users = seed(database_url, 0, random.Random(args.seed))
+        env = dict(os.environ, FLASK_ENV="production", DATABASE_URL=database_url, LOG_DIR=mode_dir,
+                   MPESA_CALLBACK_MODE="queue", MPESA_CALLBACK_CONSUMER="none", **MODES[mode])
+        server = _Gunicorn(env, args.workers, args.threads, os.path.join(mode_dir, "gunicorn.log"))
+        try:
+            server.wait_ready()
+            run_clients(server.url, users, args.clients, args.warmup, args.seed)
+            latencies, statuses = run_clients(server.url, users, args.clients, args.duration, args.seed)
+        finally:
+            server.stop()
+        log_path = os.path.join(mode_dir, "app.log")
+        report["modes"][mode] = {
+            "req_per_sec": round(len(latencies) / args.duration, 1),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            "statuses": {str(status): count for status, count in statuses.items()},
+            "log_bytes": os.path.getsize(log_path) if os.path.exists(log_path) else 0,
+        }
+        print(json.dumps({mode: report["modes"][mode]}), file=sys.stderr)
+    print(f"gunicorn logs and databases in {workdir}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
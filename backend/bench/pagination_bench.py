@@ -0,0 +1,93 @@
+"""
+Page 1 vs. page 5,000 of one user's transactions: OFFSET vs. keyset cursor.
+
+Seeds --rows transactions for a single user into an in-memory SQLite database
+(with the composite (user_id, timestamp, id) index) and times fetching the
+first page and a deep page with LIMIT/OFFSET and with keyset_page.
+
+    python -m bench.pagination_bench --rows 1000000 --page-size 50 --page 5000
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import create_app, db
+from app.models import Transaction, User
+from app.pagination import encode_cursor, keyset_page
+
+
+def _seed(rows: int) -> int:
+    user = User(full_name="Heavy User", phone="254700000001")
+    user.set_pin("0000")
+    db.session.add(user)
+    db.session.commit()
+
+    start = datetime(2020, 1, 1)
+    chunk = 50_000
+    for base in range(0, rows, chunk):
+        db.session.execute(insert(Transaction), [
+            {"user_id": user.id, "amount": 100.0 + (i % 900), "recipient": f"2547220{i % 500:05d}",
+             "timestamp": start + timedelta(minutes=i), "is_fraudulent": False, "fraud_confidence": 0.0}
+            for i in range(base, min(rows, base + chunk))
+        ])
+    db.session.commit()
+    return user.id
+
+
+def _time(fn, repeat: int = 5) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--page", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        seed_start = time.perf_counter()
+        user_id = _seed(args.rows)
+        seeded_in = time.perf_counter() - seed_start
+
+        base = Transaction.query.filter_by(user_id=user_id)
+        ordered = base.order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+        offset = (args.page - 1) * args.page_size
+
+        # Cursor a client would hold after reading the pages before the deep one
+        previous = ordered.offset(offset - 1).limit(1).one()
+        deep_cursor = encode_cursor(previous.timestamp, previous.id)
+
+        def offset_page(skip):
+            return lambda: ordered.offset(skip).limit(args.page_size).all()
+
+        def cursor_page(cursor):
+            return lambda: keyset_page(base, Transaction.timestamp, Transaction.id, args.page_size, cursor)
+
+        assert [t.id for t in offset_page(offset)()] == [t.id for t in cursor_page(deep_cursor)()[0]]
+
+        report = {
+            "rows": args.rows,
+            "seed_seconds": round(seeded_in, 1),
+            "page_size": args.page_size,
+            "deep_page": args.page,
+            "offset_ms": {"page_1": _time(offset_page(0)), f"page_{args.page}": _time(offset_page(offset))},
+            "keyset_ms": {"page_1": _time(cursor_page(None)), f"page_{args.page}": _time(cursor_page(deep_cursor))},
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+M-Pesa Max request size and latency: one concatenated prompt vs. system + user messages.
+
+Sends the same questions and user context to a local stub OpenRouter, first
+as the old single user message (persona, query and context concatenated
+under the JSON-only system message) and then as the stable system message
+with a cache_control breakpoint followed by the per-call user message.
+Reports request bytes, latency and the prompt tokens the stub's prefix cache
+model would still have to process. The stub cannot show a real provider's
+prefill time, so --prefill-ms-per-1k charges an assumed cost for uncached
+tokens.
+
+    python -m bench.prompt_bench --requests 50 --prefill-ms-per-1k 20
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bench.stub_server import OPENROUTER_PATH, StubServer
+from app.fraud_detector import FraudDetector
+
+QUESTIONS = [
+    "How do I save for land?",
+    "Is Bitcoin good?",
+    "Why is my balance always low by the 20th?",
+    "Should I take a Fuliza loan for school fees?",
+    "How much should I send home every month?",
+]
+
+
+def _context():
+    now = datetime(2025, 3, 1, 12, 0)
+    return {
+        "mpesa_balance": 2450.0,
+        "recent_transactions": [
+            {"id": i, "amount": 150.0 + 35 * i, "recipient": f"2547220000{i:02d}",
+             "timestamp": (now - timedelta(hours=9 * i)).isoformat(), "location": "Nairobi"}
+            for i in range(10)
+        ],
+        "spending_patterns": [{"recipient": f"2547220000{i:02d}", "amount": 4200.0 - 600 * i} for i in range(5)],
+        "budget_info": {"plan_name": "Main", "monthly_income": 30000, "allocations": {"Food": 8000, "Rent": 9000}},
+    }
+
+
+def legacy_prompt(detector, query, context):
+    # The single-message prompt sent before the system/user split
+    return f"{detector._get_mpesa_max_system_prompt()}\n\nUser Query: {query}\n{detector._build_user_context(context)}"
+
+
+def _run(build, requests, prefill):
+    context = _context()
+    with StubServer(completion_content="Stub advice.", prefill_ms_per_1k_tokens=prefill) as stub:
+        detector = FraudDetector(api_key="bench-key", base_url=stub.openrouter_url)
+        latencies, uncached = [], []
+        for i in range(requests):
+            prompt = build(detector, QUESTIONS[i % len(QUESTIONS)], context)
+            start = time.perf_counter()
+            usage = detector._call_openrouter(detector.primary_model, prompt)["usage"]
+            latencies.append((time.perf_counter() - start) * 1000)
+            uncached.append(usage["prompt_tokens"] - usage["prompt_tokens_details"]["cached_tokens"])
+        return {
+            "bytes_per_request": stub.bytes_received[OPENROUTER_PATH] // requests,
+            "latency_ms_median": round(statistics.median(latencies), 3),
+            "prompt_tokens": usage["prompt_tokens"],
+            "uncached_prompt_tokens_median": statistics.median(uncached),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                        help="assumed provider time per 1k uncached prompt tokens")
+    args = parser.parse_args()
+
+    report = {
+        "requests": args.requests,
+        "prefill_ms_per_1k": args.prefill_ms_per_1k,
+        "before": _run(legacy_prompt, args.requests, args.prefill_ms_per_1k),
+        "after": _run(lambda d, q, c: d._build_mpesa_max_messages(q, c), args.requests, args.prefill_ms_per_1k),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
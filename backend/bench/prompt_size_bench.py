@@ -0,0 +1,74 @@
+"""
+Fraud prompt size before and after the compact history encoding.
+
+Builds the fraud prompt for synthetic histories of 10, 50 and 500
+transactions (shaped like Transaction.to_dict()) and reports size in
+characters and estimated tokens for the old JSON dump and the new encoding.
+
+    python -m bench.prompt_size_bench --budget 800
+"""
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+from app.fraud_detector import FraudDetector
+from app.history_encoding import estimate_tokens
+
+TX = {"amount": 4500.0, "recipient": "254799999999", "timestamp": "2025-03-01T02:40:00Z", "location": "Kisumu"}
+
+
+def synthetic_history(size: int, seed: int = 7):
+    rng = random.Random(seed)
+    recipients = [f"2547{rng.randint(10000000, 99999999)}" for _ in range(12)]
+    locations = ["Nairobi CBD", "Westlands", "Kilimani", "River Road Market", None]
+    start = datetime(2025, 1, 1, 8, 0)
+    history = []
+    for i in range(size):
+        fraud = rng.random() < 0.05
+        history.append({
+            "id": i + 1,
+            "user_id": 42,
+            "amount": round(rng.uniform(50, 2000), 2),
+            "recipient": rng.choice(recipients),
+            "timestamp": (start + timedelta(hours=6 * i + rng.randint(0, 5))).isoformat(),
+            "location": rng.choice(locations),
+            "is_fraudulent": fraud,
+            "fraud_confidence": round(rng.uniform(0.7, 0.95), 2) if fraud else 0.0,
+        })
+    history.reverse()  # history_for_user returns newest first
+    return history
+
+
+def legacy_prompt(detector: FraudDetector, history, tx) -> str:
+    # The pre-compaction format: instructions followed by the raw JSON dumps
+    compact = detector._build_prompt([], tx)
+    instructions = compact.split("\n\nUSER_HISTORY:", 1)[0]
+    return f"{instructions}\n\nUSER_HISTORY={json.dumps(history, ensure_ascii=False)}\nCURRENT_TRANSACTION={json.dumps(tx, ensure_ascii=False)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget", type=int, default=800, help="history token budget")
+    args = parser.parse_args()
+
+    detector = FraudDetector(api_key="bench", history_token_budget=args.budget)
+    report = []
+    for size in (10, 50, 500):
+        history = synthetic_history(size)
+        before = legacy_prompt(detector, history, TX)
+        after = detector._build_prompt(history, TX)
+        report.append({
+            "history_size": size,
+            "before_chars": len(before),
+            "before_tokens_est": estimate_tokens(before),
+            "after_chars": len(after),
+            "after_tokens_est": estimate_tokens(after),
+            "reduction_pct": round(100.0 * (1 - len(after) / len(before)), 1),
+        })
+    print(json.dumps({"token_budget": args.budget, "results": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Local stand-ins for OpenRouter and Safaricom Daraja.
+
+Used by the benchmarks so that latency can be measured without touching the
+real services. Point the app at a running stub with:
+
+    OPENROUTER_BASE_URL=<stub.openrouter_url>  MPESA_BASE_URL=<stub.url>
+
+or run one standalone:
+
+    python -m bench.stub_server --port 8100 --latency lognormal:0.8:0.5 --error-rate 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Tuple, Union
+
+OPENROUTER_PATH = "/api/v1/chat/completions"
+
+FRAUD_VERDICT = '{"is_fraud": false, "confidence": 0.1, "action_required": false, "reason": "stub verdict"}'
+
+
+def parse_latency(spec: str, rng: Optional[random.Random] = None) -> Union[float, Callable[[], float]]:
+    """Latency from a spec string: seconds, or a distribution drawn per request.
+
+        0.25 / fixed:0.25        always 250 ms
+        uniform:0.1:0.5          uniform between 100 and 500 ms
+        exp:0.3                  exponential with a 300 ms mean
+        lognormal:0.8:0.5        log-normal with an 800 ms median and sigma 0.5
+                                 (p95 is about median * 2.3), the usual LLM shape
+    """
+    rng = rng or random.Random()
+    kind, _, rest = str(spec).partition(":")
+    if not rest:
+        try:
+            return float(kind)
+        except ValueError:
+            raise ValueError(f"Unknown latency spec: {spec}")
+    params = [float(p) for p in rest.split(":")]
+    if kind == "fixed":
+        return params[0]
+    if kind == "uniform":
+        low, high = params
+        return lambda: rng.uniform(low, high)
+    if kind == "exp":
+        mean = params[0]
+        return lambda: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    if kind == "lognormal":
+        median, sigma = params
+        mu = math.log(median)
+        return lambda: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between calls
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs
+    # add ~40 ms to every response on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        stub = self.server.stub
+        path = self.path.split("?", 1)[0]
+        stub.record(path, len(body))
+
+        delay = stub.latency() if callable(stub.latency) else stub.latency
+        if delay:
+            time.sleep(delay)
+
+        if stub.should_fail():
+            self._send_json(stub.error_status, {"error": {"code": stub.error_status, "message": "stub injected error"}})
+            return
+
+        if method == "POST" and path == OPENROUTER_PATH:
+            payload = json.loads(body or b"{}")
+            prompt_tokens, cached_tokens = stub.prompt_usage(payload)
+            if stub.prefill_ms_per_1k_tokens:
+                time.sleep((prompt_tokens - cached_tokens) / 1000.0 * stub.prefill_ms_per_1k_tokens / 1000.0)
+            if payload.get("stream"):
+                self._send_stream(payload.get("model", "stub-model"), stub)
+                return
+            self._send_json(200, {
+                "id": f"stub-{uuid.uuid4().hex[:12]}",
+                "model": payload.get("model", "stub-model"),
+                "choices": [{"message": {"role": "assistant", "content": stub.completion_content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+            })
+        elif method == "GET" and path == "/oauth/v1/generate":
+            self._send_json(200, {"access_token": f"stub-token-{uuid.uuid4().hex[:8]}", "expires_in": "3599"})
+        elif method == "POST" and path == "/mpesa/stkpush/v1/processrequest":
+            self._send_json(200, {
+                "MerchantRequestID": f"stub-mr-{uuid.uuid4().hex[:12]}",
+                "CheckoutRequestID": f"ws_CO_{uuid.uuid4().hex[:16]}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing",
+            })
+        elif method == "POST" and path == "/mpesa/stkpushquery/v1/query":
+            payload = json.loads(body or b"{}")
+            checkout_request_id = payload.get("CheckoutRequestID")
+            if stub.stk_query_result is not None:
+                status, data = stub.stk_query_result(checkout_request_id)
+                self._send_json(status, data)
+                return
+            self._send_json(200, {
+                "ResponseCode": "0",
+                "CheckoutRequestID": checkout_request_id,
+                "ResultCode": "0",
+                "ResultDesc": "The service request is processed successfully.",
+            })
+        else:
+            self._send_json(404, {"error": "not_found", "path": path})
+
+    def _send_stream(self, model: str, stub: "StubServer"):
+        # OpenRouter-style SSE over chunked transfer encoding, one word per chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._write_chunk(": OPENROUTER PROCESSING\n\n")
+        words = stub.completion_content.split(" ")
+        for index, word in enumerate(words):
+            if index and stub.token_delay:
+                time.sleep(stub.token_delay)
+            delta = word if index == 0 else f" {word}"
+            chunk = {"id": "stub-stream", "model": model, "choices": [{"delta": {"content": delta}}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    # Room for bursts of hundreds of concurrent connections (bench.async_bench)
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class StubServer:
+    """Threaded HTTP server answering OpenRouter and Daraja endpoints.
+
+    ``latency`` is a fixed delay in seconds or a callable returning one per request.
+    Streaming completions ("stream": true) send the content word by word,
+    ``token_delay`` seconds apart.
+
+    Completions report ``usage`` with prompt tokens estimated at four characters
+    each. Like a provider prefix cache, messages up to the last ``cache_control``
+    breakpoint count as cached once the same prefix has been seen for the model.
+    ``prefill_ms_per_1k_tokens`` adds a delay for the uncached prompt tokens.
+
+    ``stk_query_result`` maps a CheckoutRequestID to the (status, body) of the
+    STK query response; by default every query reports success.
+
+    A fraction ``error_rate`` of requests (after their latency) is answered
+    with ``error_status`` instead; ``seed`` makes the draws repeatable.
+    """
+
+    def __init__(self, latency: Union[float, Callable[[], float]] = 0.0,
+                 host: str = "127.0.0.1", port: int = 0,
+                 completion_content: str = FRAUD_VERDICT, token_delay: float = 0.0,
+                 prefill_ms_per_1k_tokens: float = 0.0,
+                 stk_query_result: Optional[Callable[[str], Tuple[int, dict]]] = None,
+                 error_rate: float = 0.0, error_status: int = 503, seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self.stk_query_result = stk_query_result
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self._cached_prefixes = set()
+        self.completion_content = completion_content
+        self.token_delay = token_delay
+        self.calls = Counter()
+        self.bytes_received = Counter()
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _StubHandler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openrouter_url(self) -> str:
+        return f"{self.url}{OPENROUTER_PATH}"
+
+    def record(self, path: str, size: int) -> None:
+        with self._lock:
+            self.calls[path] += 1
+            self.bytes_received[path] += size
+
+    def should_fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def prompt_usage(self, payload: dict) -> Tuple[int, int]:
+        """(prompt tokens, cached prompt tokens) for a chat completion request."""
+        texts, prefix_end = [], 0
+        for message in payload.get("messages") or []:
+            content = message.get("content")
+            parts = [{"text": content}] if isinstance(content, str) else content or []
+            for part in parts:
+                texts.append(part.get("text") or "")
+                if part.get("cache_control"):
+                    prefix_end = len(texts)
+        prompt_tokens = sum(len(text) for text in texts) // 4
+        if not prefix_end:
+            return prompt_tokens, 0
+        prefix = texts[:prefix_end]
+        key = hashlib.sha256(json.dumps([payload.get("model"), prefix]).encode()).hexdigest()
+        with self._lock:
+            seen = key in self._cached_prefixes
+            self._cached_prefixes.add(key)
+        return prompt_tokens, (sum(len(text) for text in prefix) // 4 if seen else 0)
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the OpenRouter and Daraja stubs until interrupted.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="0", help="seconds or distribution, see parse_latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stub = StubServer(latency=parse_latency(args.latency, rng), host=args.host, port=args.port,
+                      token_delay=args.token_delay, error_rate=args.error_rate,
+                      error_status=args.error_status, seed=args.seed)
+    print(f"OPENROUTER_BASE_URL={stub.openrouter_url}")
+    print(f"MPESA_BASE_URL={stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub._server.server_close()
+        print(json.dumps({"calls": dict(stub.calls)}))
+
+
+if __name__ == "__main__":
+    main()
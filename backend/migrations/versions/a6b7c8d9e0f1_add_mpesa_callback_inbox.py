@@ -0,0 +1,42 @@
+"""Add the M-Pesa callback inbox.
+
+Revision ID: a6b7c8d9e0f1
+Revises: f5a6b7c8d9e0
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6b7c8d9e0f1'
+down_revision = 'f5a6b7c8d9e0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mpesa_callback_inbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('checkout_request_id', sa.String(length=64), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('result_status', sa.Integer(), nullable=True),
+    sa.Column('last_error', sa.String(length=256), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('mpesa_callback_inbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_mpesa_callback_inbox_checkout_request_id'), ['checkout_request_id'], unique=False)
+        batch_op.create_index('ix_mpesa_callback_inbox_pending', ['processed_at', 'available_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mpesa_callback_inbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_mpesa_callback_inbox_pending')
+        batch_op.drop_index(batch_op.f('ix_mpesa_callback_inbox_checkout_request_id'))
+
+    op.drop_table('mpesa_callback_inbox')
@@ -0,0 +1,38 @@
+"""Add user feature profiles table.
+
+Revision ID: c2d3e4f5a6b7
+Revises: b1c2d3e4f5g6
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d3e4f5a6b7'
+down_revision = 'b1c2d3e4f5g6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_feature_profiles',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tx_count', sa.Integer(), nullable=False),
+    sa.Column('amount_mean', sa.Float(), nullable=False),
+    sa.Column('amount_m2', sa.Float(), nullable=False),
+    sa.Column('hour_histogram', sa.JSON(), nullable=False),
+    sa.Column('recipients', sa.JSON(), nullable=False),
+    sa.Column('locations', sa.JSON(), nullable=False),
+    sa.Column('recent_timestamps', sa.JSON(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Existing rows are backfilled with: python run.py rebuild-features
+
+
+def downgrade():
+    op.drop_table('user_feature_profiles')
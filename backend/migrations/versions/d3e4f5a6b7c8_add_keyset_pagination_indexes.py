@@ -0,0 +1,32 @@
+"""Add composite indexes for keyset pagination of transaction listings.
+
+Revision ID: d3e4f5a6b7c8
+Revises: c2d3e4f5a6b7
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3e4f5a6b7c8'
+down_revision = 'c2d3e4f5a6b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.create_index('ix_transactions_user_timestamp_id', ['user_id', 'timestamp', 'id'], unique=False)
+
+    with op.batch_alter_table('mpesa_transactions', schema=None) as batch_op:
+        batch_op.create_index('ix_mpesa_transactions_user_created_id', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mpesa_transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_mpesa_transactions_user_created_id')
+
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_transactions_user_timestamp_id')
@@ -0,0 +1,33 @@
+"""Add composite indexes for the budget plan and M-Pesa status lookups.
+
+Revision ID: e4f5a6b7c8d9
+Revises: d3e4f5a6b7c8
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4f5a6b7c8d9'
+down_revision = 'd3e4f5a6b7c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # transactions (user_id, timestamp, id) was added in d3e4f5a6b7c8
+    with op.batch_alter_table('user_budget_plans', schema=None) as batch_op:
+        batch_op.create_index('ix_user_budget_plans_user_active_updated', ['user_id', 'is_active', 'updated_at'], unique=False)
+
+    with op.batch_alter_table('mpesa_transactions', schema=None) as batch_op:
+        batch_op.create_index('ix_mpesa_transactions_user_status_created', ['user_id', 'status', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mpesa_transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_mpesa_transactions_user_status_created')
+
+    with op.batch_alter_table('user_budget_plans', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_budget_plans_user_active_updated')
@@ -0,0 +1,49 @@
+"""Add daily per-recipient spending aggregates.
+
+Revision ID: f5a6b7c8d9e0
+Revises: e4f5a6b7c8d9
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a6b7c8d9e0'
+down_revision = 'e4f5a6b7c8d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_spending_daily',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('recipient', sa.String(length=64), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.Column('tx_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day', 'recipient')
+    )
+    # Backfill from existing transactions so summaries are complete right after the upgrade
+    # (python run.py rebuild-spending recomputes them at any time)
+    transactions = sa.table('transactions',
+                            sa.column('user_id', sa.Integer()),
+                            sa.column('recipient', sa.String()),
+                            sa.column('timestamp', sa.DateTime()),
+                            sa.column('amount', sa.Float()))
+    spending = sa.table('user_spending_daily',
+                        sa.column('user_id'), sa.column('day'), sa.column('recipient'),
+                        sa.column('total_amount'), sa.column('tx_count'))
+    day = sa.func.date(transactions.c.timestamp)
+    op.execute(spending.insert().from_select(
+        ['user_id', 'day', 'recipient', 'total_amount', 'tx_count'],
+        sa.select(transactions.c.user_id, day, transactions.c.recipient,
+                  sa.func.sum(transactions.c.amount), sa.func.count())
+        .group_by(transactions.c.user_id, day, transactions.c.recipient),
+    ))
+
+
+def downgrade():
+    op.drop_table('user_spending_daily')
@@ -1,7 +1,8 @@
 import os
 import sys
-from app import create_app, db
-from app.seed_data import seed_database, clear_database
+from app import create_app, db, start_background_workers
+from app.models import UserFeatureProfile, UserSpendingDaily
+from app.seed_data import seed_database, clear_database, generate_synthetic_data
 
 def init_db():
     """Initialize the database."""
@@ -15,20 +16,114 @@ def seed_db():
     with create_app().app_context():
         seed_database()
 
+def seed_synthetic(users, days=30, workers=1, chunk_users=1000, seed=None, skip_aggregates=False):
+    """Append synthetic users, transactions and STK pushes; prints rows/sec."""
+    import json
+
+    def progress(done, chunks, totals):
+        rows = totals['users'] + totals['transactions'] + totals['mpesa_transactions']
+        print(f"chunk {done}/{chunks}: {rows} rows", file=sys.stderr)
+
+    with create_app().app_context():
+        db.create_all()
+        report = generate_synthetic_data(users, days=days, workers=workers, chunk_users=chunk_users, seed=seed,
+                                         rebuild_aggregates=not skip_aggregates, progress=progress)
+        print(json.dumps(report))
+
+def _option(name, default=None, cast=int):
+    """Value following ``name`` on the command line, e.g. _option("--users")."""
+    if name in sys.argv[:-1]:
+        return cast(sys.argv[sys.argv.index(name) + 1])
+    return default
+
 def clear_db():
     """Clear all data from database."""
     with create_app().app_context():
         clear_database()
 
+def rebuild_features(user_id=None):
+    """Rebuild fraud feature profiles from the transactions table."""
+    with create_app().app_context():
+        written = UserFeatureProfile.rebuild(user_id)
+        print(f"Rebuilt {written} feature profile(s)")
+
+def rebuild_spending(user_id=None):
+    """Rebuild the daily spending aggregates from the transactions table."""
+    with create_app().app_context():
+        written = UserSpendingDaily.rebuild(user_id)
+        print(f"Rebuilt {written} daily spending row(s)")
+
+def explain(user_id=1, analyze=False):
+    """Print EXPLAIN plans for the hot queries on the configured database."""
+    from app.query_audit import explain_hot_queries
+
+    with create_app().app_context():
+        for name, sql, plan in explain_hot_queries(user_id, analyze=analyze):
+            print(f"== {name}")
+            print(sql)
+            for line in plan:
+                print(f"  {line}")
+            print()
+
+def process_callbacks(once=False):
+    """Apply queued M-Pesa callbacks (for deployments with MPESA_CALLBACK_CONSUMER=none)."""
+    import time
+    from app.mpesa.callback_queue import drain_callbacks
+
+    app = create_app()
+    with app.app_context():
+        batch_size = app.config["MPESA_CALLBACK_BATCH_SIZE"]
+        max_attempts = app.config["MPESA_CALLBACK_MAX_ATTEMPTS"]
+        while True:
+            applied = drain_callbacks(batch_size, max_attempts)
+            if applied:
+                print(f"Processed {applied} callback(s)")
+            db.session.remove()
+            if once:
+                break
+            time.sleep(app.config["MPESA_CALLBACK_POLL_SECONDS"])
+
+def reconcile(once=False):
+    """Query Daraja for stale pending STK pushes (run in a single process)."""
+    import json
+    import time
+    from app.mpesa.reconciler import get_reconciler
+
+    app = create_app()
+    with app.app_context():
+        reconciler = get_reconciler(app)
+        while True:
+            print(json.dumps(reconciler.run_once()))
+            db.session.remove()
+            if once:
+                break
+            time.sleep(reconciler.interval_seconds)
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         command = sys.argv[1]
         if command == "init-db":
             init_db()
         elif command == "seed-db":
-            seed_db()
+            if "--users" in sys.argv:
+                seed_synthetic(_option("--users"), days=_option("--days", 30), workers=_option("--workers", 1),
+                               chunk_users=_option("--chunk-users", 1000), seed=_option("--seed"),
+                               skip_aggregates="--skip-aggregates" in sys.argv)
+            else:
+                seed_db()
         elif command == "clear-db":
             clear_db()
+        elif command == "rebuild-features":
+            rebuild_features(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        elif command == "rebuild-spending":
+            rebuild_spending(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        elif command == "explain":
+            args = [a for a in sys.argv[2:] if a != "--analyze"]
+            explain(int(args[0]) if args else 1, analyze="--analyze" in sys.argv)
+        elif command == "process-callbacks":
+            process_callbacks(once="--once" in sys.argv)
+        elif command == "reconcile":
+            reconcile(once="--once" in sys.argv)
         elif command == "reset-db":
             with create_app().app_context():
                 clear_database()
@@ -36,7 +131,7 @@ if __name__ == "__main__":
                 seed_database()
             print("Database reset complete!")
         else:
-            print("Usage: python run.py [init-db|seed-db|clear-db|reset-db]")
+            print("Usage: python run.py [init-db|seed-db [--users N --days D --workers K [--chunk-users N] [--seed S] [--skip-aggregates]]|clear-db|reset-db|rebuild-features [user_id]|rebuild-spending [user_id]|explain [user_id] [--analyze]|process-callbacks [--once]|reconcile [--once]]")
             sys.exit(1)
     else:
         # Normal server run
@@ -51,5 +146,8 @@ if __name__ == "__main__":
         host = os.getenv("HOST", "0.0.0.0")
         port = int(os.getenv("PORT", "5000"))
         debug = env == "development"
+        # With the debug reloader only the child process serves
+        if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_background_workers(app)
         print(f"Starting server on {host}:{port} (debug={debug})")
         app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+from app import create_app, db
+from app.asgi import AsgiApp
+from app.models import Transaction, User
+from bench.stub_server import OPENROUTER_PATH, StubServer
+
+
+async def _call(app, method, path, body=None):
+    """Send one request through the ASGI app; returns (status, headers, parsed JSON body)."""
+    data = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())],
+        "client": ("127.0.0.1", 5000), "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": data, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    content = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], dict(start["headers"]), json.loads(content)
+
+
+class AsgiAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user = User(full_name="Async User", phone="254700000030")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.commit()
+        self.asgi = AsgiApp(self.app, db_threads=2, wsgi_threads=2)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_model_calls_are_awaited_and_other_routes_bridged(self):
+        async def scenario():
+            return await asyncio.gather(
+                _call(self.asgi, "POST", "/api/mpesa-max", {"user_id": "254700000030", "query": "Budget?"}),
+                _call(self.asgi, "POST", "/api/ask-ai", {"user_id": "254700000030", "question": "Save?"}),
+                _call(self.asgi, "POST", "/api/mpesa-max", {"user_id": "254799999999", "query": "Budget?"}),
+                _call(self.asgi, "GET", "/api/health"),
+            )
+
+        with StubServer(latency=0.2, completion_content="Save KES 50 a day") as stub, \
+                patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key", "OPENROUTER_BASE_URL": stub.openrouter_url}):
+            mpesa_max, ask_ai, missing, health = asyncio.run(scenario())
+
+        self.assertEqual(mpesa_max[0], 200)
+        self.assertEqual(mpesa_max[2]["answer"], "Save KES 50 a day")
+        self.assertEqual(ask_ai[0], 200)
+        self.assertEqual(ask_ai[2]["answer"], "Save KES 50 a day")
+        self.assertEqual(missing[0], 404)
+        self.assertEqual(missing[2]["error"], "not_found")
+        self.assertEqual(health[0], 200)
+        # The reply went through the app's after_request hooks
+        self.assertIn(b"server-timing", mpesa_max[1])
+        self.assertEqual(stub.calls[OPENROUTER_PATH], 2)
+
+    def test_ambiguous_fraud_check_awaits_the_model(self):
+        client = self.app.test_client()
+        for day in range(1, 8):
+            client.post("/api/check-fraud", json={
+                "user_id": "254700000030", "pin": "1234",
+                "transaction": {"amount": 200, "recipient": "254722000000", "timestamp": f"2025-01-0{day}T10:00:00Z"},
+            })
+        payload = {"user_id": "254700000030", "pin": "1234",
+                   "transaction": {"amount": 400, "recipient": "254733333333", "timestamp": "2025-01-09T10:00:00Z"}}
+
+        verdict = '{"is_fraud": true, "confidence": 0.6, "reason": "llm"}'
+        with StubServer(completion_content=verdict) as stub, \
+                patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key", "OPENROUTER_BASE_URL": stub.openrouter_url}):
+            status, headers, body = asyncio.run(_call(self.asgi, "POST", "/api/check-fraud", payload))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body["routing"], "llm")
+        self.assertEqual(body["reason"], "llm")
+        self.assertTrue(body["is_fraud"])
+        self.assertEqual(stub.calls[OPENROUTER_PATH], 1)
+        self.assertEqual(Transaction.query.count(), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -80,6 +80,44 @@ class AuthTestCase(unittest.TestCase):
         response = self.client.post("/api/login", data=json.dumps(login_data), content_type="application/json")
         self.assertEqual(response.status_code, 404, "Did not return 404 for non-existent user.")
 
+    def _login(self):
+        self.client.post("/api/users", data=json.dumps(self.user_data), content_type="application/json")
+        login_data = {"phone": self.user_phone, "pin": self.user_pin}
+        return self.client.post("/api/login", data=json.dumps(login_data), content_type="application/json").get_json()
+
+    def test_6_session_token_replaces_pin(self):
+        """Test that the login token authenticates requests without a PIN."""
+        token = self._login()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = self.client.get(f"/api/users/{self.user_phone}/transactions", headers=headers)
+        self.assertEqual(response.status_code, 200, "Valid session token was rejected.")
+
+        response = self.client.get(f"/api/users/{self.user_phone}/transactions")
+        self.assertEqual(response.status_code, 400, "Request without PIN or token was accepted.")
+
+        response = self.client.get(f"/api/users/{self.user_phone}/transactions",
+                                   headers={"Authorization": f"Bearer {token}x"})
+        self.assertEqual(response.status_code, 401, "Tampered session token was accepted.")
+
+    def test_7_session_token_is_bound_to_user_and_pin(self):
+        """Test that a token cannot be used for another user or after a PIN change."""
+        token = self._login()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        other = User(full_name="Other User", phone="254799999998")
+        other.set_pin("9999")
+        db.session.add(other)
+        db.session.commit()
+        response = self.client.get("/api/users/254799999998/transactions", headers=headers)
+        self.assertEqual(response.status_code, 401, "Token was accepted for a different user.")
+
+        user = User.query.filter_by(phone=self.user_phone).first()
+        user.set_pin("5678")
+        db.session.commit()
+        response = self.client.get(f"/api/users/{self.user_phone}/transactions", headers=headers)
+        self.assertEqual(response.status_code, 401, "Token survived a PIN change.")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,216 @@
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+from app import create_app, db
+from app.cache import MemoryCache, RedisCache
+from app.circuit_breaker import reset_breakers
+from app.models import User, Transaction
+from bench.stub_server import OPENROUTER_PATH, StubServer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Local stand-in implementing the subset of redis-py used by RedisCache."""
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+        self.zsets = {}
+
+    def _alive(self, key):
+        if key in self.expiry and self.expiry[key] <= time.time():
+            self.values.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.values
+
+    def get(self, key):
+        return self.values[key].encode() if self._alive(key) else None
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        if ex is not None:
+            self.expiry[key] = time.time() + ex
+        return True
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += int(self.values.pop(key, None) is not None or self.zsets.pop(key, None) is not None)
+            self.expiry.pop(key, None)
+        return removed
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.zsets.get(key, {}).pop(member, None)
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def zrange(self, key, start, end):
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1])
+        end = len(members) if end == -1 else end + 1
+        return [member.encode() for member, _ in members[start:end]]
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.get(key, {})
+        for member in [m for m, score in zset.items() if low <= score <= high]:
+            del zset[member]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class MemoryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = MemoryCache(max_entries=2, ttl_seconds=10, clock=self.clock)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set("a", {"v": 1})
+        self.assertEqual(self.cache.get("a"), {"v": 1})
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+
+class RedisCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.cache = RedisCache(self.redis, namespace="test", max_entries=2, ttl_seconds=60)
+
+    def test_round_trip_and_lru_bound(self):
+        self.cache.set("a", {"v": 1})
+        time.sleep(0.01)
+        self.cache.set("b", {"v": 2})
+        time.sleep(0.01)
+        self.assertEqual(self.cache.get("a"), {"v": 1})
+        time.sleep(0.01)
+        self.cache.set("c", {"v": 3})
+
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), {"v": 3})
+        self.assertEqual(self.cache.stats()["entries"], 2)
+        self.assertEqual(json.loads(self.redis.values["test:a"]), {"v": 1})
+
+    def test_backend_errors_behave_like_misses(self):
+        class BrokenRedis:
+            def __getattr__(self, name):
+                raise ConnectionError("redis down")
+
+        cache = RedisCache(BrokenRedis(), namespace="test")
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["errors"], 2)
+
+
+class VerdictCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(full_name="Retry User", phone="254700000003")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_retried_check_returns_stored_verdict_without_insert(self):
+        payload = {
+            "user_id": "254700000003",
+            "pin": "1234",
+            "transaction": {"amount": 250, "recipient": "254722000000", "timestamp": "2025-02-01T11:00:00Z"},
+        }
+        first = self.client.post("/api/check-fraud", json=payload).get_json()
+        retry = self.client.post("/api/check-fraud", json=payload).get_json()
+
+        self.assertEqual(retry["transaction_id"], first["transaction_id"])
+        self.assertTrue(retry["cached"])
+        self.assertEqual(Transaction.query.count(), 1)
+
+        # A different transaction is scored and stored normally
+        payload["transaction"]["amount"] = 300
+        other = self.client.post("/api/check-fraud", json=payload).get_json()
+        self.assertNotIn("cached", other)
+        self.assertEqual(Transaction.query.count(), 2)
+
+
+class AnswerCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        reset_breakers()
+
+        user = User(full_name="Curious User", phone="254700000004")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_equivalent_questions_share_one_model_call(self):
+        with StubServer(completion_content="- Save KES 50 a day on M-Shwari") as stub, \
+                patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key", "OPENROUTER_BASE_URL": stub.openrouter_url}):
+            first = self.client.post("/api/ask-ai", json={"user_id": "254700000004", "question": "How do I save money?"})
+            again = self.client.post("/api/ask-ai", json={"user_id": "254700000004", "question": "  how do i SAVE money "})
+
+        self.assertEqual(again.get_json()["answer"], first.get_json()["answer"])
+        self.assertEqual(stub.calls[OPENROUTER_PATH], 1)
+        # Only the user lookup touches the database
+        self.assertIn('desc="1 queries"', again.headers["Server-Timing"])
+
+        stats = self.client.get("/api/health").get_json()["caches"]["ai_answer"]
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import patch
+
+from app import create_app, db
+from app.circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker, reset_breakers
+from app.fraud_detector import FraudDetector
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(
+            "test-model", window_seconds=60, min_calls=4, failure_rate_threshold=0.5,
+            open_seconds=30, slow_call_seconds=5, clock=self.clock,
+        )
+
+    def _fail(self, times=1):
+        for _ in range(times):
+            self.breaker.record_failure("boom")
+
+    def test_opens_when_error_rate_exceeds_threshold(self):
+        self.breaker.record_success(0.2)
+        self.breaker.record_success(0.2)
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: "never called")
+
+    def test_stays_closed_below_min_calls(self):
+        self._fail(3)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_old_outcomes_leave_the_window(self):
+        self._fail(3)
+        self.clock.now += 61
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.snapshot()["window_calls"], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        for _ in range(4):
+            self.breaker.record_success(6.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_admits_a_single_probe(self):
+        self._fail(4)
+        self.clock.now += 31
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        self.breaker.record_success(0.3)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self._fail(4)
+        self.clock.now += 31
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure("still down")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+
+class BreakerIntegrationTestCase(unittest.TestCase):
+    def setUp(self):
+        reset_breakers()
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        reset_breakers()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_open_primary_is_skipped_and_reported_on_health(self):
+        primary = get_breaker("primary-model")
+        for _ in range(primary.min_calls):
+            primary.record_failure("upstream 503")
+
+        detector = FraudDetector(api_key="test-key", primary_model="primary-model", fallback_model="backup-model")
+        reply = {"model": "backup-model", "choices": [{"message": {"content": "Stay disciplined."}}]}
+        with patch.object(FraudDetector, "_call_openrouter", return_value=reply) as call:
+            result = detector.get_mpesa_max_response("Hi")
+
+        self.assertEqual(result["model_used"], "backup-model")
+        self.assertEqual([args[0] for args, _ in call.call_args_list], ["backup-model"])
+
+        health = self.app.test_client().get("/api/health").get_json()
+        self.assertEqual(health["llm_circuits"]["primary-model"]["state"], CircuitBreaker.OPEN)
+        self.assertEqual(health["llm_circuits"]["backup-model"]["state"], CircuitBreaker.CLOSED)
+
+    def test_breakers_are_configured_from_app_config(self):
+        self.app.config.update(LLM_BREAKER_MIN_CALLS=2, LLM_BREAKER_OPEN_SECONDS=7, LLM_BREAKER_SLOW_CALL_SECONDS="")
+        breaker = get_breaker("configured-model")
+        self.assertEqual(breaker.min_calls, 2)
+        self.assertEqual(breaker.open_seconds, 7)
+        self.assertIsNone(breaker.slow_call_seconds)
+
+
+if __name__ == "__main__":
+    unittest.main()
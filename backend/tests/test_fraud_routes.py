@@ -0,0 +1,286 @@
+import json
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from flask import g, has_request_context
+
+from app import create_app, db, http_client
+from app.fraud_detector import FraudDetector
+from app.jobs import RedisJobQueue
+from app.models import User, Transaction
+from bench.stub_server import OPENROUTER_PATH, StubServer
+
+
+def _resolves_to(address):
+    return patch("app.jobs.socket.getaddrinfo", return_value=[(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, 0))])
+
+
+class ListRedis:
+    """Local stand-in for the redis-py calls made by RedisJobQueue."""
+
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.lists) if key.startswith(match.rstrip("*"))]
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def rpoplpush(self, source, destination):
+        if not self.lists.get(source):
+            return None
+        value = self.lists[source].pop()
+        self.lpush(destination, value)
+        return value
+
+    def brpoplpush(self, source, destination, timeout=0):
+        time.sleep(0.01)
+        return None
+
+
+class FraudRoutesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        for phone, pin in (("254700000010", "1111"), ("254700000011", "2222")):
+            user = User(full_name=f"User {phone}", phone=phone)
+            user.set_pin(pin)
+            db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @staticmethod
+    def _tx(amount, recipient="254722000000", timestamp="2025-02-01T11:00:00Z"):
+        return {"amount": amount, "recipient": recipient, "timestamp": timestamp}
+
+    def test_batch_reports_per_item_results_in_input_order(self):
+        items = [
+            {"user_id": "254700000010", "pin": "1111", "transaction": self._tx(200)},
+            {"user_id": "254700000011", "pin": "9999", "transaction": self._tx(300)},
+            {"user_id": "254700000011", "pin": "2222", "transaction": self._tx(-5)},
+            {"user_id": "254799999999", "pin": "1234", "transaction": self._tx(100)},
+            {"user_id": "254700000011", "pin": "2222", "transaction": self._tx(450, timestamp="2025-02-01T12:00:00Z")},
+            {"user_id": "254700000010", "pin": "1111", "transaction": self._tx(45000, timestamp="2025-02-01T03:00:00Z")},
+        ]
+        response = self.client.post("/api/check-fraud/batch", json={"items": items})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+
+        statuses = [(r["index"], r["status"], r.get("error")) for r in body["results"]]
+        self.assertEqual(statuses, [
+            (0, "ok", None),
+            (1, "error", "unauthorized"),
+            (2, "error", "bad_request"),
+            (3, "error", "not_found"),
+            # Same user as item 1 with a different PIN: the whole user is rejected
+            (4, "error", "unauthorized"),
+            (5, "ok", None),
+        ])
+        self.assertEqual(body["summary"], {"total": 6, "succeeded": 2, "failed": 4})
+        self.assertEqual(Transaction.query.count(), 2)
+        self.assertTrue(all("transaction_id" in r for r in body["results"] if r["status"] == "ok"))
+
+    def test_batch_allows_one_pin_attempt_per_user(self):
+        items = [{"user_id": "254700000010", "pin": f"{guess:04d}", "transaction": self._tx(100 + guess)}
+                 for guess in range(1100, 1120)]
+        with patch("app.models.User.check_pin", return_value=True) as check_pin:
+            response = self.client.post("/api/check-fraud/batch", json={"items": items})
+        body = response.get_json()
+        self.assertEqual(check_pin.call_count, 0)
+        self.assertEqual({r["error"] for r in body["results"]}, {"unauthorized"})
+        self.assertEqual(Transaction.query.count(), 0)
+
+    def test_batch_accepts_a_session_token_instead_of_pins(self):
+        token = self.client.post("/api/login", json={"phone": "254700000010", "pin": "1111"}).get_json()["token"]
+        items = [
+            {"user_id": "254700000010", "transaction": self._tx(200)},
+            {"user_id": "254700000011", "transaction": self._tx(300)},
+        ]
+        with patch("app.models.User.check_pin") as check_pin:
+            response = self.client.post("/api/check-fraud/batch", json={"items": items},
+                                        headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(check_pin.call_count, 0)
+        statuses = [(r["status"], r.get("error")) for r in response.get_json()["results"]]
+        self.assertEqual(statuses, [("ok", None), ("error", "unauthorized")])
+
+        response = self.client.post("/api/check-fraud/batch", json={"items": items},
+                                    headers={"Authorization": "Bearer not-a-token"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_batch_escalates_ambiguous_items_to_the_llm(self):
+        # A profile for the first user so the next payment to a new recipient is ambiguous
+        for day in range(1, 8):
+            self.client.post("/api/check-fraud", json={
+                "user_id": "254700000010", "pin": "1111",
+                "transaction": self._tx(200, timestamp=f"2025-01-0{day}T10:00:00Z"),
+            })
+
+        reply = {"choices": [{"message": {"content": '{"is_fraud": true, "confidence": 0.6, "reason": "llm"}'}}]}
+        items = [{"user_id": "254700000010", "pin": "1111",
+                  "transaction": self._tx(400, recipient="254733333333", timestamp="2025-01-09T10:00:00Z")}]
+        with patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key"}), \
+                patch.object(FraudDetector, "_call_openrouter", return_value=reply):
+            result = self.client.post("/api/check-fraud/batch", json={"items": items}).get_json()["results"][0]
+
+        self.assertEqual(result["routing"], "llm")
+        self.assertEqual(result["reason"], "llm")
+        self.assertTrue(result["is_fraud"])
+
+    def test_batch_escalations_reach_the_model_inside_the_request_context(self):
+        for day in range(1, 8):
+            self.client.post("/api/check-fraud", json={
+                "user_id": "254700000010", "pin": "1111",
+                "transaction": self._tx(200, timestamp=f"2025-01-0{day}T10:00:00Z"),
+            })
+        items = [{"user_id": "254700000010", "pin": "1111",
+                  "transaction": self._tx(400, recipient="254733333333", timestamp="2025-01-09T10:00:00Z")}]
+
+        seen = []
+        real_call = FraudDetector._call_openrouter
+
+        def call(detector, *args, **kwargs):
+            seen.append((has_request_context(), g.get("request_id")))
+            return real_call(detector, *args, **kwargs)
+
+        verdict = '{"is_fraud": true, "confidence": 0.6, "reason": "llm"}'
+        with StubServer(completion_content=verdict) as stub, \
+                patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key", "OPENROUTER_BASE_URL": stub.openrouter_url}), \
+                patch.object(FraudDetector, "_call_openrouter", call):
+            response = self.client.post("/api/check-fraud/batch", json={"items": items},
+                                        headers={"X-Request-ID": "batch-1"})
+
+        result = response.get_json()["results"][0]
+        self.assertEqual((result["routing"], result["reason"]), ("llm", "llm"))
+        self.assertEqual(stub.calls[OPENROUTER_PATH], 1)
+        self.assertEqual(seen, [(True, "batch-1")])
+
+    def _wait_for_job(self, status_url, key="webhook_status", timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.client.get(status_url, query_string={"user_id": "254700000010", "pin": "1111"}).get_json()
+            if job["status"] in ("succeeded", "failed") and key in job:
+                return job
+            time.sleep(0.02)
+        self.fail(f"job did not finish: {job}")
+
+    def test_async_check_returns_job_and_result_can_be_polled(self):
+        self.app.config["JOB_WEBHOOK_ALLOWED_HOSTS"] = "hooks.example"
+        payload = {"user_id": "254700000010", "pin": "1111", "transaction": self._tx(200), "async": True}
+        with patch("app.jobs.http_client.request_to_address") as webhook, _resolves_to("93.184.216.34"):
+            webhook.return_value.status_code = 200
+            response = self.client.post("/api/check-fraud", json=dict(payload, callback_url="http://hooks.example/fraud"))
+            self.assertEqual(response.status_code, 202)
+            body = response.get_json()
+            self.assertEqual(response.headers["Location"], body["status_url"])
+
+            job = self._wait_for_job(body["status_url"])
+            self.assertEqual(job["status"], "succeeded")
+            self.assertEqual(job["result"]["routing"], "local_low")
+            self.assertNotIn("payload", job)
+            self.assertEqual(Transaction.query.count(), 1)
+            self.assertEqual(job["webhook_status"], 200)
+            self.assertEqual(webhook.call_args.args, ("POST", "http://hooks.example/fraud", "93.184.216.34"))
+
+        unknown = self.client.get("/api/check-fraud/jobs/unknown", query_string={"user_id": "254700000010", "pin": "1111"})
+        self.assertEqual(unknown.status_code, 404)
+        bad_callback = self.client.post("/api/check-fraud", json=dict(payload, callback_url="file:///etc/passwd"))
+        self.assertEqual(bad_callback.status_code, 400)
+
+    def test_callbacks_are_refused_without_an_allow_list(self):
+        payload = {"user_id": "254700000010", "pin": "1111", "transaction": self._tx(200), "async": True,
+                   "callback_url": "http://169.254.169.254/latest/meta-data"}
+        response = self.client.post("/api/check-fraud", json=payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.query.count(), 0)
+
+    def test_callbacks_to_allowed_hosts_resolving_to_internal_addresses_are_refused(self):
+        self.app.config["JOB_WEBHOOK_ALLOWED_HOSTS"] = "hooks.example"
+        payload = {"user_id": "254700000010", "pin": "1111", "transaction": self._tx(200), "async": True,
+                   "callback_url": "http://hooks.example/fraud"}
+        for address in ("127.0.0.1", "169.254.169.254", "10.0.0.5"):
+            with patch("app.jobs.http_client.request_to_address") as webhook, _resolves_to(address):
+                status_url = self.client.post("/api/check-fraud", json=payload).get_json()["status_url"]
+                job = self._wait_for_job(status_url)
+            self.assertEqual(job["webhook_status"], "refused")
+            webhook.assert_not_called()
+
+    def test_job_status_is_only_shown_to_the_submitting_user(self):
+        payload = {"user_id": "254700000010", "pin": "1111", "transaction": self._tx(200), "async": True}
+        status_url = self.client.post("/api/check-fraud", json=payload).get_json()["status_url"]
+        self._wait_for_job(status_url, key="result")
+
+        self.assertEqual(self.client.get(status_url).status_code, 400)
+        wrong_pin = self.client.get(status_url, query_string={"user_id": "254700000010", "pin": "9999"})
+        self.assertEqual(wrong_pin.status_code, 401)
+        other_user = self.client.get(status_url, query_string={"user_id": "254700000011", "pin": "2222"})
+        self.assertEqual(other_user.status_code, 404)
+        bad_token = self.client.get(status_url, headers={"Authorization": "Bearer not-a-token"})
+        self.assertEqual(bad_token.status_code, 401)
+
+    def test_webhooks_are_sent_to_the_checked_address_with_the_original_host(self):
+        seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                seen.append((self.headers["Host"], self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(204)
+                self.end_headers()
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            # hooks.invalid never resolves, so only the pinned address can be reached
+            url = f"http://hooks.invalid:{server.server_port}/fraud"
+            resp = http_client.request_to_address("POST", url, "127.0.0.1", json={"id": "job-1"})
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(seen, [(f"hooks.invalid:{server.server_port}", b'{"id": "job-1"}')])
+
+    def test_redis_queue_requeues_jobs_abandoned_by_a_dead_worker(self):
+        redis = ListRedis()
+        job = {"id": "job-1", "status": "running", "started_at": "2025-02-01T11:00:00"}
+        redis.set("shieldai:jobs:job-1", json.dumps(job))
+        redis.lpush("shieldai:jobs:processing:dead", "job-1")
+        redis.lpush("shieldai:jobs:processing:alive", "job-2")
+        redis.set("shieldai:jobs:consumer:alive", 1)
+
+        queue = RedisJobQueue(self.app, redis, workers=0)
+        queue.stop()
+        self.assertEqual(redis.lists["shieldai:jobs:queue"], ["job-1"])
+        self.assertEqual(redis.lists["shieldai:jobs:processing:alive"], ["job-2"])
+        self.assertEqual(queue.get("job-1")["status"], "queued")
+
+
+if __name__ == "__main__":
+    unittest.main()
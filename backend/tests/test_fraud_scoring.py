@@ -0,0 +1,254 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlalchemy.orm import Session
+
+from app import create_app, db
+from app.circuit_breaker import reset_breakers
+from app.fraud_detector import FraudDetector
+from app.fraud_scoring import FeatureProfile, PreScore, RiskScorer
+from app.history_encoding import encode_history, estimate_tokens
+from app.models import User, Transaction, UserFeatureProfile
+
+
+def _student_history(days: int = 30):
+    """Thirty days of small daytime payments to a handful of regular recipients."""
+    base = datetime(2025, 1, 1, 10, 0)
+    recipients = ["254722000000", "254733111111", "254744222222"]
+    history = []
+    for day in range(days):
+        history.append({
+            "amount": 200.0 + (day % 5) * 50,
+            "recipient": recipients[day % len(recipients)],
+            "timestamp": (base + timedelta(days=day, hours=day % 4)).isoformat(),
+            "location": "Nairobi CBD",
+            "is_fraudulent": False,
+        })
+    return history
+
+
+class RiskScorerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.history = _student_history()
+        self.profile = FeatureProfile.from_history(self.history)
+        self.scorer = RiskScorer(low_threshold=0.3, high_threshold=0.8)
+
+    def test_profile_running_statistics(self):
+        amounts = [tx["amount"] for tx in self.history]
+        mean = sum(amounts) / len(amounts)
+        self.assertEqual(self.profile.count, len(amounts))
+        self.assertAlmostEqual(self.profile.amount_mean, mean)
+        self.assertTrue(self.profile.knows_recipient("254722000000"))
+        self.assertTrue(self.profile.knows_location("nairobi cbd"))
+
+    def test_profile_ignores_flagged_history(self):
+        history = self.history + [{
+            "amount": 45000.0, "recipient": "254799999999",
+            "timestamp": "2025-02-01T03:00:00", "is_fraudulent": True,
+        }]
+        profile = FeatureProfile.from_history(history)
+        self.assertEqual(profile.count, len(self.history))
+        self.assertFalse(profile.knows_recipient("254799999999"))
+
+    def test_routine_payment_is_cleared_locally(self):
+        tx = {"amount": 250, "recipient": "254733111111", "timestamp": "2025-02-01T11:00:00Z", "location": "Nairobi CBD"}
+        result = self.scorer.score(self.profile, tx)
+        self.assertEqual(result.decision, PreScore.LOCAL_LOW)
+
+    def test_large_night_payment_to_new_recipient_is_flagged_locally(self):
+        tx = {"amount": 45000, "recipient": "254799999999", "timestamp": "2025-02-01T03:15:00Z"}
+        result = self.scorer.score(self.profile, tx)
+        self.assertEqual(result.decision, PreScore.LOCAL_HIGH)
+        self.assertEqual(result.indicators["amount"], 1.0)
+
+    def test_new_recipient_alone_is_escalated(self):
+        tx = {"amount": 300, "recipient": "254700888888", "timestamp": "2025-02-01T11:00:00Z", "location": "Nairobi CBD"}
+        result = self.scorer.score(self.profile, tx)
+        self.assertEqual(result.decision, PreScore.ESCALATE)
+
+
+class FraudDetectorRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.history = _student_history()
+        self.detector = FraudDetector(api_key="test-key", low_risk_threshold=0.3, high_risk_threshold=0.8)
+
+    def test_conclusive_cases_skip_the_llm(self):
+        tx = {"amount": 250, "recipient": "254733111111", "timestamp": "2025-02-01T11:00:00Z", "location": "Nairobi CBD"}
+        with patch.object(FraudDetector, "_call_openrouter") as call:
+            result = self.detector.detect_fraud(self.history, tx)
+        call.assert_not_called()
+        self.assertFalse(result["is_fraud"])
+        self.assertEqual(result["routing"], PreScore.LOCAL_LOW)
+        self.assertIn("risk_score", result)
+
+    def test_ambiguous_cases_are_escalated(self):
+        tx = {"amount": 300, "recipient": "254700888888", "timestamp": "2025-02-01T11:00:00Z", "location": "Nairobi CBD"}
+        llm_reply = {"choices": [{"message": {"content": '{"is_fraud": false, "confidence": 0.2, "reason": "ok"}'}}]}
+        with patch.object(FraudDetector, "_call_openrouter", return_value=llm_reply) as call:
+            result = self.detector.detect_fraud(self.history, tx)
+        call.assert_called_once()
+        self.assertEqual(result["routing"], PreScore.ESCALATE)
+        self.assertEqual(result["reason"], "ok")
+
+
+class HistoryEncodingTestCase(unittest.TestCase):
+    def test_rows_are_dictionary_encoded(self):
+        encoded = encode_history(_student_history(6))
+        self.assertIn("HISTORY_SUMMARY: n=6", encoded)
+        self.assertIn("RECIPIENTS: R1=", encoded)
+        self.assertNotIn("fraud_confidence", encoded)
+        self.assertEqual(encoded.count("|R"), 6)
+
+    def test_budget_trims_oldest_rows_deterministically(self):
+        history = _student_history(200)
+        encoded = encode_history(history, token_budget=300)
+        self.assertLessEqual(estimate_tokens(encoded), 300)
+        self.assertEqual(encoded, encode_history(list(reversed(history)), token_budget=300))
+        # The newest transaction survives trimming, the oldest does not
+        self.assertIn(history[-1]["timestamp"][:16], encoded)
+        self.assertNotIn(history[0]["timestamp"][:16], encoded)
+        self.assertIn("n=200", encoded)
+
+
+class HedgedRequestTestCase(unittest.TestCase):
+    def setUp(self):
+        reset_breakers()
+        self.detector = FraudDetector(
+            api_key="test-key", primary_model="slow-model", fallback_model="fast-model", hedge_delay=0.05,
+        )
+
+    def _fake_call(self, model, prompt):
+        if model == "slow-model":
+            time.sleep(0.5)
+        return {"model": model, "choices": [{"message": {"content": f"answer from {model}"}}]}
+
+    def test_fallback_wins_when_primary_is_slow(self):
+        with patch.object(FraudDetector, "_call_openrouter", side_effect=self._fake_call):
+            start = time.monotonic()
+            result = self.detector.get_mpesa_max_response("How do I save?")
+            elapsed = time.monotonic() - start
+        self.assertEqual(result["model_used"], "fast-model")
+        self.assertLess(elapsed, 0.4)
+
+    def test_primary_answers_within_delay_without_hedging(self):
+        self.detector.hedge_delay = 1.0
+        with patch.object(FraudDetector, "_call_openrouter", side_effect=self._fake_call) as call:
+            self.detector.primary_model, self.detector.fallback_model = "fast-model", "slow-model"
+            result = self.detector.get_mpesa_max_response("How do I save?")
+        self.assertEqual(result["model_used"], "fast-model")
+        self.assertEqual(call.call_count, 1)
+
+    def test_delay_is_read_from_app_config(self):
+        app = create_app("testing")
+        app.config["OPENROUTER_HEDGE_DELAY"] = "p95"
+        with app.app_context():
+            self.assertEqual(FraudDetector(api_key="test-key").hedge_delay, "p95")
+
+
+class FeatureStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(full_name="Store User", phone="254700000001")
+        self.user.set_pin("1234")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _add_history(self, history):
+        for tx in history:
+            db.session.add(Transaction(
+                user_id=self.user.id,
+                amount=tx["amount"],
+                recipient=tx["recipient"],
+                timestamp=datetime.fromisoformat(tx["timestamp"]),
+                location=tx["location"],
+            ))
+            db.session.commit()
+
+    def test_profile_is_updated_on_commit(self):
+        history = _student_history(10)
+        self._add_history(history)
+
+        row = db.session.get(UserFeatureProfile, self.user.id)
+        self.assertIsNotNone(row)
+        self.assertEqual(row.version, 10)
+        expected = FeatureProfile.from_history(history)
+        self.assertEqual(row.tx_count, expected.count)
+        self.assertAlmostEqual(row.amount_mean, expected.amount_mean)
+        self.assertAlmostEqual(row.amount_m2, expected.amount_m2)
+        self.assertEqual(row.hour_histogram, expected.hour_histogram)
+
+    def test_rebuild_matches_incremental_profile(self):
+        self._add_history(_student_history(12))
+        incremental = db.session.get(UserFeatureProfile, self.user.id).to_dict()
+
+        self.assertEqual(UserFeatureProfile.rebuild(), 1)
+        db.session.expire_all()
+        rebuilt = db.session.get(UserFeatureProfile, self.user.id).to_dict()
+
+        for key in ("tx_count", "hour_histogram", "known_recipients", "known_locations", "version"):
+            self.assertEqual(rebuilt[key], incremental[key])
+        self.assertAlmostEqual(rebuilt["amount_mean"], incremental["amount_mean"])
+
+    def test_first_profile_insert_tolerates_a_concurrent_insert(self):
+        history = _student_history(3)
+        self._add_history(history[:2])
+        real_get = Session.get
+        misses = []
+
+        def get(session, entity, ident, **kwargs):
+            # The first lookup misses, as if another transaction inserted the profile just after it
+            if entity is UserFeatureProfile and not misses:
+                misses.append(ident)
+                return None
+            return real_get(session, entity, ident, **kwargs)
+
+        with patch.object(Session, "get", get):
+            self._add_history(history[2:])
+
+        self.assertEqual(misses, [self.user.id])
+        db.session.expire_all()
+        self.assertEqual(Transaction.query.count(), 3)
+        self.assertEqual(db.session.get(UserFeatureProfile, self.user.id).version, 3)
+
+    def test_profile_update_counts_transactions_committed_since_it_was_loaded(self):
+        history = _student_history(3)
+        self._add_history(history[:1])
+        # The request loads the profile (e.g. for the prescore) and holds it across a slow model call
+        loaded = db.session.get(UserFeatureProfile, self.user.id)
+        self.assertEqual(loaded.tx_count, 1)
+
+        with db.session.session_factory() as other:
+            tx = history[1]
+            other.add(Transaction(user_id=self.user.id, amount=tx["amount"], recipient=tx["recipient"],
+                                  timestamp=datetime.fromisoformat(tx["timestamp"]), location=tx["location"]))
+            other.commit()
+
+        self._add_history(history[2:])
+        db.session.expire_all()
+        profile = db.session.get(UserFeatureProfile, self.user.id)
+        self.assertIs(profile, loaded)
+        self.assertEqual(Transaction.query.count(), 3)
+        self.assertEqual((profile.tx_count, profile.version), (3, 3))
+
+    def test_mixed_naive_and_aware_timestamps_in_one_flush(self):
+        db.session.add(Transaction(user_id=self.user.id, amount=100, recipient="254722000000",
+                                   timestamp=datetime(2025, 2, 1, 10, 0)))
+        db.session.add(Transaction(user_id=self.user.id, amount=200, recipient="254722000000",
+                                   timestamp=datetime(2025, 2, 1, 12, 0, tzinfo=timezone.utc)))
+        db.session.commit()
+        self.assertEqual(db.session.get(UserFeatureProfile, self.user.id).tx_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import asyncio
+import io
+import json
+import logging
+import unittest
+from unittest.mock import patch
+
+from app import create_app, db
+from app.asgi import AsgiApp
+from app.log_pipeline import _QueueHandler, setup_logging
+from app.models import User
+from bench.stub_server import StubServer
+
+
+class LogPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config.update(LOG_PAYLOAD_SAMPLE_RATE=1, LOG_PAYLOAD_MAX_CHARS=40)
+        self.output = io.StringIO()
+        setup_logging(self.app, [logging.StreamHandler(self.output)])
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _records(self):
+        # Stopping the writer thread flushes what is queued
+        for handler in self.app.logger.handlers:
+            if isinstance(handler, _QueueHandler):
+                handler.pipeline.stop()
+        return [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    def test_callback_records_carry_request_id_duration_and_truncated_payload(self):
+        callback = {"Body": {"stkCallback": {
+            "MerchantRequestID": "mr-1", "CheckoutRequestID": "ws_CO_1", "ResultCode": 1032,
+            "ResultDesc": "Request cancelled by user",
+        }}}
+        response = self.client.post("/api/callback", json=callback, headers={"X-Request-ID": "req-42"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Request-ID"], "req-42")
+
+        received, completed = self._records()
+        self.assertEqual(received["message"], "M-Pesa callback received: CheckoutRequestID=ws_CO_1")
+        self.assertEqual(received["request_id"], "req-42")
+        self.assertTrue(received["payload"].endswith("chars truncated]"))
+        self.assertEqual(completed["request_id"], "req-42")
+        self.assertEqual(completed["status"], 200)
+        self.assertIn("duration_ms", completed)
+
+    def test_asgi_model_routes_carry_the_request_id_across_stages(self):
+        user = User(full_name="Logged User", phone="254700000080")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.commit()
+        asgi = AsgiApp(self.app, db_threads=2, wsgi_threads=2)
+        body = json.dumps({"user_id": "254700000080", "question": "How do I save?"}).encode()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/ask-ai", "raw_path": b"/api/ask-ai", "query_string": b"", "root_path": "",
+            "headers": [(b"content-type", b"application/json"), (b"x-request-id", b"req-asgi")],
+            "client": ("127.0.0.1", 5000), "server": ("testserver", 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        with StubServer(latency=0.05, completion_content="Save a little daily") as stub, \
+                patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key", "OPENROUTER_BASE_URL": stub.openrouter_url}):
+            asyncio.run(asgi(scope, receive, send))
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(dict(sent[0]["headers"])[b"x-request-id"], b"req-asgi")
+        completed = [r for r in self._records() if "status" in r]
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(completed[0]["request_id"], "req-asgi")
+        self.assertEqual(completed[0]["path"], "/api/ask-ai")
+        # Timed from the first stage, so the model call is included
+        self.assertGreaterEqual(completed[0]["duration_ms"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
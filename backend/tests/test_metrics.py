@@ -0,0 +1,95 @@
+import unittest
+from collections import defaultdict
+
+from app import create_app, db
+from app.metrics import REGISTRY, RedisMetricsStore, render, timed
+from app.models import User
+
+
+class HashRedis:
+    """Local stand-in for the redis-py hash calls made by RedisMetricsStore."""
+
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+
+    def hincrbyfloat(self, key, field, amount):
+        self.hashes[key][field] = self.hashes[key].get(field, 0.0) + amount
+
+    def hset(self, key, field, value):
+        self.hashes[key][field] = value
+
+    def hgetall(self, key):
+        return {field.encode(): str(value).encode() for field, value in self.hashes[key].items()}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        REGISTRY.reset()
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(full_name="Metered", phone="254700000070")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_routes_and_dependencies_are_exposed(self):
+        self.client.post("/api/check-fraud", json={
+            "user_id": "254700000070", "pin": "1234",
+            "transaction": {"amount": 100, "recipient": "254722000000", "timestamp": "2025-02-01T11:00:00Z"},
+        })
+        self.client.get("/api/users/254700000070/transactions?pin=0000")
+
+        @timed("openrouter")
+        def failing_call():
+            raise RuntimeError("upstream down")
+
+        with self.assertRaises(RuntimeError):
+            failing_call()
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.mimetype, "text/plain")
+        text = response.get_data(as_text=True)
+        self.assertIn('shieldai_http_requests_total{endpoint="api.check_fraud",method="POST",status="200"} 1', text)
+        self.assertIn('status="401"} 1', text)
+        self.assertIn('shieldai_http_request_duration_seconds_bucket{endpoint="api.check_fraud",method="POST",le="+Inf"} 1',
+                      text)
+        self.assertIn('shieldai_dependency_duration_seconds_count{dependency="pin_hash"} 2', text)
+        self.assertIn('shieldai_dependency_duration_seconds_count{dependency="db"}', text)
+        self.assertIn('shieldai_dependency_errors_total{dependency="openrouter"} 1', text)
+        self.assertNotIn('endpoint="metrics"', text)
+
+    def test_redis_store_sums_increments_from_every_worker(self):
+        store = RedisMetricsStore(HashRedis())
+        for _ in range(3):  # three workers flushing their own counts
+            REGISTRY.reset()
+            REGISTRY.inc("shieldai_http_requests_total", {"endpoint": "api.health", "method": "GET", "status": "200"}, 2)
+            REGISTRY.observe("shieldai_dependency_duration_seconds", {"dependency": "db"}, 0.02)
+            store.push(REGISTRY.take_pending())
+        for age in (30.0, 12.5):  # a gauge keeps the last value pushed
+            REGISTRY.set("shieldai_mpesa_reconcile_oldest_pending_age_seconds", {}, age)
+            store.push({}, REGISTRY.take_gauges())
+
+        text = render(store.read())
+        self.assertIn('shieldai_http_requests_total{endpoint="api.health",method="GET",status="200"} 6', text)
+        self.assertIn('shieldai_dependency_duration_seconds_bucket{dependency="db",le="0.01"} 0', text)
+        self.assertIn('shieldai_dependency_duration_seconds_bucket{dependency="db",le="0.025"} 3', text)
+        self.assertIn("shieldai_mpesa_reconcile_oldest_pending_age_seconds 12.5", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
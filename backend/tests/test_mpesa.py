@@ -0,0 +1,269 @@
+import itertools
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from app import create_app, db
+from app.metrics import REGISTRY
+from app.models import User
+from app.mpesa.callback_queue import drain_callbacks
+from app.mpesa.models import MpesaCallbackInbox, MpesaTransaction
+from app.mpesa.mpesa_service import MpesaService
+from app.mpesa.reconciler import MpesaReconciler, RateLimiter, get_reconciler
+from app.mpesa.token_cache import RedisAccessTokenCache
+from bench.stub_server import StubServer
+
+OAUTH_PATH = "/oauth/v1/generate"
+
+
+def mpesa_env(stub):
+    return {
+        "MPESA_CONSUMER_KEY": "key",
+        "MPESA_CONSUMER_SECRET": "secret",
+        "MPESA_BUSINESS_SHORTCODE": "174379",
+        "MPESA_PASSKEY": "passkey",
+        "MPESA_CALLBACK_URL": "https://example.test/api/mpesa/callback",
+        "MPESA_BASE_URL": stub.url,
+    }
+
+
+class LockingRedis:
+    """Local stand-in for the redis-py calls made by RedisAccessTokenCache."""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.values.get(key)
+            return entry[0].encode() if entry and entry[1] > time.time() else None
+
+    def ttl(self, key):
+        with self.lock:
+            entry = self.values.get(key)
+            return int(entry[1] - time.time()) if entry else -2
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            entry = self.values.get(key)
+            if nx and entry and entry[1] > time.time():
+                return None
+            self.values[key] = (value, time.time() + (ex or 3600))
+            return True
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+
+    def _hammer(self, threads, target):
+        workers = [threading.Thread(target=target) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def test_concurrent_requests_share_one_oauth_call(self):
+        with StubServer(latency=0.05) as stub, patch.dict("os.environ", mpesa_env(stub)):
+            def push():
+                with self.app.app_context():
+                    # A fresh service per request, as the routes do
+                    MpesaService().make_api_request("POST", f"{stub.url}/mpesa/stkpushquery/v1/query",
+                                                    {"CheckoutRequestID": "ws_CO_1"})
+
+            self._hammer(16, push)
+
+        self.assertEqual(stub.calls[OAUTH_PATH], 1)
+        self.assertEqual(stub.calls["/mpesa/stkpushquery/v1/query"], 16)
+
+    def test_redis_backend_shares_the_token_between_workers(self):
+        redis = LockingRedis()
+        # One cache per simulated gunicorn worker
+        workers = [RedisAccessTokenCache(redis, poll_interval=0.01) for _ in range(4)]
+        fetched = []
+
+        def fetch():
+            time.sleep(0.05)
+            fetched.append(1)
+            return "shared-token", 3599
+
+        tokens, ids = [], itertools.count()
+        self._hammer(12, lambda: tokens.append(workers[next(ids) % 4].get("creds", fetch)))
+
+        self.assertEqual(len(fetched), 1)
+        self.assertEqual(set(tokens), {"shared-token"})
+
+        # A worker that sees a 401 drops the shared token and fetches a new one
+        workers[0].invalidate("creds")
+        self.assertEqual(workers[0].get("creds", lambda: ("new-token", 3599)), "new-token")
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt="QK123ABC"):
+    callback = {"MerchantRequestID": "mr-1", "CheckoutRequestID": checkout_request_id,
+                "ResultCode": result_code, "ResultDesc": "Processed"}
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [{"Name": "Amount", "Value": 100},
+                                                 {"Name": "MpesaReceiptNumber", "Value": receipt}]}
+    return {"Body": {"stkCallback": callback}}
+
+
+class CallbackQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["MPESA_CALLBACK_CONSUMER"] = "none"
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(full_name="Payer", phone="254700000050")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([
+            MpesaTransaction(user_id=user.id, checkout_request_id=f"ws_CO_{i}", amount=100,
+                             phone_number="254700000050", account_reference="Shield", status="pending")
+            for i in range(2)
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_callbacks_are_acknowledged_then_applied_once_in_a_batch(self):
+        for payload in (stk_callback("ws_CO_0"), stk_callback("ws_CO_0"),
+                        stk_callback("ws_CO_1", result_code=1032), stk_callback("ws_CO_missing")):
+            response = self.client.post("/api/callback", json=payload)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post("/api/callback", json={"Body": {}}).status_code, 400)
+
+        # Nothing is applied until the consumer runs
+        self.assertEqual(MpesaCallbackInbox.query.count(), 4)
+        self.assertEqual(MpesaTransaction.get_by_checkout_request_id("ws_CO_0").status, "pending")
+
+        self.assertEqual(drain_callbacks(batch_size=2), 4)
+        paid = MpesaTransaction.get_by_checkout_request_id("ws_CO_0")
+        self.assertEqual((paid.status, paid.mpesa_receipt_number), ("completed", "QK123ABC"))
+        self.assertEqual(MpesaTransaction.get_by_checkout_request_id("ws_CO_1").status, "cancelled")
+
+        # The unknown checkout is retried later rather than dropped
+        missing = MpesaCallbackInbox.query.filter_by(checkout_request_id="ws_CO_missing").one()
+        self.assertIsNone(missing.processed_at)
+        self.assertEqual((missing.attempts, missing.result_status), (1, 404))
+        self.assertGreater(missing.available_at, datetime.utcnow())
+        self.assertEqual(drain_callbacks(), 0)
+
+
+class ReconcilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config.update(MPESA_RECONCILE_CHUNK_SIZE=3, MPESA_RECONCILE_RATE_PER_SECOND=200,
+                               MPESA_RECONCILE_MIN_AGE_SECONDS=60)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(full_name="Payer", phone="254700000060")
+        user.set_pin("1234")
+        db.session.add(user)
+        db.session.flush()
+        stale = datetime.utcnow() - timedelta(minutes=10)
+        rows = [(f"ws_CO_{i}", "pending", stale) for i in range(7)]
+        rows += [("ws_CO_fresh", "pending", datetime.utcnow()), ("ws_CO_done", "completed", stale)]
+        db.session.add_all([
+            MpesaTransaction(user_id=user.id, checkout_request_id=cid, amount=100, phone_number="254700000060",
+                             account_reference="Shield", status=status, created_at=created_at)
+            for cid, status, created_at in rows
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @staticmethod
+    def _daraja(checkout_request_id):
+        if checkout_request_id == "ws_CO_3":
+            return 500, {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"}
+        code, desc = {"ws_CO_1": ("1032", "Request cancelled by user"),
+                      "ws_CO_2": ("2001", "The initiator information is invalid.")}.get(
+            checkout_request_id, ("0", "The service request is processed successfully."))
+        return 200, {"ResponseCode": "0", "CheckoutRequestID": checkout_request_id, "ResultCode": code, "ResultDesc": desc}
+
+    def test_stale_pending_transactions_are_resolved_through_daraja(self):
+        REGISTRY.reset()
+        with StubServer(stk_query_result=self._daraja) as stub, patch.dict("os.environ", mpesa_env(stub)):
+            run = get_reconciler().run_once()
+
+        self.assertEqual(stub.calls["/mpesa/stkpushquery/v1/query"], 7)
+        self.assertEqual(stub.calls[OAUTH_PATH], 1)
+        # "Being processed" is a pending checkout, not a failed query
+        self.assertEqual((run["checked"], run["resolved"], run["still_pending"], run["errors"]), (7, 6, 1, 0))
+
+        statuses = {tx.checkout_request_id: tx.status for tx in MpesaTransaction.query}
+        self.assertEqual(statuses["ws_CO_0"], "completed")
+        self.assertEqual(statuses["ws_CO_1"], "cancelled")
+        self.assertEqual(statuses["ws_CO_2"], "failed")
+        self.assertEqual(statuses["ws_CO_3"], "pending")
+        self.assertEqual(statuses["ws_CO_fresh"], "pending")
+        self.assertGreater(run["oldest_pending_age_seconds"], 500)
+
+        # A late callback for a reconciled checkout does not change it again
+        self.app.config["MPESA_CALLBACK_MODE"] = "sync"
+        self.client.post("/api/callback", json=stk_callback("ws_CO_1"))
+        self.assertEqual(MpesaTransaction.get_by_checkout_request_id("ws_CO_1").status, "cancelled")
+
+        metrics = self.client.get("/api/health").get_json()["mpesa_reconciler"]
+        self.assertEqual(metrics["resolved"], {"completed": 4, "failed": 1, "cancelled": 1})
+        self.assertEqual(metrics["last_run"]["checked"], 7)
+
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('shieldai_mpesa_reconcile_checked_total{outcome="completed"} 4', text)
+        self.assertIn('shieldai_mpesa_reconcile_checked_total{outcome="still_pending"} 1', text)
+        self.assertIn("shieldai_mpesa_reconcile_runs_total 1", text)
+        self.assertIn("# TYPE shieldai_mpesa_reconcile_oldest_pending_age_seconds gauge", text)
+
+    def test_callback_applied_during_the_query_is_not_overwritten(self):
+        real_query = MpesaReconciler._query
+
+        def query(reconciler, service, checkout_request_id):
+            answer = real_query(reconciler, service, checkout_request_id)
+            if checkout_request_id == "ws_CO_0":
+                # The consumer applies the real callback while the reconciler waits on Daraja
+                with self.app.app_context():
+                    tx = MpesaTransaction.get_by_checkout_request_id("ws_CO_0")
+                    tx.status, tx.mpesa_receipt_number, tx.callback_data = "completed", "REALRCPT", "callback"
+                    db.session.commit()
+            return answer
+
+        with StubServer(stk_query_result=self._daraja) as stub, patch.dict("os.environ", mpesa_env(stub)), \
+                patch.object(MpesaReconciler, "_query", query):
+            run = get_reconciler().run_once()
+
+        self.assertEqual((run["resolved"], run["already_resolved"]), (5, 1))
+        db.session.expire_all()
+        tx = MpesaTransaction.get_by_checkout_request_id("ws_CO_0")
+        self.assertEqual((tx.mpesa_receipt_number, tx.callback_data), ("REALRCPT", "callback"))
+
+    def test_rate_limiter_spaces_queries(self):
+        now, waits = [0.0], []
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=waits.append)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(waits, [0.25, 0.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import User, Transaction
+from app.pagination import decode_cursor, encode_cursor
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(full_name="Paging User", phone="254700000020")
+        self.user.set_pin("1234")
+        db.session.add(self.user)
+        db.session.flush()
+        # Pairs of rows share a timestamp so the id tie-break is exercised
+        start = datetime(2025, 1, 1, 9, 0)
+        db.session.add_all([
+            Transaction(user_id=self.user.id, amount=100 + i, recipient="254722000000",
+                        timestamp=start + timedelta(hours=i // 2))
+            for i in range(7)
+        ])
+        db.session.commit()
+        self.url = "/api/users/254700000020/transactions?pin=1234&limit=3"
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cursor_pages_cover_every_row_once_despite_new_inserts(self):
+        first = self.client.get(self.url).get_json()
+        self.assertEqual(len(first["transactions"]), 3)
+
+        # A row arriving mid-scroll must not shift the following pages
+        db.session.add(Transaction(user_id=self.user.id, amount=999, recipient="254722000000",
+                                   timestamp=datetime(2025, 2, 1)))
+        db.session.commit()
+
+        seen = [tx["id"] for tx in first["transactions"]]
+        cursor = first["next_cursor"]
+        while cursor:
+            page = self.client.get(f"{self.url}&cursor={cursor}").get_json()
+            seen.extend(tx["id"] for tx in page["transactions"])
+            cursor = page["next_cursor"]
+        self.assertEqual(sorted(seen), list(range(1, 8)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_offset_mode_and_cursor_validation(self):
+        legacy = self.client.get(f"{self.url}&offset=3").get_json()
+        self.assertNotIn("next_cursor", legacy)
+        self.assertEqual([tx["id"] for tx in legacy["transactions"]], [4, 3, 2])
+
+        self.assertEqual(self.client.get(f"{self.url}&cursor=not-a-cursor").status_code, 400)
+        self.assertEqual(decode_cursor(encode_cursor(datetime(2025, 1, 1, 9), 5)), (datetime(2025, 1, 1, 9), 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import User, Transaction, UserFeatureProfile, UserSpendingDaily
+from app.mpesa.models import MpesaTransaction
+from app.seed_data import generate_synthetic_data, seed_database
+
+
+class SpendingAggregatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(full_name="Spender", phone="254700000040")
+        self.user.set_pin("1234")
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _add(self, amount, recipient, days_ago):
+        db.session.add(Transaction(user_id=self.user.id, amount=amount, recipient=recipient,
+                                   timestamp=datetime.utcnow() - timedelta(days=days_ago)))
+
+    def _rows(self):
+        return sorted((r.day, r.recipient, r.total_amount, r.tx_count) for r in UserSpendingDaily.query.all())
+
+    def test_inserts_maintain_daily_buckets_and_rolling_windows(self):
+        self._add(100, "254722000001", 0)
+        self._add(50, "254722000001", 0)
+        self._add(300, "254722000002", 10)
+        db.session.commit()
+        # A later commit adds to the existing bucket
+        self._add(25, "254722000001", 0)
+        self._add(900, "254722000003", 60)
+        db.session.commit()
+
+        today = datetime.utcnow().date()
+        self.assertIn((today, "254722000001", 175.0, 3), self._rows())
+
+        week, month, quarter = UserSpendingDaily.summary(self.user.id, top=2)
+        self.assertEqual((week["total_spent"], week["transaction_count"]), (175.0, 3))
+        self.assertEqual((month["total_spent"], month["transaction_count"]), (475.0, 4))
+        self.assertEqual(quarter["total_spent"], 1375.0)
+        self.assertEqual([r["recipient"] for r in quarter["top_recipients"]], ["254722000003", "254722000002"])
+
+        # Rebuilding from the transactions table gives the same rows
+        incremental = self._rows()
+        UserSpendingDaily.rebuild()
+        self.assertEqual(self._rows(), incremental)
+
+    def test_spending_summary_endpoint(self):
+        self._add(120, "254722000001", 3)
+        db.session.commit()
+
+        response = self.client.get("/api/users/254700000040/spending-summary?pin=1234&days=7,30")
+        self.assertEqual(response.status_code, 200)
+        windows = response.get_json()["windows"]
+        self.assertEqual([w["days"] for w in windows], [7, 30])
+        self.assertEqual(windows[0]["top_recipients"], [{"recipient": "254722000001", "amount": 120.0, "count": 1}])
+
+        self.assertEqual(self.client.get("/api/users/254700000040/spending-summary?pin=0000").status_code, 401)
+        self.assertEqual(self.client.get("/api/users/254700000040/spending-summary?pin=1234&days=0").status_code, 400)
+
+    def test_synthetic_data_appends_users_with_history(self):
+        report = generate_synthetic_data(users=5, days=3, chunk_users=2, seed=3, stk_per_day=1)
+
+        self.assertEqual(report["chunks"], 3)
+        self.assertEqual(User.query.count(), 6)
+        self.assertEqual(Transaction.query.count(), report["transactions"])
+        self.assertEqual(MpesaTransaction.query.count(), report["mpesa_transactions"])
+        synthetic = User.query.filter(User.id > self.user.id).order_by(User.id).first()
+        self.assertTrue(synthetic.check_pin("0000"))
+        # Daily aggregates were rebuilt from the generated rows
+        self.assertEqual(db.session.query(db.func.sum(UserSpendingDaily.tx_count)).scalar(), report["transactions"])
+
+    def test_demo_seed_builds_profiles_and_aggregates(self):
+        # The seeder bulk-deletes users, which would leave setUp's user in the identity map
+        db.session.expunge_all()
+        seed_database()
+        users = User.query.count()
+        self.assertEqual(UserFeatureProfile.query.count(), users)
+        # Profiles learn from legitimate transactions only
+        self.assertEqual(db.session.query(db.func.sum(UserFeatureProfile.tx_count)).scalar(),
+                         Transaction.query.filter_by(is_fraudulent=False).count())
+        self.assertEqual(db.session.query(db.func.sum(UserSpendingDaily.tx_count)).scalar(), Transaction.query.count())
+
+
+if __name__ == "__main__":
+    unittest.main()
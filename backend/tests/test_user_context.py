@@ -0,0 +1,97 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from app import create_app, db
+from app.models import User, Transaction, UserBudgetPlan
+from app.circuit_breaker import reset_breakers
+from app.fraud_detector import FraudDetector
+from app.user_context import load_user_context
+from bench.stub_server import StubServer
+
+
+class UserContextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(full_name="Context User", phone="254700000030", mpesa_balance=1250.5)
+        self.user.set_pin("1234")
+        db.session.add(self.user)
+        db.session.flush()
+        now = datetime.utcnow()
+        db.session.add_all([
+            Transaction(user_id=self.user.id, amount=100 + i, recipient=f"25472200000{i % 3}",
+                        timestamp=now - timedelta(days=4 * i), location="Nairobi" if i % 2 else None)
+            for i in range(14)
+        ])
+        db.session.add(UserBudgetPlan(id="plan-1", user_id=self.user.id, plan_name="Main", monthly_income=20000,
+                                      allocations={"Food": 5000}, savings_period_months=6, is_active=True))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_matches_the_separate_queries(self):
+        context = load_user_context("254700000030")
+
+        self.assertEqual(context.user_id, self.user.id)
+        self.assertEqual(context.mpesa_balance, 1250.5)
+        recent = Transaction.query.filter_by(user_id=self.user.id)\
+            .order_by(Transaction.timestamp.desc()).limit(10).all()
+        self.assertEqual(context.recent_transactions, [tx.to_dict() for tx in recent])
+        self.assertEqual(context.active_plan, db.session.get(UserBudgetPlan, "plan-1").to_dict())
+
+        # Last 30 days are transactions 0..7
+        expected = {}
+        for i in range(8):
+            recipient = f"25472200000{i % 3}"
+            expected[recipient] = expected.get(recipient, 0) + 100 + i
+        self.assertEqual(context.spending_patterns,
+                         [{"recipient": r, "amount": float(a)} for r, a in sorted(expected.items(), key=lambda i: -i[1])])
+        self.assertIsNone(load_user_context("254799999999"))
+
+    def test_mpesa_max_reads_context_in_one_query(self):
+        response = self.client.post("/api/mpesa-max", json={"user_id": "254700000030", "query": "How am I doing?"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="1 queries"', response.headers["Server-Timing"])
+
+    def test_mpesa_max_stream_forwards_tokens_and_assembles_answer(self):
+        reset_breakers()
+        answer = "Your KES 1250 balance is one emergency away from zero."
+        with StubServer(completion_content=answer) as stub, \
+                patch.dict("os.environ", {"OPENROUTER_API_KEY": "test-key", "OPENROUTER_BASE_URL": stub.openrouter_url}):
+            response = self.client.post("/api/mpesa-max/stream",
+                                        json={"user_id": "254700000030", "query": "How am I doing?"})
+            body = response.get_data(as_text=True)
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = [block.split("\n", 1) for block in body.strip().split("\n\n")]
+        tokens = [json.loads(data[len("data: "):])["content"] for kind, data in events if kind == "event: token"]
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(events[-1][0], "event: done")
+        done = json.loads(events[-1][1][len("data: "):])
+        self.assertEqual(done["answer"], answer)
+        self.assertEqual("".join(tokens), answer)
+        self.assertIsNotNone(done["time_to_first_token_ms"])
+
+    def test_mpesa_max_persona_is_a_cacheable_system_message(self):
+        detector = FraudDetector(api_key="test-key", prompt_cache=True)
+        first = detector._build_mpesa_max_messages("Hi", {"mpesa_balance": 10})
+        second = detector._build_mpesa_max_messages("Is Bitcoin good?", {"mpesa_balance": 99})
+
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(first[0]["content"][0]["cache_control"], {"type": "ephemeral"})
+        self.assertEqual(second[1], {"role": "user", "content": "User Query: Is Bitcoin good?\nCurrent M-Pesa Balance: KES 99"})
+        self.assertIsInstance(FraudDetector(api_key="test-key", prompt_cache=False)
+                              ._build_mpesa_max_messages("Hi")[0]["content"], str)
+
+
+if __name__ == "__main__":
+    unittest.main()